@@ -13,9 +13,10 @@
 """ Base class for SAML2Plugins-based PAS plugins
 """
 
-import copy
+import heapq
 import logging
 import time
+import types
 import urllib
 import uuid
 
@@ -23,6 +24,7 @@ from AccessControl import ClassSecurityInfo
 from AccessControl.class_init import InitializeClass
 from AccessControl.Permissions import manage_users
 from AccessControl.SecurityManagement import getSecurityManager
+from BTrees.OOBTree import OOTreeSet
 from Products.PageTemplates.PageTemplateFile import PageTemplateFile
 
 from Products.PluggableAuthService.interfaces.plugins import \
@@ -31,14 +33,30 @@ from Products.PluggableAuthService.interfaces.plugins import IChallengePlugin
 from Products.PluggableAuthService.interfaces.plugins import \
     ICredentialsResetPlugin
 from Products.PluggableAuthService.interfaces.plugins import IExtractionPlugin
+from Products.PluggableAuthService.interfaces.plugins import \
+    IGroupEnumerationPlugin
+from Products.PluggableAuthService.interfaces.plugins import IGroupsPlugin
 from Products.PluggableAuthService.interfaces.plugins import IPropertiesPlugin
 from Products.PluggableAuthService.interfaces.plugins import IRolesPlugin
+from Products.PluggableAuthService.interfaces.plugins import \
+    IUserEnumerationPlugin
 from Products.PluggableAuthService.plugins.BasePlugin import BasePlugin
 from Products.PluggableAuthService.utils import classImplements
 
+from .challenge import NONINTERACTIVE_RULES
+from .challenge import getChallengeClassifier
 from .configuration import PySAML2ConfigurationSupport
+from .discovery import getDiscoveryIndex
 from .metadata import SAML2MetadataProvider
+from .metadata import clearMetadataDocument
 from .serviceprovider import SAML2ServiceProvider
+from .ticket import TICKET_KEYS_KEPT
+from .ticket import TICKET_MAX_SIZE
+from .ticket import createTicketKey
+from .ticket import decodeTicket
+from .ticket import encodeTicket
+from .userdirectory import UserDirectory
+from .userdirectory import firstUserIds
 
 
 logger = logging.getLogger('Products.SAML2Plugins')
@@ -53,11 +71,33 @@ class SAML2PluginBase(BasePlugin,
     security = ClassSecurityInfo()
     default_idp = None
     login_attribute = ''
+    attribute_rules = ()
     assign_roles = []
+    role_rules = ()
+    group_attribute = ''
+    _known_groups = None
+    user_directory = False
+    user_directory_email = 'mail'
+    user_directory_fullname = 'displayName'
+    _user_directory = None
     inactivity_timeout = 2
+    activity_update_interval = 60
+    credential_storage = 'session'
+    credential_storage_options = ('session', 'ticket')
+    ticket_encrypt = False
+    ticket_max_lifetime = 24
+    _ticket_keys = ()
     logout_path = ''
+    artifact_timeout = 5.0
+    artifact_max_concurrency = 10
+    authn_request_templates = False
+    noninteractive_challenge = 'login'
+    noninteractive_challenge_options = ('login', '401', '403')
+    noninteractive_rules = NONINTERACTIVE_RULES
+    relay_state_tokens = False
     metadata_sign = False
     metadata_envelope = False
+    metadata_max_age = 3600
     protocol = 'http'  # The PAS challenge 'protocol' we use.
 
     security.declareProtected(manage_users, 'manage_configuration')
@@ -93,19 +133,90 @@ class SAML2PluginBase(BasePlugin,
                      'label': 'Login attribute (SAML subject if empty)',
                      'type': 'string',
                      'mode': 'w'},
+                    {'id': 'attribute_rules',
+                     'label': 'Attribute rules (keep, rename, drop, truncate)',
+                     'type': 'lines',
+                     'mode': 'w'},
                     {'id': 'inactivity_timeout',
                      'label': 'Session inactivity timeout (hours)',
                      'type': 'int',
                      'mode': 'w'},
+                    {'id': 'activity_update_interval',
+                     'label': 'Session activity update interval (seconds)',
+                     'type': 'int',
+                     'mode': 'w'},
+                    {'id': 'credential_storage',
+                     'label': 'Store credentials in (session or ticket)',
+                     'type': 'selection',
+                     'select_variable': 'credential_storage_options',
+                     'mode': 'w'},
+                    {'id': 'ticket_encrypt',
+                     'label': 'Encrypt credential tickets',
+                     'type': 'boolean',
+                     'mode': 'w'},
+                    {'id': 'ticket_max_lifetime',
+                     'label': 'Credential ticket lifetime after login (hours)',
+                     'type': 'int',
+                     'mode': 'w'},
                     {'id': 'assign_roles',
                      'label': 'Roles for SAML-authenticated users',
                      'type': 'multiple selection',
                      'select_variable': 'getCandidateRoles',
                      'mode': 'w'},
+                    {'id': 'role_rules',
+                     'label': 'Role rules (attribute, match type, value, '
+                              'roles)',
+                     'type': 'lines',
+                     'mode': 'w'},
+                    {'id': 'group_attribute',
+                     'label': 'Group membership attribute',
+                     'type': 'string',
+                     'mode': 'w'},
+                    {'id': 'user_directory',
+                     'label': 'Keep a directory of logged-in users',
+                     'type': 'boolean',
+                     'mode': 'w'},
+                    {'id': 'user_directory_email',
+                     'label': 'User directory email attribute',
+                     'type': 'string',
+                     'mode': 'w'},
+                    {'id': 'user_directory_fullname',
+                     'label': 'User directory display name attribute',
+                     'type': 'string',
+                     'mode': 'w'},
                     {'id': 'logout_path',
                      'label': 'Logout redirect path',
                      'type': 'string',
                      'mode': 'w'},
+                    {'id': 'artifact_timeout',
+                     'label': 'Artifact resolution timeout (seconds)',
+                     'type': 'float',
+                     'mode': 'w'},
+                    {'id': 'artifact_max_concurrency',
+                     'label': 'Artifact resolution concurrent connections '
+                              'per identity provider',
+                     'type': 'int',
+                     'mode': 'w'},
+                    {'id': 'authn_request_templates',
+                     'label': 'Pre-render unsigned authentication requests',
+                     'type': 'boolean',
+                     'mode': 'w'},
+                    {'id': 'noninteractive_challenge',
+                     'label': 'Challenge non-interactive requests with '
+                              '(login, 401 or 403)',
+                     'type': 'selection',
+                     'select_variable': 'noninteractive_challenge_options',
+                     'mode': 'w'},
+                    {'id': 'noninteractive_rules',
+                     'label': 'Non-interactive request rules (method, '
+                              'header, accept or path and values)',
+                     'type': 'lines',
+                     'mode': 'w'},
+                    {'id': 'relay_state_tokens',
+                     'label': 'Send short RelayState tokens instead of '
+                              'return URLs',
+                     'type': 'boolean',
+                     'mode': 'w'},
                     {'id': 'metadata_sign',
                      'label': 'Sign metadata',
                      'type': 'boolean',
@@ -113,6 +224,10 @@ class SAML2PluginBase(BasePlugin,
                     {'id': 'metadata_envelope',
                      'label': 'Use enclosing metadata EntitiesDescriptor',
                      'type': 'boolean',
+                     'mode': 'w'},
+                    {'id': 'metadata_max_age',
+                     'label': 'Metadata HTTP cache lifetime (seconds)',
+                     'type': 'int',
                      'mode': 'w'},)
                    + BasePlugin._properties)
 
@@ -125,6 +240,7 @@ class SAML2PluginBase(BasePlugin,
         # Set a unique UID as key for the configuration file
         # so that each plugin in the ZODB can have a unique configuration
         self._uid = f'{id}_{str(uuid.uuid4())}'
+        self._ticket_keys = (createTicketKey(),)
 
     def __setstate__(self, state):
         # This is called when the instance is loaded from the ZODB, for example
@@ -134,6 +250,13 @@ class SAML2PluginBase(BasePlugin,
         super().__setstate__(state)
         self._configuration = None
 
+    def _updateProperty(self, id, value):
+        # Stop signing metadata for the previous settings right away
+        # instead of when the metadata is requested next
+        super()._updateProperty(id, value)
+        if id.startswith('metadata_'):
+            clearMetadataDocument(self._uid)
+
     #
     #   ZMI helpers
     #
@@ -162,6 +285,189 @@ class SAML2PluginBase(BasePlugin,
 
         return ()
 
+    @security.private
+    def getDiscoveryIndex(self):
+        """ Get the search index for identity provider discovery """
+        cfg = self.getPySAML2Configuration()
+        return getDiscoveryIndex(self._uid, getattr(cfg, 'metadata', None))
+
+    @security.private
+    def getActivityUpdateInterval(self):
+        """ Get the minimum number of seconds between session activity updates
+
+        The configured interval is capped at a tenth of the inactivity
+        timeout so that short timeouts are not distorted by it.
+
+        Returns:
+            An integer, 0 means the session is updated on every request.
+        """
+        max_interval = (self.inactivity_timeout * 3600) // 10
+        return max(0, min(self.activity_update_interval or 0, max_interval))
+
+    @security.protected(manage_users)
+    def manage_rotateTicketKeys(self, REQUEST=None):
+        """ ZMI helper to create a new credential ticket key
+
+        Tickets signed with the previous keys stay valid until these keys
+        are rotated out as well.
+        """
+        self._ticket_keys = ((createTicketKey(),)
+                             + tuple(self._ticket_keys)[:TICKET_KEYS_KEPT - 1])
+        if REQUEST is not None:
+            qs = 'manage_tabs_message=Ticket keys rotated'
+            REQUEST.RESPONSE.redirect(
+                f'{self.absolute_url()}/manage_configuration?{qs}')
+
+    #
+    #   Session data helpers
+    #
+    @security.private
+    def getTicketCookieName(self):
+        """ Get the name of the credential ticket cookie """
+        return f'__saml2_{self.getId()}'
+
+    @security.private
+    def haveBrowserId(self, request):
+        """ Check if the request may belong to an existing Zope session
+
+        Accessing ``request.SESSION`` creates a new session and browser ID
+        cookie for every anonymous visitor. Ask the browser ID manager
+        first, it does not create anything.
+
+        Args:
+            request (Zope request): The incoming Zope request instance
+
+        Returns:
+            True or False
+        """
+        bid_manager = getattr(self, 'browser_id_manager', None)
+        if bid_manager is None:
+            # Cannot tell without a browser ID manager
+            return True
+        return bool(bid_manager.hasBrowserId())
+
+    @security.private
+    def getSessionInfo(self, request):
+        """ Get the session information for the current user
+
+        With ticket storage the information is read from the credential
+        ticket cookie, the Zope session is only used as fallback. The
+        result is cached on the request, so all plugin interfaces called
+        during one request share a single lookup.
+
+        Args:
+            request (Zope request): The incoming Zope request instance
+
+        Returns:
+            A mapping of user information or None
+        """
+        if request is None:
+            return None
+
+        # Only look at request.other, form values must not leak in here
+        cached = request.other.get(self._sessionInfoCacheKey(), None)
+        if cached is None:
+            cached = (self._lookupSessionInfo(request),)
+            request.other[self._sessionInfoCacheKey()] = cached
+        return cached[0]
+
+    def _sessionInfoCacheKey(self):
+        return f'_saml2_session_info_{self._uid}'
+
+    def _lookupSessionInfo(self, request):
+        if self.credential_storage == 'ticket':
+            cookies = getattr(request, 'cookies', None) or {}
+            ticket = cookies.get(self.getTicketCookieName())
+            if ticket:
+                session_info = decodeTicket(ticket, self._ticket_keys)
+                if session_info is not None and \
+                   not self._isTicketCurrent(session_info):
+                    logger.debug('getSessionInfo: Ticket lifetime exceeded')
+                    return None
+                return session_info
+
+        if not self.haveBrowserId(request):
+            return None
+
+        return request.SESSION.get(self._uid, None)
+
+    def _isTicketCurrent(self, session_info):
+        # Activity updates issue new tickets, the login time caps their
+        # lifetime. Tickets without login time are not accepted.
+        login_time = session_info.get('login_time')
+        if not isinstance(login_time, (int, float)):
+            return False
+        max_lifetime = max(self.ticket_max_lifetime, 1) * 3600
+        return time.time() - login_time < max_lifetime
+
+    @security.private
+    def setSessionInfo(self, request, session_info):
+        """ Store session information for the current user
+
+        With ticket storage a credential ticket cookie is set on the
+        response. Session information too large for a cookie is stored
+        in the Zope session instead.
+
+        Args:
+            request (Zope request): The incoming Zope request instance
+
+            session_info (dict): The user information
+        """
+        self._storeSessionInfo(request, session_info)
+        request.other[self._sessionInfoCacheKey()] = (session_info,)
+
+    def _storeSessionInfo(self, request, session_info):
+        if self.credential_storage == 'ticket':
+            if not self._ticket_keys:
+                self.manage_rotateTicketKeys()
+
+            try:
+                ticket = encodeTicket(dict(session_info),
+                                      self._ticket_keys[0],
+                                      encrypt=self.ticket_encrypt)
+            except (TypeError, ValueError) as exc:
+                ticket = None
+                logger.warning(f'setSessionInfo: Cannot create ticket: {exc}')
+
+            if ticket and len(ticket) <= TICKET_MAX_SIZE:
+                secure = request.get('SERVER_URL', '').startswith('https')
+                request.RESPONSE.setCookie(self.getTicketCookieName(),
+                                           ticket,
+                                           path='/',
+                                           http_only=True,
+                                           same_site='Lax',
+                                           secure=secure)
+                return
+
+            if ticket:
+                logger.warning(
+                    'setSessionInfo: Ticket too large, using the session')
+
+            # An older ticket would take precedence over the session
+            cookie_name = self.getTicketCookieName()
+            if cookie_name in (getattr(request, 'cookies', None) or {}):
+                request.RESPONSE.expireCookie(cookie_name, path='/')
+            request.other.pop(self._sessionInfoCacheKey(), None)
+
+        request.SESSION.set(self._uid, session_info)
+
+    @security.private
+    def clearSessionInfo(self, request):
+        """ Remove the session information for the current user
+
+        Args:
+            request (Zope request): The incoming Zope request instance
+        """
+        cookie_name = self.getTicketCookieName()
+        if cookie_name in (getattr(request, 'cookies', None) or {}):
+            request.RESPONSE.expireCookie(cookie_name, path='/')
+
+        # Don't create a new session just to empty it
+        if self.haveBrowserId(request):
+            request.SESSION.set(self._uid, {})
+
+        request.other[self._sessionInfoCacheKey()] = (None,)
+
     @security.public
     def loggedInHere(self, REQUEST):
         """ Helper to signal if the authenticated user is from this plugin
@@ -169,9 +475,55 @@ class SAML2PluginBase(BasePlugin,
         Returns: True or False
         """
         user = getSecurityManager().getUser()
-        session_info = REQUEST.SESSION.get(self._uid)
+        session_info = self.getSessionInfo(REQUEST)
         return session_info and user.getId() == session_info.get('_login', ())
 
+    @security.private
+    def updateUserDirectory(self, session_info):
+        """ Store the user information from a login in the user directory
+
+        Args:
+            session_info (dict): User information as returned by
+                ``handleACSRequest``
+
+        Returns:
+            True if the user directory was changed, False otherwise
+        """
+        user_id = session_info.get('_login')
+        if not user_id:
+            return False
+
+        # Only store values that don't change with every login
+        properties = {key: value for key, value in session_info.items()
+                      if key not in ('_login', '_roles', '_groups',
+                                     'last_active', 'login_time',
+                                     'name_id', 'session_index')}
+
+        if self._user_directory is None:
+            self._user_directory = UserDirectory()
+
+        return self._user_directory.updateUser(
+            user_id, properties,
+            email=properties.get(self.user_directory_email, ''),
+            fullname=properties.get(self.user_directory_fullname, ''))
+
+    @security.private
+    def registerGroups(self, group_ids):
+        """ Remember group IDs for the group enumeration
+
+        Nothing is written to the database if all groups are known.
+
+        Args:
+            group_ids (iterable): Group IDs from a user login
+        """
+        known = self._known_groups
+        new_ids = [gid for gid in group_ids
+                   if known is None or gid not in known]
+        if new_ids:
+            if known is None:
+                known = self._known_groups = OOTreeSet()
+            known.update(new_ids)
+
     #
     #   IAuthenticationPlugin implementation
     #
@@ -208,8 +560,18 @@ class SAML2PluginBase(BasePlugin,
     def challenge(self, request, response, **kw):
         """ See IChallengePlugin.
 
-        Challenge the user for credentials.
+        Challenge the user for credentials. Requests that cannot complete
+        a browser login, like asset fetches, script calls or ``HEAD``
+        requests, can get a plain 401 or 403 status instead.
         """
+        if self.noninteractive_challenge != 'login' and \
+           not getChallengeClassifier(
+               self.noninteractive_rules).isInteractive(request):
+            logger.debug('challenge: Non-interactive request, sending '
+                         f'status {self.noninteractive_challenge}')
+            response.setStatus(int(self.noninteractive_challenge))
+            return True
+
         self.idpCommunicate(self.getIdPAuthenticationData(request), response)
         return True
 
@@ -258,14 +620,19 @@ class SAML2PluginBase(BasePlugin,
 
             response (Zope response): The response instance from the request
         """
-        session_info = request.SESSION.get(self._uid, None)
+        session_info = self.getSessionInfo(request)
         if session_info:
             login = session_info.get('_login', 'n/a')
             logger.debug(f'resetCredentials: Logging out {login}')
             self.logoutLocally(session_info['name_id'])
+            # Copies of the credential ticket must not work after logout
+            self.getSessionRegistry().logout(
+                session_info['name_id'],
+                session_info.get('session_index'),
+                login_time=session_info.get('login_time'))
         else:
             logger.debug('resetCredentials: No login session active')
-        request.SESSION.set(self._uid, {})
+        self.clearSessionInfo(request)
 
     #
     # IExtractionPlugin implementation
@@ -285,16 +652,28 @@ class SAML2PluginBase(BasePlugin,
             exists, information about the user.
         """
         creds = {'plugin_uid': self._uid}
-        session_info = request.SESSION.get(self._uid, None)
+        session_info = self.getSessionInfo(request)
         if session_info:
             # Don't accept sessions older than the activity timeout
             now_secs = int(time.time())
             max_inactive = now_secs - (self.inactivity_timeout * 3600)
-            if session_info.get('last_active', 0) < max_inactive:
+            last_active = session_info.get('last_active', 0)
+            if last_active < max_inactive:
                 return creds
-            else:
+
+            # The identity provider may have ended the session
+            if self.isSessionRevoked(session_info):
+                logger.debug('extractCredentials: Session revoked for '
+                             f'{session_info.get("_login")}')
+                self.clearSessionInfo(request)
+                return creds
+
+            # Writing to the session on every request causes conflict
+            # errors, only refresh the activity marker once it is older
+            # than the update interval.
+            if now_secs - last_active >= self.getActivityUpdateInterval():
                 session_info['last_active'] = now_secs
-                request.SESSION.set(self._uid, session_info)
+                self.setSessionInfo(request, session_info)
 
             creds['login'] = session_info['_login']
             creds['password'] = ''
@@ -306,6 +685,62 @@ class SAML2PluginBase(BasePlugin,
 
         return creds
 
+    #
+    # IGroupsPlugin implementation
+    #
+    @security.private
+    def getGroupsForPrincipal(self, principal, request=None):
+        """ See IGroupsPlugin.
+
+        The groups were taken from the group membership attribute at
+        login time.
+        """
+        session_info = self.getSessionInfo(request)
+
+        if session_info and principal.getId() == session_info['_login']:
+            return tuple(session_info.get('_groups') or ())
+
+        return ()
+
+    #
+    # IGroupEnumerationPlugin implementation
+    #
+    @security.private
+    def enumerateGroups(self, id=None, exact_match=False, sort_by=None,
+                        max_results=None, **kw):
+        """ See IGroupEnumerationPlugin.
+
+        Only groups seen in the group membership attribute of a user
+        login are known. Without ``exact_match`` IDs are matched by prefix.
+        """
+        known = self._known_groups
+        if known is None:
+            return ()
+
+        if not id:
+            group_ids = list(known)
+        else:
+            if isinstance(id, str):
+                id = (id,)
+            group_ids = set()
+            for value in id:
+                if exact_match:
+                    if value in known:
+                        group_ids.add(value)
+                    continue
+                for group_id in known.keys(min=value):
+                    if not group_id.startswith(value):
+                        break
+                    group_ids.add(group_id)
+            group_ids = sorted(group_ids)
+
+        if max_results:
+            group_ids = group_ids[:max_results]
+
+        plugin_id = self.getId()
+        return tuple({'id': group_id, 'title': group_id, 'pluginid': plugin_id}
+                     for group_id in group_ids)
+
     #
     # IPropertiesPlugin implementation
     #
@@ -313,21 +748,109 @@ class SAML2PluginBase(BasePlugin,
     def getPropertiesForUser(self, user, request=None):
         """ See IPropertiesPlugin.
 
-        Get properties for the user.
+        Get properties for the user. The session information is returned
+        as read-only view, PAS copies it into the user's property sheet.
         """
         properties = {}
-        session_info = request.SESSION.get(self._uid, None)
+        session_info = self.getSessionInfo(request)
 
         if session_info and user.getId() == session_info['_login']:
-            properties = copy.deepcopy(session_info)
+            properties = types.MappingProxyType(session_info)
             logger.debug(
                 'getPropertiesForUser: Found data for '
                 f'{session_info["_login"]}')
+        elif self._user_directory is not None:
+            record = self._user_directory.getUser(user.getId())
+            if record is not None:
+                properties = types.MappingProxyType(record['properties'])
+                logger.debug('getPropertiesForUser: Found directory data '
+                             f'for {user.getId()}')
         else:
             logger.debug('getPropertiesForUser: No login session active')
 
         return properties
 
+    #
+    # IUserEnumerationPlugin implementation
+    #
+    @security.private
+    def enumerateUsers(self, id=None, login=None, exact_match=False,
+                       sort_by=None, max_results=None, **kw):
+        """ See IUserEnumerationPlugin.
+
+        Search the user directory. User IDs, logins, email addresses and
+        display names are matched case-insensitively by prefix or, with
+        ``exact_match``, as whole values. Unless the results are sorted by
+        login, email or display name, only the first ``max_results`` user
+        records are read.
+        """
+        directory = self._user_directory
+        if directory is None:
+            return ()
+
+        if sort_by not in ('login', 'email', 'fullname'):
+            sort_by = None
+        # Sorting by record values needs all matching records
+        limit = None if sort_by else (max_results or None)
+
+        user_ids = None
+        criteria = (('login', id), ('login', login),
+                    ('email', kw.get('email')),
+                    ('fullname', kw.get('fullname')))
+        for index_name, values in criteria:
+            if not values:
+                continue
+            if isinstance(values, str):
+                values = (values,)
+            found = set()
+            for value in values:
+                found.update(directory.search(exact_match,
+                                              **{index_name: value}))
+            user_ids = found if user_ids is None else user_ids & found
+
+        if user_ids is None:
+            user_ids = directory.search(limit=limit)
+        else:
+            user_ids = firstUserIds(user_ids, limit)
+
+        plugin_id = self.getId()
+        result = []
+        for user_id in user_ids:
+            record = directory.getUser(user_id)
+            result.append({'id': user_id,
+                           'login': record['login'],
+                           'email': record['email'],
+                           'fullname': record['fullname'],
+                           'pluginid': plugin_id})
+
+        if sort_by:
+            def sort_key(info):
+                return info[sort_by].lower()
+
+            if max_results:
+                result = heapq.nsmallest(max_results, result, key=sort_key)
+            else:
+                result.sort(key=sort_key)
+
+        return tuple(result)
+
+    @security.private
+    def updateUser(self, user_id, login_name):
+        """ See IUserEnumerationPlugin.
+
+        Login names are set by the identity provider, so they cannot be
+        changed here.
+        """
+        return False
+
+    @security.private
+    def updateEveryLoginName(self, quit_on_first_error=True):
+        """ See IUserEnumerationPlugin.
+
+        Login names are set by the identity provider, nothing to do here.
+        """
+        pass
+
     #
     # IRolesPlugin implementation
     #
@@ -338,11 +861,13 @@ class SAML2PluginBase(BasePlugin,
         Get roles for the principal (a group or a user).
         """
         roles = []
-        session_info = request.SESSION.get(self._uid, None)
+        session_info = self.getSessionInfo(request)
 
         if session_info and \
            principal.getId() == session_info['_login']:
-            roles = self.assign_roles
+            # Roles from the role rules were computed at login time
+            roles = set(self.assign_roles).union(
+                session_info.get('_roles') or ())
             logger.debug('getRolesForPrincipal: Found roles for '
                          f'{principal.getId()}')
         else:
@@ -358,6 +883,9 @@ classImplements(SAML2PluginBase,
                 IChallengePlugin,
                 ICredentialsResetPlugin,
                 IExtractionPlugin,
+                IGroupEnumerationPlugin,
+                IGroupsPlugin,
                 IPropertiesPlugin,
                 IRolesPlugin,
+                IUserEnumerationPlugin,
                 )
@@ -0,0 +1,207 @@
+##############################################################################
+#
+# Copyright (c) 2023 Jens Vagelpohl and Contributors. All Rights Reserved.
+#
+# This software is subject to the provisions of the Zope Public License,
+# Version 2.1 (ZPL).  A copy of the ZPL should accompany this distribution.
+# THIS SOFTWARE IS PROVIDED "AS IS" AND ANY AND ALL EXPRESS OR IMPLIED
+# WARRANTIES ARE DISCLAIMED, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF TITLE, MERCHANTABILITY, AGAINST INFRINGEMENT, AND FITNESS
+# FOR A PARTICULAR PURPOSE.
+#
+##############################################################################
+""" Connection pools for resolving HTTP-Artifact binding messages
+
+The identity provider sends an artifact instead of the SAML response. The
+service provider resolves it with a SOAP call to the artifact resolution
+service of the identity provider. Each identity provider host gets its own
+pool of keep-alive connections, so most logins reuse an open connection
+instead of paying for a new TCP and TLS handshake. The number of
+concurrent calls per host is bounded.
+"""
+
+import threading
+from urllib.parse import urlsplit
+from xml.parsers import expat
+from xml.sax.saxutils import quoteattr
+
+
+POOLS = {}
+POOLS_LOCK = threading.Lock()
+NS_SAMLP = 'urn:oasis:names:tc:SAML:2.0:protocol'
+
+
+class ArtifactResolutionPool:
+    """ Keep-alive connections to one artifact resolution service host """
+
+    def __init__(self, timeout, max_concurrency):
+        import requests
+        from requests.adapters import HTTPAdapter
+
+        self.timeout = timeout
+        self.max_concurrency = max_concurrency
+        self._slots = threading.BoundedSemaphore(max_concurrency)
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1,
+                              pool_maxsize=max_concurrency,
+                              pool_block=True,
+                              max_retries=0)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+    def post(self, url, data, headers=(), verify=True, cert=None):
+        """ POST to the artifact resolution service
+
+        Args:
+            url (str): The artifact resolution service URL
+
+            data (str or bytes): The SOAP message
+
+        Kwargs:
+            headers (iterable): (name, value) tuples of HTTP headers
+
+            verify (bool or str): Verify the server TLS certificate, or the
+                path of a CA bundle to verify it with
+
+            cert (tuple): Client certificate and key file paths
+
+        Returns:
+            The response body as string
+
+        Raises:
+            ``TimeoutError`` if all connections stay busy for longer than
+            the timeout, ``requests`` exceptions for connection failures,
+            timeouts and HTTP error responses.
+        """
+        if isinstance(data, str):
+            data = data.encode('utf-8')
+
+        if not self._slots.acquire(timeout=self.timeout):
+            raise TimeoutError(
+                f'No free connection to {url} within {self.timeout}s')
+        try:
+            response = self.session.post(url,
+                                         data=data,
+                                         headers=dict(headers),
+                                         timeout=self.timeout,
+                                         verify=verify,
+                                         cert=cert,
+                                         allow_redirects=False)
+            # Reading the body returns the connection to the pool
+            text = response.text
+            response.raise_for_status()
+            return text
+        finally:
+            self._slots.release()
+
+    def close(self):
+        self.session.close()
+
+
+def getArtifactResolutionPool(uid, url, timeout, max_concurrency):
+    """ Get or create the connection pool for an artifact resolution service
+
+    Pools are shared by all services on the same scheme, host and port.
+    Changed pool settings replace the pool.
+
+    Args:
+        uid (str): The plugin UID
+
+        url (str): The artifact resolution service URL
+
+        timeout (float): Timeout in seconds for connecting, for reading the
+            response and for waiting on a free connection
+
+        max_concurrency (int): Maximum number of concurrent calls
+    """
+    parsed = urlsplit(url)
+    key = (uid, parsed.scheme, parsed.netloc)
+    max_concurrency = max(max_concurrency, 1)
+    pool = POOLS.get(key)
+    if pool is None or pool.timeout != timeout or \
+       pool.max_concurrency != max_concurrency:
+        with POOLS_LOCK:
+            pool = POOLS.get(key)
+            if pool is None or pool.timeout != timeout or \
+               pool.max_concurrency != max_concurrency:
+                pool = POOLS[key] = ArtifactResolutionPool(timeout,
+                                                           max_concurrency)
+    return pool
+
+
+def clearArtifactResolutionPools():
+    """ Close and remove all connection pools """
+    with POOLS_LOCK:
+        for pool in POOLS.values():
+            pool.close()
+        POOLS.clear()
+
+
+def extractResponse(xmlstr):
+    """ Cut the SAML response out of a SOAP-enveloped ArtifactResponse
+
+    The response is copied verbatim instead of being parsed and serialized
+    again, which would change namespace prefixes and break signatures
+    inside the response. Namespace declarations inherited from enclosing
+    elements are added to its start tag.
+
+    Args:
+        xmlstr (str or bytes): The artifact resolution service response
+
+    Returns:
+        The SAML response XML as bytes or None if there is none
+    """
+    if isinstance(xmlstr, str):
+        xmlstr = xmlstr.encode('utf-8')
+
+    parser = expat.ParserCreate()
+    scopes = [{}]  # In-scope namespace declarations per open element
+    found = {}
+
+    def refuse(*args):
+        raise ValueError('Document type declarations are not allowed')
+
+    def start(name, attrs):
+        scope = dict(scopes[-1])
+        for key, value in attrs.items():
+            if key == 'xmlns' or key.startswith('xmlns:'):
+                scope[key] = value
+        scopes.append(scope)
+
+        if 'start' in found:
+            return
+        prefix, _, local_name = name.rpartition(':')
+        xmlns = f'xmlns:{prefix}' if prefix else 'xmlns'
+        if local_name == 'Response' and scope.get(xmlns) == NS_SAMLP:
+            found['start'] = parser.CurrentByteIndex
+            found['name'] = name
+            found['depth'] = len(scopes)
+            found['inherited'] = {key: value
+                                  for key, value in scopes[-2].items()
+                                  if key not in attrs}
+
+    def end(name):
+        if found.get('depth') == len(scopes) and 'end' not in found:
+            end = parser.CurrentByteIndex
+            # Empty elements end before the next tag, without end tag
+            if xmlstr.startswith(f'</{name}'.encode('utf-8'), end):
+                end = xmlstr.index(b'>', end) + 1
+            found['end'] = end
+        scopes.pop()
+
+    parser.StartDoctypeDeclHandler = refuse
+    parser.EntityDeclHandler = refuse
+    parser.StartElementHandler = start
+    parser.EndElementHandler = end
+    parser.Parse(xmlstr, True)
+
+    if 'end' not in found:
+        return None
+
+    start, end = found['start'], found['end']
+    name_end = start + 1 + len(found['name'].encode('utf-8'))
+    declarations = ''.join(f' {key}={quoteattr(value)}'
+                           for key, value in found['inherited'].items())
+    return b''.join((xmlstr[start:name_end],
+                     declarations.encode('utf-8'),
+                     xmlstr[name_end:end]))
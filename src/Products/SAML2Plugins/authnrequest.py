@@ -0,0 +1,110 @@
+##############################################################################
+#
+# Copyright (c) 2023 Jens Vagelpohl and Contributors. All Rights Reserved.
+#
+# This software is subject to the provisions of the Zope Public License,
+# Version 2.1 (ZPL).  A copy of the ZPL should accompany this distribution.
+# THIS SOFTWARE IS PROVIDED "AS IS" AND ANY AND ALL EXPRESS OR IMPLIED
+# WARRANTIES ARE DISCLAIMED, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF TITLE, MERCHANTABILITY, AGAINST INFRINGEMENT, AND FITNESS
+# FOR A PARTICULAR PURPOSE.
+#
+##############################################################################
+""" Pre-rendered authentication request templates
+
+Unless the XML document itself is signed, authentication requests to the
+same identity provider endpoint only differ in their ``ID`` and
+``IssueInstant`` attributes. ``pysaml2`` renders the request once, and
+later requests are put together from the rendered pieces and the new
+attribute values without building and serializing ``pysaml2`` objects.
+"""
+
+import re
+from xml.sax.saxutils import escape
+
+from saml2 import BINDING_HTTP_POST
+
+
+AUTHN_REQUEST_TEMPLATES = {}
+TEMPLATE_ID = 'id-authnrequesttemplate'
+FIELDS = re.compile(r'\s(ID|IssueInstant)="([^"]*)"')
+
+
+class AuthnRequestTemplate:
+    """ An authentication request with replaceable ID and IssueInstant """
+
+    def __init__(self, xml):
+        root_end = xml.index('>', xml.index('<', xml.index('?>') + 2
+                                            if xml.startswith('<?') else 0))
+        self._parts = []
+        self._fields = []
+        position = 0
+        for match in FIELDS.finditer(xml, 0, root_end):
+            self._parts.append(xml[position:match.start(2)])
+            self._fields.append(match.group(1))
+            position = match.end(2)
+        self._parts.append(xml[position:])
+
+        if sorted(self._fields) != ['ID', 'IssueInstant']:
+            raise ValueError('Request must have one ID and one IssueInstant')
+
+    def render(self, message_id, issue_instant):
+        """ Render an authentication request
+
+        Args:
+            message_id (str): The request ID
+
+            issue_instant (str): The request time stamp
+
+        Returns:
+            The request XML as string
+        """
+        values = {'ID': escape(message_id, {'"': '&quot;'}),
+                  'IssueInstant': escape(issue_instant, {'"': '&quot;'})}
+        pieces = [self._parts[0]]
+        for field, part in zip(self._fields, self._parts[1:]):
+            pieces.append(values[field])
+            pieces.append(part)
+        return ''.join(pieces)
+
+
+def getAuthnRequestTemplate(uid, client, binding, destination):
+    """ Get or render the authentication request template for an endpoint
+
+    Templates are rendered once for each loaded configuration. They are
+    only valid for requests that don't carry an XML signature.
+
+    Args:
+        uid (str): The plugin UID
+
+        client (saml2.client.Saml2Client): The pysaml2 client
+
+        binding (str): The binding for sending the request
+
+        destination (str): The single sign-on service location
+
+    Returns:
+        An ``AuthnRequestTemplate`` instance or None if the request cannot
+        be used as template
+    """
+    cached = AUTHN_REQUEST_TEMPLATES.get(uid)
+    if cached is None or cached[0] is not client.config:
+        cached = AUTHN_REQUEST_TEMPLATES[uid] = (client.config, {})
+    templates = cached[1]
+
+    key = (binding, destination)
+    if key not in templates:
+        _, request = client.create_authn_request(destination=destination,
+                                                 binding=BINDING_HTTP_POST,
+                                                 message_id=TEMPLATE_ID,
+                                                 sign=False)
+        try:
+            templates[key] = AuthnRequestTemplate(str(request))
+        except ValueError:
+            templates[key] = None
+    return templates[key]
+
+
+def clearAuthnRequestTemplates():
+    """ Remove all authentication request templates """
+    AUTHN_REQUEST_TEMPLATES.clear()
@@ -29,7 +29,8 @@ class SAML2AssertionConsumerView(BrowserView):
     def __call__(self):
         """ Interact with request from the SAML 2.0 Identity Provider (IdP) """
         saml_response = self.request.get('SAMLResponse', '')
-        target_url = self.request.get('RelayState', '/')
+        target_url = self.context.resolveRelayState(
+            self.request.get('RelayState', '/'), self.request)
         binding = 'REDIRECT'
 
         # Make sure the login target url lands here by ripping off
@@ -41,10 +42,17 @@ class SAML2AssertionConsumerView(BrowserView):
         if self.request.method == 'POST':
             binding = 'POST'
 
+        # With the HTTP-Artifact binding the response must be fetched
+        # from the identity provider first
+        artifact = self.request.get('SAMLart', '')
+        if artifact and not saml_response:
+            saml_response = artifact
+            binding = 'ARTIFACT'
+
         user_info = self.context.handleACSRequest(saml_response, binding)
         if user_info:
             logger.debug(f'SP view: Success, redirecting to {target_url}')
-            self.request.SESSION.set(self.context._uid, user_info)
+            self.context.setSessionInfo(self.request, user_info)
             self.request.response.redirect(target_url, lock=1)
 
             return 'Success'
@@ -0,0 +1,108 @@
+##############################################################################
+#
+# Copyright (c) 2023 Jens Vagelpohl and Contributors. All Rights Reserved.
+#
+# This software is subject to the provisions of the Zope Public License,
+# Version 2.1 (ZPL).  A copy of the ZPL should accompany this distribution.
+# THIS SOFTWARE IS PROVIDED "AS IS" AND ANY AND ALL EXPRESS OR IMPLIED
+# WARRANTIES ARE DISCLAIMED, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF TITLE, MERCHANTABILITY, AGAINST INFRINGEMENT, AND FITNESS
+# FOR A PARTICULAR PURPOSE.
+#
+##############################################################################
+""" Identity provider discovery views
+"""
+
+import json
+from urllib.parse import quote
+
+from Products.Five import BrowserView
+from Products.Five.browser.pagetemplatefile import ViewPageTemplateFile
+
+from ..discovery import LOGO_TTL
+from ..discovery import getLogo
+
+
+DEFAULT_LIMIT = 20
+MAX_LIMIT = 100
+
+
+class DiscoveryBase(BrowserView):
+
+    def getLimit(self):
+        try:
+            limit = int(self.request.get('limit', DEFAULT_LIMIT))
+        except (TypeError, ValueError):
+            limit = DEFAULT_LIMIT
+        return max(1, min(limit, MAX_LIMIT))
+
+    def search(self):
+        """ Search identity providers for the query in the request
+
+        Returns:
+            A list of mappings with the keys ``entity_id``, ``name``,
+            ``domains``, ``logo`` (the logo URL) and ``login`` (the URL for
+            logging in with the identity provider)
+        """
+        plugin = self.context
+        plugin_url = plugin.absolute_url()
+        came_from = self.request.get('came_from', '')
+        index = plugin.getDiscoveryIndex()
+
+        results = []
+        for entry in index.search(self.request.get('q', ''),
+                                  limit=self.getLimit()):
+            idp = quote(entry['entity_id'], safe='')
+            login_url = f'{plugin_url}/login?idp={idp}'
+            if came_from:
+                login_url += f'&came_from={quote(came_from, safe="")}'
+            logo_url = ''
+            if entry['logo']:
+                logo_url = f'{plugin_url}/discovery_logo?idp={idp}'
+            results.append({'entity_id': entry['entity_id'],
+                            'name': entry['name'],
+                            'domains': list(entry['domains']),
+                            'logo': logo_url,
+                            'login': login_url})
+        return results
+
+
+class SAML2DiscoveryView(DiscoveryBase):
+    """ Page for choosing an identity provider """
+
+    template = ViewPageTemplateFile('templates/discovery.zpt')
+
+    def __call__(self):
+        return self.template()
+
+
+class SAML2DiscoveryJSONView(DiscoveryBase):
+    """ Identity provider search for typeahead widgets """
+
+    def __call__(self):
+        response = self.request.response
+        response.setHeader('Content-Type', 'application/json')
+        return json.dumps(self.search())
+
+
+class SAML2DiscoveryLogoView(BrowserView):
+    """ Identity provider logos, served from the logo cache """
+
+    def __call__(self):
+        response = self.request.response
+        entry = self.context.getDiscoveryIndex().get(
+            self.request.get('idp', ''))
+        logo = None
+        if entry is not None and entry['logo']:
+            logo = getLogo(entry['logo'])
+
+        if logo is None:
+            response.setStatus(404)
+            return ''
+
+        content_type, data = logo
+        response.setHeader('Content-Type', content_type)
+        response.setHeader('X-Content-Type-Options', 'nosniff')
+        response.setHeader('Content-Security-Policy', 'sandbox')
+        response.setHeader('Cache-Control', f'public, max-age={LOGO_TTL}')
+        return data
@@ -17,8 +17,31 @@ from Products.Five import BrowserView
 
 
 class SAML2MetadataView(BrowserView):
-    """ Metadata browser view """
+    """ Metadata browser view
+
+    The rendered metadata is cached until the configuration changes.
+    Conditional requests for an unchanged document get a 304 response.
+    Signed metadata is signed ahead of time, if no signed document is
+    available yet the response status is 503.
+    """
 
     def __call__(self):
-        self.request.response.setHeader('Content-Type', 'application/xml')
-        return self.context.generateMetadata()
+        response = self.request.response
+        document = self.context.getMetadataDocument()
+        if document is None:
+            response.setStatus(503)
+            response.setHeader('Retry-After', '10')
+            return b''
+
+        max_age = document.maxAge(self.context.metadata_max_age)
+        response.setHeader('ETag', document.etag)
+        response.setHeader('Last-Modified', document.last_modified)
+        response.setHeader('Cache-Control', f'public, max-age={max_age}')
+
+        if document.isNotModified(self.request.getHeader('If-None-Match'),
+                                  self.request.getHeader('If-Modified-Since')):
+            response.setStatus(304)
+            return b''
+
+        response.setHeader('Content-Type', 'application/xml')
+        return document.data
@@ -19,6 +19,13 @@ from Products.Five import BrowserView
 
 
 logger = logging.getLogger('Products.SAML2Plugins')
+SOAP_FAULT = ('<?xml version="1.0" encoding="UTF-8"?>'
+              '<soap11:Envelope '
+              'xmlns:soap11="http://schemas.xmlsoap.org/soap/envelope/">'
+              '<soap11:Body><soap11:Fault>'
+              '<faultcode>soap11:Client</faultcode>'
+              '<faultstring>Logout request rejected</faultstring>'
+              '</soap11:Fault></soap11:Body></soap11:Envelope>')
 
 
 class SAML2SingleLogoutView(BrowserView):
@@ -26,15 +33,21 @@ class SAML2SingleLogoutView(BrowserView):
 
     def __call__(self):
         """ Interact with request from the SAML 2.0 Identity Provider (IdP) """
+        if self.request.get('SAMLRequest', ''):
+            return self.handleLogoutRequest()
+
         saml_response = self.request.get('SAMLResponse', '')
         binding = 'REDIRECT'
+        query_string = self.request.get('QUERY_STRING', '')
         result = 'Logged out'
 
         if self.request.method == 'POST':
             binding = 'POST'
+            query_string = ''
 
         try:
-            logout_path = self.context.handleSLORequest(saml_response, binding)
+            logout_path = self.context.handleSLORequest(
+                saml_response, binding, query_string=query_string)
         except Exception:
             result = 'Logout failed'
             logout_path = ''
@@ -47,3 +60,67 @@ class SAML2SingleLogoutView(BrowserView):
             self.request.response.redirect(logout_path, lock=1)
         else:
             return result
+
+    def handleLogoutRequest(self):
+        """ Handle a logout request initiated by the Identity Provider """
+        binding = 'REDIRECT'
+        query_string = self.request.get('QUERY_STRING', '')
+
+        if self.request.method == 'POST':
+            binding = 'POST'
+            query_string = ''
+
+        try:
+            response_info = self.context.handleLogoutRequest(
+                self.request.get('SAMLRequest'),
+                binding,
+                query_string=query_string,
+                relay_state=self.request.get('RelayState', ''))
+        except Exception:
+            response_info = None
+
+        # Invalid or unsigned requests must not end the session
+        if response_info is None:
+            return 'Logout failed'
+
+        # Clear local credentials
+        self.context.resetCredentials(self.request, self.request.RESPONSE)
+
+        logger.debug('SLO view: Sending logout response')
+        return self.context.idpCommunicate(response_info,
+                                           self.request.RESPONSE)
+
+
+class SAML2SOAPSingleLogoutView(BrowserView):
+    """ Single logout service browser view for the SOAP back channel
+
+    The identity provider calls this view directly, without the user's
+    browser, and expects the logout response in the HTTP response.
+    """
+
+    def __call__(self):
+        """ Answer a logout request from the SAML 2.0 Identity Provider """
+        response = self.request.RESPONSE
+
+        if self.request.method != 'POST':
+            response.setStatus(405)
+            response.setHeader('Allow', 'POST')
+            return ''
+
+        body = self.request.get('BODY') or b''
+        if isinstance(body, bytes):
+            body = body.decode('utf-8', 'replace')
+
+        try:
+            response_info = self.context.handleLogoutRequest(body, 'SOAP')
+        except Exception:
+            response_info = None
+
+        if response_info is None:
+            logger.debug('SOAP SLO view: Rejected logout request')
+            response.setStatus(500)
+            response.setHeader('Content-Type', 'text/xml; charset=utf-8')
+            return SOAP_FAULT
+
+        logger.debug('SOAP SLO view: Sending logout response')
+        return self.context.idpCommunicate(response_info, response)
@@ -65,8 +65,50 @@ class SAML2AssertionConsumerViewTests(PluginViewsTestBase):
         self.assertEqual(req.SESSION[plugin._uid], user_info)
         self.assertEqual(req.response.redirected, '/good/target.html?key=val')
 
+    def test___call__relay_state_token(self):
+        from ...relaystate import encodeReturnURL
+        from ...relaystate import getRelayStateCookieName
+
+        view = self._makeOne()
+        plugin = view.context
+        plugin.handleACSRequest = MagicMock(return_value={'foo': 'bar'})
+        view.request.method = 'POST'
+        token = 'rs-token'
+        cookie_name = getRelayStateCookieName(token)
+        view.request.cookies[cookie_name] = encodeReturnURL(
+            token, 'https://foo.com/target.html?key=val',
+            plugin._ticket_keys[0])
+
+        view.request.set('RelayState', token)
+        self.assertEqual(view(), 'Success')
+        self.assertEqual(view.request.response.redirected,
+                         '/target.html?key=val')
+
+        # The token is used up
+        self.assertEqual(view.request.response.cookies[cookie_name]['value'],
+                         'deleted')
+        del view.request.cookies[cookie_name]
+        self.assertEqual(view(), 'Success')
+        self.assertEqual(view.request.response.redirected, '/')
+
     def test___call__POST(self):
         self._call_test(request_method='POST')
 
     def test___call__REDIRECT(self):
         self._call_test(request_method='GET')
+
+    def test___call__artifact(self):
+        view = self._makeOne()
+        plugin = view.context
+        plugin.handleACSRequest = MagicMock(return_value={'foo': 'bar'})
+        view.request.method = 'GET'
+        view.request.set('SAMLart', 'abc')
+
+        # The artifact is resolved by handleACSRequest
+        self.assertEqual(view(), 'Success')
+        plugin.handleACSRequest.assert_called_with('abc', 'ARTIFACT')
+
+        # A SAML response takes precedence
+        view.request.set('SAMLResponse', 'def')
+        view()
+        plugin.handleACSRequest.assert_called_with('def', 'REDIRECT')
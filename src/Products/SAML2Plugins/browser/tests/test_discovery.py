@@ -0,0 +1,119 @@
+##############################################################################
+#
+# Copyright (c) 2023 Jens Vagelpohl and Contributors. All Rights Reserved.
+#
+# This software is subject to the provisions of the Zope Public License,
+# Version 2.1 (ZPL).  A copy of the ZPL should accompany this distribution.
+# THIS SOFTWARE IS PROVIDED "AS IS" AND ANY AND ALL EXPRESS OR IMPLIED
+# WARRANTIES ARE DISCLAIMED, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF TITLE, MERCHANTABILITY, AGAINST INFRINGEMENT, AND FITNESS
+# FOR A PARTICULAR PURPOSE.
+#
+##############################################################################
+""" Tests for identity provider discovery views
+"""
+
+import json
+
+from .base import PluginViewsTestBase
+
+
+class DiscoveryViewsTestBase(PluginViewsTestBase):
+
+    def setUp(self):
+        from ...discovery import clearLogoCache
+        super().setUp()
+        clearLogoCache()
+        self.addCleanup(clearLogoCache)
+
+    def _makeOne(self, **kw):
+        from ...configuration import clearConfigurationCaches
+
+        view = super()._makeOne()
+        view.context.getConfiguration()['metadata']['local'] = [
+            self._test_path('discovery_metadata.xml')]
+        view.context.absolute_url = lambda: 'https://sp.example/acl/test'
+        clearConfigurationCaches()
+        for key, value in kw.items():
+            view.request.set(key, value)
+        return view
+
+
+class SAML2DiscoveryJSONViewTests(DiscoveryViewsTestBase):
+
+    def _getTargetClass(self):
+        from ..discovery import SAML2DiscoveryJSONView
+        return SAML2DiscoveryJSONView
+
+    def test___call__(self):
+        view = self._makeOne(q='univ', came_from='https://sp.example/a?b=c')
+        result = json.loads(view())
+
+        self.assertEqual(view.request.response.headers['Content-Type'],
+                         'application/json')
+        self.assertEqual(
+            result,
+            [{'entity_id': 'https://idp.uni.example/idp',
+              'name': 'University of Example',
+              'domains': ['uni.example'],
+              'logo': 'https://sp.example/acl/test/discovery_logo'
+                      '?idp=https%3A%2F%2Fidp.uni.example%2Fidp',
+              'login': 'https://sp.example/acl/test/login'
+                       '?idp=https%3A%2F%2Fidp.uni.example%2Fidp'
+                       '&came_from=https%3A%2F%2Fsp.example%2Fa%3Fb%3Dc'}])
+
+    def test___call__no_logo(self):
+        view = self._makeOne(q='plain')
+        result = json.loads(view())
+
+        self.assertEqual(len(result), 1)
+        self.assertEqual(result[0]['logo'], '')
+        self.assertEqual(result[0]['login'],
+                         'https://sp.example/acl/test/login'
+                         '?idp=https%3A%2F%2Fplain.example%2Fidp')
+
+    def test___call__limit(self):
+        self.assertEqual(len(json.loads(self._makeOne()())), 3)
+        self.assertEqual(len(json.loads(self._makeOne(limit='2')())), 2)
+        self.assertEqual(len(json.loads(self._makeOne(limit='0')())), 1)
+        self.assertEqual(len(json.loads(self._makeOne(limit='x')())), 3)
+
+
+class SAML2DiscoveryViewTests(DiscoveryViewsTestBase):
+
+    def _getTargetClass(self):
+        from ..discovery import SAML2DiscoveryView
+        return SAML2DiscoveryView
+
+    def test_search(self):
+        view = self._makeOne(q='college')
+        self.assertEqual([x['name'] for x in view.search()],
+                         ['Example Community College'])
+
+
+class SAML2DiscoveryLogoViewTests(DiscoveryViewsTestBase):
+
+    def _getTargetClass(self):
+        from ..discovery import SAML2DiscoveryLogoView
+        return SAML2DiscoveryLogoView
+
+    def test___call__(self):
+        from ...discovery import LOGO_TTL
+
+        view = self._makeOne(idp='https://idp.uni.example/idp')
+        response = view.request.response
+
+        self.assertEqual(view(), b'\x89PNG\r\n\x1a\n')
+        self.assertEqual(response.headers['Content-Type'], 'image/png')
+        self.assertEqual(response.headers['X-Content-Type-Options'],
+                         'nosniff')
+        self.assertEqual(response.headers['Content-Security-Policy'],
+                         'sandbox')
+        self.assertEqual(response.headers['Cache-Control'],
+                         f'public, max-age={LOGO_TTL}')
+
+    def test___call__no_logo(self):
+        for idp in ('https://plain.example/idp', 'https://unknown/', ''):
+            view = self._makeOne(idp=idp)
+            self.assertEqual(view(), '')
+            self.assertEqual(view.request.response.status, 404)
@@ -13,6 +13,8 @@
 """ Tests for SAML 2.0 metadata view
 """
 
+from unittest.mock import patch
+
 from .base import PluginViewsTestBase
 
 
@@ -27,4 +29,67 @@ class SAML2MetadataViewTests(PluginViewsTestBase):
         result = view()
 
         self.assertTrue(result.startswith(
-            '<?xml version="1.0" ?>\n<ns0:EntityDescriptor'))
+            b'<?xml version="1.0" ?>\n<ns0:EntityDescriptor'))
+        headers = view.request.response.headers
+        self.assertEqual(headers['Content-Type'], 'application/xml')
+        self.assertEqual(headers['Cache-Control'], 'public, max-age=3600')
+        self.assertTrue(headers['ETag'].startswith('"'))
+        self.assertTrue(headers['Last-Modified'].endswith(' GMT'))
+
+        # The rendered document is reused
+        with patch.object(view.context, 'generateMetadata',
+                          side_effect=AssertionError):
+            self.assertEqual(view(), result)
+
+    def test___call__conditional(self):
+        view = self._makeOne()
+        view()
+        response = view.request.response
+        etag = response.headers['ETag']
+        last_modified = response.headers['Last-Modified']
+
+        for name, value in (('If-None-Match', etag),
+                            ('If-None-Match', f'"abc", W/{etag}'),
+                            ('If-None-Match', '*'),
+                            ('If-Modified-Since', last_modified)):
+            view.request.headers = {name: value}
+            response.status = None
+            with patch.object(view.context, 'generateMetadata',
+                              side_effect=AssertionError):
+                self.assertEqual(view(), b'')
+            self.assertEqual(response.status, 304)
+            self.assertEqual(response.headers['ETag'], etag)
+
+        for headers in ({'If-None-Match': '"abc"'},
+                        # If-None-Match takes precedence
+                        {'If-None-Match': '"abc"',
+                         'If-Modified-Since': last_modified},
+                        {'If-Modified-Since': 'Sat, 01 Jan 2000 00:00:00 GMT'},
+                        {'If-Modified-Since': 'invalid'}):
+            view.request.headers = headers
+            response.status = None
+            self.assertTrue(view().startswith(b'<?xml'))
+            self.assertIsNone(response.status)
+
+    def test___call__signing(self):
+        from ...metadata import METADATA_DOCUMENTS
+
+        view = self._makeOne()
+        view.context.metadata_sign = True
+        response = view.request.response
+
+        with patch.object(view.context, 'getMetadataDocument',
+                          return_value=None):
+            self.assertEqual(view(), b'')
+        self.assertEqual(response.status, 503)
+        self.assertEqual(response.headers['Retry-After'], '10')
+
+        # Requests don't wait for the signature
+        response.status = None
+        self.assertEqual(view(), b'')
+        self.assertEqual(response.status, 503)
+
+        METADATA_DOCUMENTS[view.context._uid][2]._timer.join(5)
+        response.status = None
+        self.assertIn(b'<ns1:SignatureValue>', view())
+        self.assertIsNone(response.status)
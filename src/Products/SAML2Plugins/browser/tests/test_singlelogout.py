@@ -13,11 +13,96 @@
 """ Tests for SAML 2.0 single logout view
 """
 
+import os
+import shutil
+import tempfile
+import threading
+from base64 import b64decode
+from base64 import b64encode
 from unittest.mock import MagicMock
+from urllib.parse import parse_qs
+from urllib.parse import urlsplit
 
+from saml2 import BINDING_HTTP_POST
+from saml2 import BINDING_HTTP_REDIRECT
+from saml2 import BINDING_SOAP
+from saml2.ident import code as nameid_to_str
+from saml2.saml import NAMEID_FORMAT_PERSISTENT
+from saml2.saml import NameID
+from saml2.xmldsig import SIG_RSA_SHA256
+
+from ...tests.dummy import DummyRequest
 from .base import PluginViewsTestBase
 
 
+SP_SOAP_SLO_URL = 'http://sp.example.com/slo_soap'
+SP_SLO_URL = 'http://sp.example.com/slo'
+
+
+class LocalIdP:
+    """ Stand-in identity provider sending SOAP logout requests """
+
+    entity_id = 'https://idp.test/metadata'
+
+    def __init__(self, key_file, cert_file, xmlsec_binary, folder):
+        from saml2.config import IdPConfig
+        from saml2.entity import Entity
+        from saml2.metadata import entity_descriptor
+
+        config = IdPConfig().load({
+            'entityid': self.entity_id,
+            'service': {'idp': {'endpoints': {
+                'single_sign_on_service': [
+                    ('https://idp.test/sso', BINDING_HTTP_REDIRECT)],
+                'single_logout_service': [
+                    ('https://idp.test/slo', BINDING_SOAP),
+                    ('https://idp.test/slo', BINDING_HTTP_REDIRECT),
+                    ('https://idp.test/slo', BINDING_HTTP_POST)]}}},
+            'key_file': key_file,
+            'cert_file': cert_file,
+            'xmlsec_binary': xmlsec_binary})
+        self.entity = Entity('idp', config=config)
+        self.metadata_file = os.path.join(folder, 'local_idp.xml')
+        with open(self.metadata_file, 'w') as fp:
+            fp.write(str(entity_descriptor(config)))
+
+    def logoutRequest(self, name_id, session_indexes=(), sign=True):
+        """ Create a SOAP-enveloped logout request """
+        _, request = self.entity.create_logout_request(
+            SP_SOAP_SLO_URL, 'http://sp.example.com/metadata.xml',
+            name_id=name_id, session_indexes=list(session_indexes),
+            sign=sign)
+        info = self.entity.apply_binding(BINDING_SOAP, str(request),
+                                         SP_SOAP_SLO_URL)
+        return info['data'].encode('utf-8')
+
+    def frontChannelRequest(self, name_id, binding, sign=True):
+        """ Create a logout request sent through the browser
+
+        Returns:
+            The request method, the SAMLRequest value and the query string
+        """
+        _, request = self.entity.create_logout_request(
+            SP_SLO_URL, 'http://sp.example.com/metadata.xml',
+            name_id=name_id, session_indexes=['idx1'],
+            sign=sign and binding == BINDING_HTTP_POST)
+        if binding == BINDING_HTTP_POST:
+            return 'POST', b64encode(str(request).encode()).decode(), ''
+
+        info = self.entity.apply_binding(BINDING_HTTP_REDIRECT, str(request),
+                                         SP_SLO_URL, sign=sign,
+                                         sigalg=SIG_RSA_SHA256)
+        query_string = urlsplit(dict(info['headers'])['Location']).query
+        saml_request = parse_qs(query_string)['SAMLRequest'][0]
+        return 'GET', saml_request, query_string
+
+    def parseResponse(self, data):
+        """ Parse the SOAP response of the service provider """
+        if isinstance(data, bytes):
+            data = data.decode('utf-8')
+        return self.entity.parse_logout_request_response(data, BINDING_SOAP)
+
+
 class SAML2SingleLogoutViewTests(PluginViewsTestBase):
 
     def _getTargetClass(self):
@@ -57,3 +142,229 @@ class SAML2SingleLogoutViewTests(PluginViewsTestBase):
 
     def test___call__REDIRECT(self):
         self._call_test(request_method='GET')
+
+    def test___call__query_string(self):
+        view = self._makeOne()
+        plugin = view.context
+        plugin.handleSLORequest = MagicMock(return_value='')
+        view.request.set('SAMLResponse', 'abc')
+        view.request.set('QUERY_STRING', 'SAMLResponse=abc&Signature=def')
+
+        # The raw query string is passed on for the redirect binding
+        view.request.method = 'GET'
+        view()
+        plugin.handleSLORequest.assert_called_with(
+            'abc', 'REDIRECT', query_string='SAMLResponse=abc&Signature=def')
+
+        # It is not used with the POST binding
+        view.request.method = 'POST'
+        view()
+        plugin.handleSLORequest.assert_called_with(
+            'abc', 'POST', query_string='')
+
+    def test___call__logout_request(self):
+        view = self._makeOne()
+        req = view.request
+        plugin = view.context
+        response_info = {'headers': [('Location', 'https://idp/slo?x=y')],
+                         'status': 303}
+        plugin.handleLogoutRequest = MagicMock(return_value=response_info)
+        req.set('SAMLRequest', 'abc')
+        req.set('RelayState', 'state')
+        req.set('QUERY_STRING', 'SAMLRequest=abc&RelayState=state')
+        req.SESSION.set(plugin._uid, {'_login': 'foo', 'name_id': 'bar'})
+
+        # The logout response is sent back to the identity provider
+        req.method = 'GET'
+        self.assertIsNone(view())
+        plugin.handleLogoutRequest.assert_called_with(
+            'abc', 'REDIRECT', query_string='SAMLRequest=abc&RelayState=state',
+            relay_state='state')
+        self.assertEqual(req.response.redirected, 'https://idp/slo?x=y')
+        self.assertFalse(req.SESSION.get(plugin._uid))
+
+        req.method = 'POST'
+        view()
+        plugin.handleLogoutRequest.assert_called_with(
+            'abc', 'POST', query_string='', relay_state='state')
+
+        # Failures are reported and leave the session alone
+        req.SESSION.set(plugin._uid, {'_login': 'foo', 'name_id': 'bar'})
+        plugin.handleLogoutRequest = MagicMock(return_value=None)
+        self.assertEqual(view(), 'Logout failed')
+        plugin.handleLogoutRequest = MagicMock(side_effect=Exception)
+        self.assertEqual(view(), 'Logout failed')
+        self.assertTrue(req.SESSION.get(plugin._uid))
+
+
+class SAML2SingleLogoutViewSignatureTests(PluginViewsTestBase):
+
+    def _getTargetClass(self):
+        from ..singlelogout import SAML2SingleLogoutView
+        return SAML2SingleLogoutView
+
+    def setUp(self):
+        super().setUp()
+        self.tmpdir = tempfile.mkdtemp()
+        self.plugin = self._makeOne().context
+        cfg = self.plugin.getConfiguration()
+        self.idp = LocalIdP(cfg['key_file'], cfg['cert_file'],
+                            cfg['xmlsec_binary'], self.tmpdir)
+        cfg['metadata']['local'].append(self.idp.metadata_file)
+        cfg['service']['sp']['endpoints']['single_logout_service'] = [
+            (SP_SLO_URL, BINDING_HTTP_REDIRECT),
+            (SP_SLO_URL, BINDING_HTTP_POST)]
+        self.name_id = NameID(text='jdoe', format=NAMEID_FORMAT_PERSISTENT)
+        self.plugin.getSessionRegistry().register(
+            nameid_to_str(self.name_id), 'idx1')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+        super().tearDown()
+
+    def _call(self, method, saml_request, query_string):
+        request = DummyRequest()
+        request.method = method
+        request.set('SAMLRequest', saml_request)
+        request.set('QUERY_STRING', query_string)
+        request.SESSION.set(self.plugin._uid,
+                            {'_login': 'jdoe',
+                             'name_id': nameid_to_str(self.name_id)})
+        view = self._getTargetClass()(self.plugin, request)
+        result = view()
+        return result, request
+
+    def _isRevoked(self):
+        return self.plugin.getSessionRegistry().isRevoked(
+            nameid_to_str(self.name_id), 'idx1')
+
+    def test_signed(self):
+        for binding in (BINDING_HTTP_POST, BINDING_HTTP_REDIRECT):
+            self.plugin.getSessionRegistry().register(
+                nameid_to_str(self.name_id), 'idx1')
+            result, request = self._call(
+                *self.idp.frontChannelRequest(self.name_id, binding))
+            self.assertNotEqual(result, 'Logout failed')
+            self.assertTrue(self._isRevoked())
+            self.assertFalse(request.SESSION.get(self.plugin._uid))
+
+    def _assertRejected(self, method, saml_request, query_string):
+        result, request = self._call(method, saml_request, query_string)
+        self.assertEqual(result, 'Logout failed')
+        self.assertFalse(self._isRevoked())
+        self.assertTrue(request.SESSION.get(self.plugin._uid))
+
+    def test_unsigned(self):
+        for binding in (BINDING_HTTP_POST, BINDING_HTTP_REDIRECT):
+            self._assertRejected(*self.idp.frontChannelRequest(
+                self.name_id, binding, sign=False))
+
+    def test_bad_signature(self):
+        # A signed POST request for another user
+        method, saml_request, _ = self.idp.frontChannelRequest(
+            self.name_id, BINDING_HTTP_POST)
+        xml = b64decode(saml_request).replace(b'>jdoe<', b'>jane<')
+        self._assertRejected(method, b64encode(xml).decode(), '')
+
+        # A redirect query string signature for another request
+        method, saml_request, query_string = self.idp.frontChannelRequest(
+            self.name_id, BINDING_HTTP_REDIRECT)
+        other = NameID(text='jane', format=NAMEID_FORMAT_PERSISTENT)
+        _, _, other_query = self.idp.frontChannelRequest(
+            other, BINDING_HTTP_REDIRECT)
+        signature = other_query[other_query.index('&Signature='):]
+        query_string = query_string[:query_string.index('&Signature=')]
+        self._assertRejected(method, saml_request, query_string + signature)
+
+
+class SAML2SOAPSingleLogoutViewTests(PluginViewsTestBase):
+
+    def _getTargetClass(self):
+        from ..singlelogout import SAML2SOAPSingleLogoutView
+        return SAML2SOAPSingleLogoutView
+
+    def setUp(self):
+        super().setUp()
+        self.tmpdir = tempfile.mkdtemp()
+        self.plugin = self._makeOne().context
+        cfg = self.plugin.getConfiguration()
+        self.idp = LocalIdP(cfg['key_file'], cfg['cert_file'],
+                            cfg['xmlsec_binary'], self.tmpdir)
+        cfg['metadata']['local'].append(self.idp.metadata_file)
+        cfg['service']['sp']['endpoints']['single_logout_service'] = [
+            (SP_SOAP_SLO_URL, BINDING_SOAP)]
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+        super().tearDown()
+
+    def _call(self, body, method='POST'):
+        request = DummyRequest()
+        request.method = method
+        request.set('BODY', body)
+        view = self._getTargetClass()(self.plugin, request)
+        return view(), request.RESPONSE
+
+    def _name_id(self, name='jdoe'):
+        return NameID(text=name, format=NAMEID_FORMAT_PERSISTENT)
+
+    def test_logout(self):
+        name_id = self._name_id()
+        registry = self.plugin.getSessionRegistry()
+        registry.register(nameid_to_str(name_id), 'idx1')
+
+        body, response = self._call(
+            self.idp.logoutRequest(name_id, ['idx1']))
+        self.assertEqual(response.headers['content-type'],
+                         'application/soap+xml')
+        self.assertTrue(self.idp.parseResponse(body).status_ok())
+        self.assertTrue(registry.isRevoked(nameid_to_str(name_id), 'idx1'))
+
+    def test_rejected(self):
+        name_id = self._name_id()
+        registry = self.plugin.getSessionRegistry()
+
+        # Only POST is supported
+        body, response = self._call(b'', method='GET')
+        self.assertEqual(response.status, 405)
+
+        # Garbage
+        body, response = self._call(b'<foo/>')
+        self.assertEqual(response.status, 500)
+        self.assertIn('Fault', body)
+
+        # Unsigned requests
+        body, response = self._call(
+            self.idp.logoutRequest(name_id, ['idx1'], sign=False))
+        self.assertEqual(response.status, 500)
+        self.assertFalse(registry.isRevoked(nameid_to_str(name_id), 'idx1'))
+
+        # Tampered requests
+        request = self.idp.logoutRequest(name_id, ['idx1'])
+        body, response = self._call(request.replace(b'>jdoe<', b'>jane<'))
+        self.assertEqual(response.status, 500)
+        self.assertFalse(registry.isRevoked(
+            nameid_to_str(self._name_id('jane')), 'idx1'))
+
+    def test_burst(self):
+        requests = [self.idp.logoutRequest(self._name_id(f'user{i}'),
+                                           [f'idx{i}'])
+                    for i in range(8)]
+        results = []
+
+        def work(offset):
+            for request in requests[offset::4]:
+                body, response = self._call(request)
+                results.append(self.idp.parseResponse(body).status_ok())
+
+        threads = [threading.Thread(target=work, args=(i,)) for i in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(results, [True] * 8)
+        registry = self.plugin.getSessionRegistry()
+        for i in range(8):
+            self.assertTrue(registry.isRevoked(
+                nameid_to_str(self._name_id(f'user{i}')), f'idx{i}'))
@@ -0,0 +1,131 @@
+##############################################################################
+#
+# Copyright (c) 2023 Jens Vagelpohl and Contributors. All Rights Reserved.
+#
+# This software is subject to the provisions of the Zope Public License,
+# Version 2.1 (ZPL).  A copy of the ZPL should accompany this distribution.
+# THIS SOFTWARE IS PROVIDED "AS IS" AND ANY AND ALL EXPRESS OR IMPLIED
+# WARRANTIES ARE DISCLAIMED, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF TITLE, MERCHANTABILITY, AGAINST INFRINGEMENT, AND FITNESS
+# FOR A PARTICULAR PURPOSE.
+#
+##############################################################################
+""" Recognize requests that cannot complete a browser login
+
+Each rule is one line of the plugin ``noninteractive_rules`` property::
+
+    method <method> [<method> ...]
+    header <header name> [<value> ...]
+    accept <media type> [<media type> ...]
+    path <regular expression>
+
+A request is non-interactive if any rule matches: its method is one of the
+listed methods (``method``), it carries the header, with one of the listed
+values if there are any (``header``), its ``Accept`` header names none of
+the listed media types (``accept``) or its path contains a match for the
+regular expression (``path``).
+"""
+
+import logging
+import re
+
+
+logger = logging.getLogger('Products.SAML2Plugins')
+CHALLENGE_CLASSIFIERS = {}
+NONINTERACTIVE_RULES = (
+    'method HEAD OPTIONS PUT DELETE PATCH PROPFIND',
+    'header X-Requested-With',
+    'header Sec-Fetch-Mode cors no-cors same-origin websocket',
+    'accept text/html application/xhtml+xml */*',
+    r'path (?i)\.(css|js|mjs|map|png|gif|jpe?g|svg|ico|webp|woff2?|ttf)$',
+)
+
+
+class ChallengeClassifier:
+    """ Non-interactive request rules compiled into lookup tables """
+
+    def __init__(self, rules=()):
+        self.methods = set()
+        self.headers = {}   # header name: set of values, empty for any
+        self.accept = set()
+        self.paths = []     # compiled patterns
+
+        for line in rules or ():
+            words = line.split()
+            if not words or words[0].startswith('#'):
+                continue
+            kind, values = words[0], words[1:]
+            if kind not in ('method', 'header', 'accept', 'path') or \
+               not values:
+                logger.warning(f'ChallengeClassifier: Invalid rule {line}')
+                continue
+
+            if kind == 'method':
+                self.methods.update(value.upper() for value in values)
+            elif kind == 'header':
+                header_values = self.headers.get(values[0])
+                if header_values is None or not values[1:]:
+                    # A rule without values matches any value
+                    self.headers[values[0]] = {v.lower() for v in values[1:]}
+                elif header_values:
+                    header_values.update(v.lower() for v in values[1:])
+            elif kind == 'accept':
+                self.accept.update(value.lower() for value in values)
+            else:
+                try:
+                    self.paths.append(re.compile(' '.join(values)))
+                except re.error as exc:
+                    logger.warning(
+                        f'ChallengeClassifier: Invalid rule {line}: {exc}')
+
+    def __bool__(self):
+        return bool(self.methods or self.headers or self.accept or
+                    self.paths)
+
+    def isInteractive(self, request):
+        """ Can the request be part of a browser login?
+
+        Args:
+            request (REQUEST): The current Zope request object
+
+        Returns:
+            True or False
+        """
+        if self.methods and \
+           request.get('REQUEST_METHOD', 'GET').upper() in self.methods:
+            return False
+
+        for name, values in self.headers.items():
+            value = request.getHeader(name)
+            if value is not None and \
+               (not values or value.strip().lower() in values):
+                return False
+
+        if self.accept:
+            accept = request.getHeader('Accept')
+            if accept:
+                media_types = {x.split(';', 1)[0].strip().lower()
+                               for x in accept.split(',')}
+                if not media_types & self.accept:
+                    return False
+
+        if self.paths:
+            path = request.get('PATH_INFO', '')
+            for pattern in self.paths:
+                if pattern.search(path):
+                    return False
+
+        return True
+
+
+def getChallengeClassifier(rules):
+    """ Get or create the compiled classifier for a list of rules """
+    cache_key = tuple(rules or ())
+    if cache_key not in CHALLENGE_CLASSIFIERS:
+        CHALLENGE_CLASSIFIERS[cache_key] = ChallengeClassifier(cache_key)
+    return CHALLENGE_CLASSIFIERS[cache_key]
+
+
+def clearChallengeClassifiers():
+    """ Clear all compiled challenge classifiers """
+    CHALLENGE_CLASSIFIERS.clear()
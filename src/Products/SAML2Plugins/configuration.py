@@ -21,13 +21,21 @@ import os
 import pprint
 import sys
 
-from saml2.config import Config
-
 from AccessControl import ClassSecurityInfo
 from AccessControl.class_init import InitializeClass
 from AccessControl.Permissions import manage_users
 from App.config import getConfiguration
 
+from .authnrequest import clearAuthnRequestTemplates
+from .challenge import clearChallengeClassifiers
+from .discovery import clearDiscoveryIndexes
+from .encryption import clearEncryptionKeyIndexes
+from .endpoints import clearEndpointIndexes
+from .metadata import clearMetadataDocuments
+from .monkeypatch import applyPatches
+from .projection import clearAttributeProjections
+from .roles import clearRoleMappers
+
 
 logger = logging.getLogger('Products.SAML2Plugins')
 CONFIGS = {}
@@ -60,6 +68,14 @@ def setPySAML2Configuration(uid, config):
 def clearConfigurationCaches():
     """ Clear all cached configurations """
     CONFIGS.clear()
+    clearEncryptionKeyIndexes()
+    clearAttributeProjections()
+    clearRoleMappers()
+    clearChallengeClassifiers()
+    clearDiscoveryIndexes()
+    clearEndpointIndexes()
+    clearAuthnRequestTemplates()
+    clearMetadataDocuments()
 
 
 class PySAML2ConfigurationSupport:
@@ -307,6 +323,9 @@ class PySAML2ConfigurationSupport:
         cfg = getPySAML2Configuration(self._uid)
 
         if cfg is None:
+            applyPatches()
+            from saml2.config import Config
+
             cfg = Config()
             try:
                 cfg.load(copy.deepcopy(self.getConfiguration()))
@@ -0,0 +1,333 @@
+##############################################################################
+#
+# Copyright (c) 2023 Jens Vagelpohl and Contributors. All Rights Reserved.
+#
+# This software is subject to the provisions of the Zope Public License,
+# Version 2.1 (ZPL).  A copy of the ZPL should accompany this distribution.
+# THIS SOFTWARE IS PROVIDED "AS IS" AND ANY AND ALL EXPRESS OR IMPLIED
+# WARRANTIES ARE DISCLAIMED, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF TITLE, MERCHANTABILITY, AGAINST INFRINGEMENT, AND FITNESS
+# FOR A PARTICULAR PURPOSE.
+#
+##############################################################################
+""" Identity provider discovery search index and logo cache
+
+The index is built once for each loaded metadata store from the
+``mdui:UIInfo`` and ``mdui:DiscoHints`` metadata extensions. It maps every
+prefix of every word in display names, keywords and domain names to the
+identity providers carrying that word, so a typeahead query is a few
+dictionary lookups and an intersection of sorted position lists.
+"""
+
+import base64
+import re
+import threading
+import time
+import unicodedata
+from bisect import bisect_left
+from collections import OrderedDict
+from urllib.parse import unquote_to_bytes
+from urllib.parse import urlsplit
+
+
+DISCOVERY_INDEXES = {}
+LOGOS = OrderedDict()
+LOGOS_LOCK = threading.Lock()
+MAX_PREFIX_LENGTH = 16
+MAX_LOGOS = 1000
+MAX_LOGO_SIZE = 100 * 1024  # bytes
+LOGO_TTL = 86400  # seconds
+LOGO_FAILURE_TTL = 600  # seconds
+# Raster formats only, SVG logos could carry scripts
+LOGO_CONTENT_TYPES = frozenset(('image/gif', 'image/jpeg', 'image/png',
+                                'image/webp'))
+MDUI_UIINFO = 'urn:oasis:names:tc:SAML:metadata:ui&UIInfo'
+MDUI_DISCOHINTS = 'urn:oasis:names:tc:SAML:metadata:ui&DiscoHints'
+WORD = re.compile(r'\w+')
+
+
+def normalize(text):
+    """ Case-fold a string and remove accents """
+    decomposed = unicodedata.normalize('NFKD', text.casefold())
+    return ''.join(c for c in decomposed if not unicodedata.combining(c))
+
+
+def tokenize(text):
+    """ Split a string into normalized words """
+    return WORD.findall(normalize(text))
+
+
+def _texts(elements, lang=None):
+    return [element['text'].strip() for element in elements or ()
+            if element.get('text') and
+            (lang is None or element.get('lang') == lang)]
+
+
+def _size(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return 0
+
+
+def discoveryEntries(metadata, lang='en'):
+    """ Extract discovery information for all identity providers
+
+    Args:
+        metadata (saml2.mdstore.MetadataStore): The metadata store
+
+    Kwargs:
+        lang (str): The preferred language for display names
+
+    Returns:
+        A generator of mappings with the keys ``entity_id``, ``name``,
+        ``names``, ``keywords``, ``domains`` and ``logo``
+    """
+    for entity_id, entity in metadata.with_descriptor('idpsso').items():
+        names = []
+        preferred_names = []
+        keywords = []
+        domains = []
+        logos = []
+        for descriptor in entity.get('idpsso_descriptor', ()):
+            extensions = descriptor.get('extensions') or {}
+            for element in extensions.get('extension_elements', ()):
+                if element.get('__class__') == MDUI_UIINFO:
+                    names.extend(_texts(element.get('display_name')))
+                    preferred_names.extend(
+                        _texts(element.get('display_name'), lang))
+                    for value in _texts(element.get('keywords')):
+                        # Multi-word keywords use "+" instead of spaces
+                        keywords.extend(k.replace('+', ' ')
+                                        for k in value.split())
+                    logos.extend(element.get('logo') or ())
+                elif element.get('__class__') == MDUI_DISCOHINTS:
+                    domains.extend(_texts(element.get('domain_hint')))
+
+        name = (preferred_names or names or
+                [metadata.name(entity_id, lang) or entity_id])[0]
+        # Use the smallest logo, discovery lists show them small
+        logo = ''
+        if logos:
+            logos.sort(key=lambda x: (_size(x.get('height')),
+                                      _size(x.get('width'))))
+            logo = (logos[0].get('text') or '').strip()
+
+        yield {'entity_id': entity_id,
+               'name': name,
+               'names': tuple(dict.fromkeys(names)),
+               'keywords': tuple(dict.fromkeys(keywords)),
+               'domains': tuple(dict.fromkeys(domains)),
+               'logo': logo}
+
+
+def _contains(positions, position):
+    # Binary search in a sorted tuple of positions
+    i = bisect_left(positions, position)
+    return i < len(positions) and positions[i] == position
+
+
+class DiscoveryIndex:
+    """ Prefix search index over identity provider discovery information
+
+    Entries are kept sorted by display name, search results come out in
+    that order.
+    """
+
+    def __init__(self, entries):
+        self.entries = tuple(sorted(
+            entries, key=lambda x: (normalize(x['name']), x['entity_id'])))
+        self._positions = {}
+        self._words = []
+        prefixes = {}
+
+        for position, entry in enumerate(self.entries):
+            self._positions[entry['entity_id']] = position
+            words = set()
+            for text in (entry['name'], *entry['names'], *entry['keywords']):
+                words.update(tokenize(text))
+            for domain in entry['domains']:
+                # Find domains by their full name and by each label
+                words.add(normalize(domain))
+                words.update(tokenize(domain))
+            host = urlsplit(entry['entity_id']).hostname
+            if host:
+                words.add(host)
+            self._words.append(frozenset(words))
+
+            for prefix in {word[:length]
+                           for word in words
+                           for length in range(
+                               1, min(len(word), MAX_PREFIX_LENGTH) + 1)}:
+                prefixes.setdefault(prefix, []).append(position)
+
+        # Positions are appended in ascending order
+        self._prefixes = {prefix: tuple(positions)
+                          for prefix, positions in prefixes.items()}
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get(self, entity_id):
+        """ Get the entry for an identity provider or None """
+        position = self._positions.get(entity_id)
+        if position is None:
+            return None
+        return self.entries[position]
+
+    def search(self, query, limit=20):
+        """ Find identity providers
+
+        Every word of the query must be the start of a word in a display
+        name, keyword or domain of the identity provider.
+
+        Args:
+            query (str): The search text
+
+        Kwargs:
+            limit (int): The maximum number of results
+
+        Returns:
+            A list of entries, sorted by display name
+        """
+        normalized = normalize(query)
+        terms = set(WORD.findall(normalized))
+        # Let people type domain names
+        terms.update(word for word in normalized.split() if '.' in word)
+        if not terms:
+            return list(self.entries[:limit])
+
+        matches = []
+        for term in terms:
+            positions = self._prefixes.get(term[:MAX_PREFIX_LENGTH])
+            if positions is None:
+                return []
+            matches.append(positions)
+        matches.sort(key=len)
+
+        others = matches[1:]
+        long_terms = [term for term in terms
+                      if len(term) > MAX_PREFIX_LENGTH]
+        results = []
+        for position in matches[0]:
+            if all(_contains(other, position) for other in others) and \
+               all(any(word.startswith(term)
+                       for word in self._words[position])
+                   for term in long_terms):
+                results.append(self.entries[position])
+                if len(results) >= limit:
+                    break
+
+        return results
+
+
+def getDiscoveryIndex(uid, metadata):
+    """ Get or build the discovery index for a metadata store
+
+    A new index is built when the plugin configuration and its metadata
+    have been loaded again.
+
+    Args:
+        uid (str): The plugin UID
+
+        metadata (saml2.mdstore.MetadataStore or None): The metadata store
+    """
+    cached = DISCOVERY_INDEXES.get(uid)
+    if cached is None or cached[0] is not metadata:
+        if metadata is None:
+            index = DiscoveryIndex(())
+        else:
+            index = DiscoveryIndex(discoveryEntries(metadata))
+        cached = DISCOVERY_INDEXES[uid] = (metadata, index)
+    return cached[1]
+
+
+def clearDiscoveryIndexes():
+    """ Remove all discovery indexes """
+    DISCOVERY_INDEXES.clear()
+
+
+def _logoContentType(content_type):
+    content_type = content_type.split(';', 1)[0].strip().lower()
+    if content_type in LOGO_CONTENT_TYPES:
+        return content_type
+    return None
+
+
+def _fetchLogo(url, timeout):
+    parsed = urlsplit(url)
+    if parsed.scheme == 'data':
+        # data:image/png;base64,...
+        header, _, data = parsed.path.partition(',')
+        content_type, _, encoding = header.partition(';')
+        content_type = _logoContentType(content_type or 'image/png')
+        if content_type is None:
+            return None
+        if encoding == 'base64':
+            data = base64.b64decode(data, validate=True)
+        else:
+            data = unquote_to_bytes(data)
+        if not data:
+            return None
+        return content_type, data[:MAX_LOGO_SIZE + 1]
+
+    if parsed.scheme not in ('http', 'https'):
+        return None
+
+    import requests
+
+    with requests.get(url, timeout=timeout, stream=True,
+                      allow_redirects=False) as response:
+        response.raise_for_status()
+        content_type = _logoContentType(
+            response.headers.get('Content-Type', ''))
+        if content_type is None:
+            return None
+        data = response.raw.read(MAX_LOGO_SIZE + 1, decode_content=True)
+    return content_type, data
+
+
+def getLogo(url, timeout=5):
+    """ Get identity provider logo data from the logo cache
+
+    Logos are fetched once and kept for a day, failures are remembered
+    for a few minutes. Logos larger than ``MAX_LOGO_SIZE`` and logos that
+    are not PNG, GIF, JPEG or WebP images are rejected.
+
+    Args:
+        url (str): The logo URL from the metadata, HTTP(S) or data URL
+
+    Kwargs:
+        timeout (float): Timeout in seconds for fetching the logo
+
+    Returns:
+        A (content type, data) tuple or None
+    """
+    now = time.time()
+    with LOGOS_LOCK:
+        cached = LOGOS.get(url)
+        if cached is not None and cached[0] > now:
+            LOGOS.move_to_end(url)
+            return cached[1]
+
+    try:
+        logo = _fetchLogo(url, timeout)
+    except Exception:
+        logo = None
+    if logo is not None and len(logo[1]) > MAX_LOGO_SIZE:
+        logo = None
+    expiration = now + (LOGO_TTL if logo is not None else LOGO_FAILURE_TTL)
+
+    with LOGOS_LOCK:
+        LOGOS[url] = (expiration, logo)
+        LOGOS.move_to_end(url)
+        while len(LOGOS) > MAX_LOGOS:
+            LOGOS.popitem(last=False)
+
+    return logo
+
+
+def clearLogoCache():
+    """ Remove all cached logos """
+    with LOGOS_LOCK:
+        LOGOS.clear()
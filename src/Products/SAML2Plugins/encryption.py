@@ -0,0 +1,248 @@
+##############################################################################
+#
+# Copyright (c) 2023 Jens Vagelpohl and Contributors. All Rights Reserved.
+#
+# This software is subject to the provisions of the Zope Public License,
+# Version 2.1 (ZPL).  A copy of the ZPL should accompany this distribution.
+# THIS SOFTWARE IS PROVIDED "AS IS" AND ANY AND ALL EXPRESS OR IMPLIED
+# WARRANTIES ARE DISCLAIMED, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF TITLE, MERCHANTABILITY, AGAINST INFRINGEMENT, AND FITNESS
+# FOR A PARTICULAR PURPOSE.
+#
+##############################################################################
+""" Decryption key selection based on KeyInfo hints
+"""
+
+import base64
+import binascii
+import hashlib
+import itertools
+import logging
+
+from cryptography import x509
+from cryptography.hazmat.primitives.asymmetric.rsa import RSAPublicKey
+from cryptography.hazmat.primitives.serialization import Encoding
+from defusedxml import ElementTree
+
+
+logger = logging.getLogger('Products.SAML2Plugins')
+KEY_INDEXES = {}
+
+NS_DS = 'http://www.w3.org/2000/09/xmldsig#'
+NS_DS11 = 'http://www.w3.org/2009/xmldsig11#'
+NS_XENC = 'http://www.w3.org/2001/04/xmlenc#'
+
+# Digest algorithms that may show up in dsig11:X509Digest hints
+DIGEST_ALGORITHMS = {
+    'http://www.w3.org/2000/09/xmldsig#sha1': 'sha1',
+    'http://www.w3.org/2001/04/xmldsig-more#sha224': 'sha224',
+    'http://www.w3.org/2001/04/xmlenc#sha256': 'sha256',
+    'http://www.w3.org/2001/04/xmldsig-more#sha384': 'sha384',
+    'http://www.w3.org/2001/04/xmlenc#sha512': 'sha512',
+}
+
+
+def _b64decode(text):
+    """ Decode base64 element text, returns None for bad input """
+    try:
+        return base64.b64decode(''.join((text or '').split()), validate=True)
+    except (binascii.Error, ValueError):
+        return None
+
+
+def _sha256(data):
+    return hashlib.sha256(data).digest()
+
+
+def _modulus_hint(modulus):
+    """ Hash the big-endian representation of a RSA modulus """
+    if isinstance(modulus, int):
+        modulus = modulus.to_bytes((modulus.bit_length() + 7) // 8, 'big')
+    return ('modulus', _sha256(modulus.lstrip(b'\x00')))
+
+
+def certificate_hints(cert):
+    """ Compute all lookup keys a KeyInfo element may reference
+
+    Args:
+        cert (cryptography.x509.Certificate): The encryption certificate
+
+    Returns:
+        A list of hashable hint tuples
+    """
+    der = cert.public_bytes(Encoding.DER)
+    hints = [('der', _sha256(der)), ('serial', cert.serial_number)]
+
+    for algorithm in DIGEST_ALGORITHMS.values():
+        digest = hashlib.new(algorithm, der).digest()
+        hints.append(('digest', algorithm, digest))
+
+    public_key = cert.public_key()
+    try:
+        ski = cert.extensions.get_extension_for_class(
+            x509.SubjectKeyIdentifier).value.digest
+    except x509.ExtensionNotFound:
+        ski = x509.SubjectKeyIdentifier.from_public_key(public_key).digest
+    hints.append(('ski', ski))
+
+    if isinstance(public_key, RSAPublicKey):
+        hints.append(_modulus_hint(public_key.public_numbers().n))
+
+    return hints
+
+
+def document_hints(enctext):
+    """ Extract key hints from all EncryptedKey elements in a document
+
+    Args:
+        enctext (str or bytes): XML document containing encrypted data
+
+    Returns:
+        A list of hint tuples in document order, empty if there are none
+    """
+    try:
+        root = ElementTree.fromstring(enctext)
+    except Exception:
+        return []
+
+    hints = []
+    for enc_key in root.iter(f'{{{NS_XENC}}}EncryptedKey'):
+        key_info = enc_key.find(f'{{{NS_DS}}}KeyInfo')
+        if key_info is None:
+            continue
+
+        for elem in key_info.iter():
+            if elem.tag == f'{{{NS_DS}}}X509Certificate':
+                value = _b64decode(elem.text)
+                if value:
+                    hints.append(('der', _sha256(value)))
+            elif elem.tag == f'{{{NS_DS}}}X509SKI':
+                value = _b64decode(elem.text)
+                if value:
+                    hints.append(('ski', value))
+            elif elem.tag == f'{{{NS_DS}}}X509SerialNumber':
+                try:
+                    hints.append(('serial', int((elem.text or '').strip())))
+                except ValueError:
+                    pass
+            elif elem.tag == f'{{{NS_DS11}}}X509Digest':
+                algorithm = DIGEST_ALGORITHMS.get(elem.get('Algorithm'))
+                value = _b64decode(elem.text)
+                if algorithm and value:
+                    hints.append(('digest', algorithm, value))
+            elif elem.tag == f'{{{NS_DS}}}Modulus':
+                value = _b64decode(elem.text)
+                if value:
+                    hints.append(_modulus_hint(value))
+
+    return hints
+
+
+class EncryptionKeyIndex:
+    """ Index of private key files keyed on certificate properties
+
+    The index maps certificate fingerprints, subject key identifiers,
+    serial numbers and RSA modulus hashes of all configured
+    ``encryption_keypairs`` to the matching private key file.
+    """
+
+    def __init__(self, keypairs):
+        self.key_files = []
+        self._hints = {}
+
+        for keypair in keypairs or ():
+            key_file = keypair.get('key_file')
+            cert_file = keypair.get('cert_file')
+            if not key_file:
+                continue
+            self.key_files.append(key_file)
+
+            if not cert_file:
+                continue
+
+            try:
+                with open(cert_file, 'rb') as fp:
+                    cert = x509.load_pem_x509_certificate(fp.read())
+            except Exception as exc:
+                logger.warning(
+                    f'EncryptionKeyIndex: Cannot index {cert_file}: {exc}')
+                continue
+
+            for hint in certificate_hints(cert):
+                self._hints.setdefault(hint, key_file)
+
+    def __len__(self):
+        return len(self._hints)
+
+    def select(self, enctext):
+        """ Find the private key files referenced by a document
+
+        Args:
+            enctext (str or bytes): XML document containing encrypted data
+
+        Returns:
+            A list of key file paths, empty if the document carries no
+            usable key hint.
+        """
+        key_files = []
+        for hint in document_hints(enctext):
+            key_file = self._hints.get(hint)
+            if key_file and key_file not in key_files:
+                key_files.append(key_file)
+        return key_files
+
+
+def getEncryptionKeyIndex(keypairs):
+    """ Get or create the key index for a list of encryption keypairs
+
+    Args:
+        keypairs (list): The pysaml2 ``encryption_keypairs`` setting
+
+    Returns:
+        An EncryptionKeyIndex instance
+    """
+    cache_key = tuple((kp.get('key_file'), kp.get('cert_file'))
+                      for kp in keypairs or ())
+    if cache_key not in KEY_INDEXES:
+        KEY_INDEXES[cache_key] = EncryptionKeyIndex(keypairs)
+    return KEY_INDEXES[cache_key]
+
+
+def clearEncryptionKeyIndexes():
+    """ Clear all cached encryption key indexes """
+    KEY_INDEXES.clear()
+
+
+def decrypt_with_key_hints(self, enctext, key_file=None):
+    """ Decrypt with the key named in the KeyInfo hints first
+
+    Drop-in replacement for ``saml2.sigver.SecurityContext.decrypt``.
+    Keys matching a hint in the ``EncryptedKey`` element are tried first,
+    all other keys are only tried if the hinted keys fail or if the
+    document does not carry any hint.
+    """
+    from saml2.sigver import DecryptError
+    from saml2.sigver import XmlsecError
+
+    if not isinstance(key_file, list):
+        key_file = [key_file]
+
+    key_files = [key for key in itertools.chain(key_file,
+                                                self.enc_key_files or ())
+                 if key]
+    hinted = getEncryptionKeyIndex(self.encryption_keypairs).select(enctext)
+    if hinted:
+        logger.debug(f'decrypt: Using key hint for {hinted[0]}')
+        key_files = hinted + [key for key in key_files if key not in hinted]
+
+    for key_file in key_files:
+        try:
+            dectext = self.crypto.decrypt(enctext, key_file)
+        except XmlsecError:
+            continue
+        else:
+            if dectext:
+                return dectext
+
+    raise DecryptError(
+        f'No key was able to decrypt the ciphertext. Keys tried: {key_files}')
@@ -0,0 +1,184 @@
+##############################################################################
+#
+# Copyright (c) 2023 Jens Vagelpohl and Contributors. All Rights Reserved.
+#
+# This software is subject to the provisions of the Zope Public License,
+# Version 2.1 (ZPL).  A copy of the ZPL should accompany this distribution.
+# THIS SOFTWARE IS PROVIDED "AS IS" AND ANY AND ALL EXPRESS OR IMPLIED
+# WARRANTIES ARE DISCLAIMED, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF TITLE, MERCHANTABILITY, AGAINST INFRINGEMENT, AND FITNESS
+# FOR A PARTICULAR PURPOSE.
+#
+##############################################################################
+""" Per-entity index of metadata service endpoints
+
+The ``pysaml2`` metadata store answers questions like "does any identity
+provider offer a single logout service" by walking all entities in all
+loaded metadata sources. The index walks them once for each loaded metadata
+store and keeps the endpoints of each entity by descriptor type, service and
+binding, so the same questions about a single entity are dictionary lookups.
+"""
+
+from saml2 import BINDING_HTTP_POST
+from saml2 import BINDING_HTTP_REDIRECT
+
+
+ENDPOINT_INDEXES = {}
+# Binding preference for authentication requests, same as pysaml2
+SSO_BINDINGS = (BINDING_HTTP_REDIRECT, BINDING_HTTP_POST)
+SERVICES = {
+    'idpsso': ('single_sign_on_service',
+               'single_logout_service',
+               'artifact_resolution_service'),
+    'spsso': ('assertion_consumer_service',
+              'single_logout_service',
+              'artifact_resolution_service'),
+}
+
+
+class EndpointIndex:
+    """ Service endpoints of all entities in a metadata store """
+
+    def __init__(self, entities=()):
+        # {(entity_id, typ, service): ((binding, location), ...)}
+        self._endpoints = {}
+        # {(typ, service): {binding, ...}}
+        self._bindings = {}
+        self._identity_providers = []
+
+        for entity_id, entity in entities:
+            if entity.get('idpsso_descriptor'):
+                self._identity_providers.append(entity_id)
+            for typ, services in SERVICES.items():
+                for descriptor in entity.get(f'{typ}_descriptor') or ():
+                    for service in services:
+                        endpoints = self._endpoints.setdefault(
+                            (entity_id, typ, service), [])
+                        for endpoint in descriptor.get(service) or ():
+                            binding = endpoint.get('binding')
+                            location = endpoint.get('location')
+                            if binding and location:
+                                endpoints.append((binding, location))
+                                self._bindings.setdefault(
+                                    (typ, service), set()).add(binding)
+
+        self._endpoints = {key: tuple(value)
+                           for key, value in self._endpoints.items()
+                           if value}
+
+        # {entity_id: (binding, location)} for authentication requests
+        self._sso = {}
+        for entity_id in self._identity_providers:
+            for binding in SSO_BINDINGS:
+                location = self.location(entity_id, 'single_sign_on_service',
+                                         binding)
+                if location:
+                    self._sso[entity_id] = (binding, location)
+                    break
+
+    def endpoints(self, entity_id, service, typ='idpsso'):
+        """ Get the endpoints of an entity for a service
+
+        Args:
+            entity_id (str): The entity ID
+
+            service (str): The service name, e.g.
+                ``single_logout_service``
+
+        Kwargs:
+            typ (str): The descriptor type, ``idpsso`` or ``spsso``
+
+        Returns:
+            A tuple of (binding, location) tuples in metadata order
+        """
+        return self._endpoints.get((entity_id, typ, service), ())
+
+    def bindings(self, entity_id, service, typ='idpsso'):
+        """ Get the bindings an entity supports for a service
+
+        Returns:
+            A tuple of binding URIs in metadata order
+        """
+        return tuple(dict.fromkeys(
+            binding for binding, _ in self.endpoints(entity_id, service, typ)))
+
+    def location(self, entity_id, service, binding, typ='idpsso'):
+        """ Get the first endpoint location for a service binding
+
+        Returns:
+            The endpoint location or None
+        """
+        for endpoint_binding, location in self.endpoints(entity_id, service,
+                                                         typ):
+            if endpoint_binding == binding:
+                return location
+        return None
+
+    def supports(self, entity_id, service, bindings, typ='idpsso'):
+        """ Does an entity support a service with any of the bindings?
+
+        Args:
+            entity_id (str or None): The entity ID. If it is None, look for
+                any entity that supports the service.
+
+            service (str): The service name
+
+            bindings (iterable): Binding URIs
+
+        Kwargs:
+            typ (str): The descriptor type, ``idpsso`` or ``spsso``
+
+        Returns:
+            True or False
+        """
+        if entity_id is None:
+            supported = self._bindings.get((typ, service), ())
+        else:
+            supported = self.bindings(entity_id, service, typ)
+        return any(binding in supported for binding in bindings)
+
+    def ssoDestination(self, entity_id=None):
+        """ Get the binding and location for authentication requests
+
+        The binding is negotiated like ``pysaml2`` does it, HTTP-Redirect is
+        preferred over HTTP-POST.
+
+        Kwargs:
+            entity_id (str or None): The identity provider entity ID.
+                Defaults to the only identity provider in the metadata.
+
+        Returns:
+            A (binding, location) tuple or None if the identity provider is
+            unknown or ambiguous or supports neither binding.
+        """
+        if entity_id is None:
+            if len(self._identity_providers) != 1:
+                return None
+            entity_id = self._identity_providers[0]
+        return self._sso.get(entity_id)
+
+
+def getEndpointIndex(uid, metadata):
+    """ Get or build the endpoint index for a metadata store
+
+    A new index is built when the plugin configuration and its metadata
+    have been loaded again.
+
+    Args:
+        uid (str): The plugin UID
+
+        metadata (saml2.mdstore.MetadataStore or None): The metadata store
+    """
+    cached = ENDPOINT_INDEXES.get(uid)
+    if cached is None or cached[0] is not metadata:
+        if metadata is None:
+            index = EndpointIndex()
+        else:
+            index = EndpointIndex(metadata.items())
+        cached = ENDPOINT_INDEXES[uid] = (metadata, index)
+    return cached[1]
+
+
+def clearEndpointIndexes():
+    """ Remove all endpoint indexes """
+    ENDPOINT_INDEXES.clear()
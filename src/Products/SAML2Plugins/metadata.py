@@ -14,20 +14,266 @@
 """
 
 import copy
+import functools
+import hashlib
+import logging
+import threading
+import time
+from datetime import timezone
+from email.utils import formatdate
+from email.utils import parsedate_to_datetime
 from xml.dom.minidom import parseString
 
-from saml2.config import Config
-from saml2.metadata import entities_descriptor
-from saml2.metadata import entity_descriptor
-from saml2.metadata import metadata_tostring_fix
-from saml2.metadata import sign_entity_descriptor
-from saml2.sigver import security_context
-from saml2.validate import valid_instance
-
 from AccessControl import ClassSecurityInfo
 from AccessControl.class_init import InitializeClass
 from AccessControl.Permissions import manage_users
 
+from .monkeypatch import applyPatches
+
+
+logger = logging.getLogger('Products.SAML2Plugins')
+METADATA_DOCUMENTS = {}
+METADATA_LOCK = threading.Lock()
+SIGNING_RETRY_INTERVAL = 60  # seconds
+
+
+class MetadataDocument:
+    """ Rendered metadata with HTTP cache validators """
+
+    def __init__(self, xml, valid_for=None):
+        self.data = xml.encode('utf-8')
+        self.etag = f'"{hashlib.sha256(self.data).hexdigest()[:32]}"'
+        self.generated = int(time.time())
+        self.last_modified = formatdate(self.generated, usegmt=True)
+        # Render again once half of the validity period has passed, so
+        # clients never get a document that is about to expire
+        if valid_for:
+            self.expires = self.generated + float(valid_for) * 1800
+        else:
+            self.expires = None
+
+    def isExpired(self, now=None):
+        """ Must the document be rendered again? """
+        if self.expires is None:
+            return False
+        return (now or time.time()) >= self.expires
+
+    def maxAge(self, max_age, now=None):
+        """ Get the ``Cache-Control`` lifetime in seconds
+
+        Args:
+            max_age (int): The configured maximum lifetime
+
+        Returns:
+            The configured lifetime, but not beyond the document expiration
+        """
+        max_age = max(int(max_age or 0), 0)
+        if self.expires is not None:
+            remaining = self.expires - (now or time.time())
+            max_age = min(max_age, max(int(remaining), 0))
+        return max_age
+
+    def isNotModified(self, if_none_match=None, if_modified_since=None):
+        """ Does a conditional request match the document?
+
+        ``If-Modified-Since`` is ignored if ``If-None-Match`` is given.
+
+        Kwargs:
+            if_none_match (str or None): The ``If-None-Match`` header value
+
+            if_modified_since (str or None): The ``If-Modified-Since`` header
+                value
+
+        Returns:
+            True if the client copy is current, False otherwise
+        """
+        if if_none_match:
+            for etag in if_none_match.split(','):
+                etag = etag.strip()
+                if etag == '*' or etag.removeprefix('W/') == self.etag:
+                    return True
+            return False
+
+        if if_modified_since:
+            try:
+                since = parsedate_to_datetime(if_modified_since)
+            except (TypeError, ValueError):
+                return False
+            if since.tzinfo is None:
+                since = since.replace(tzinfo=timezone.utc)
+            return self.generated <= since.timestamp()
+
+        return False
+
+
+class MetadataSigner:
+    """ Sign metadata in a worker thread ahead of its expiration
+
+    The first signature is started right away. Documents with a validity
+    period are signed again when they expire, which is after half of that
+    period, and the previous document is served until the new one is ready.
+    Failed signing runs are retried after ``SIGNING_RETRY_INTERVAL`` seconds.
+
+    Signing runs are scheduled with ``timer``, a callable with the
+    signature of ``threading.Timer`` returning an object with ``start``
+    and ``cancel`` methods.
+    """
+
+    def __init__(self, render, valid_for=None, timer=threading.Timer):
+        self.render = render
+        self.valid_for = valid_for
+        self.timer = timer
+        self.document = None
+        self.error = None
+        self._lock = threading.Lock()
+        self._timer = None
+        self._cancelled = False
+        self._schedule(0)
+
+    def _schedule(self, delay):
+        with self._lock:
+            if self._cancelled:
+                return
+            self._timer = self.timer(delay, self._sign)
+            self._timer.daemon = True
+            self._timer.start()
+
+    def _sign(self):
+        try:
+            document = MetadataDocument(self.render(), self.valid_for)
+        except Exception as exc:
+            logger.error(f'MetadataSigner: Cannot sign metadata: {exc}')
+            # Only keep the message, the exception holds on to the frames
+            # of the failed signing run through its traceback
+            self.error = str(exc) or exc.__class__.__name__
+            self._schedule(SIGNING_RETRY_INTERVAL)
+            return
+
+        self.document = document
+        self.error = None
+        if document.expires is not None:
+            self._schedule(max(document.expires - time.time(), 0))
+
+    def isExpired(self, now=None):
+        """ Signed documents are replaced before they expire """
+        return False
+
+    def cancel(self):
+        """ Stop signing """
+        with self._lock:
+            self._cancelled = True
+            if self._timer is not None:
+                self._timer.cancel()
+
+    def getDocument(self):
+        """ Get the last signed document without waiting for signing runs
+
+        Returns:
+            A ``MetadataDocument`` instance or None if no document has been
+            signed yet, because the first signature is not ready or failed
+        """
+        return self.document
+
+
+def renderMetadata(configuration, uid, sign=False, envelope=False):
+    """ Render XML metadata from a plugin configuration
+
+    The metadata generation assumes that a pysaml2 configuration only
+    describes a single entity/service.
+
+    Args:
+        configuration (dict): The plugin configuration
+
+        uid (str): The plugin UID
+
+    Kwargs:
+        sign (bool): Sign the metadata
+
+        envelope (bool): Wrap the entity in an ``EntitiesDescriptor``
+
+    Returns:
+        An unencoded string representing the XML metadata description
+    """
+    applyPatches()
+    from saml2.config import Config
+    from saml2.metadata import entities_descriptor
+    from saml2.metadata import entity_descriptor
+    from saml2.metadata import metadata_tostring_fix
+    from saml2.metadata import sign_entity_descriptor
+    from saml2.sigver import security_context
+    from saml2.validate import valid_instance
+
+    nspair = {"xs": "http://www.w3.org/2001/XMLSchema"}
+    config = copy.deepcopy(configuration)
+    xmldoc = None
+
+    # Configuration for a single entity (XML EntityDescriptor element)
+    entity_cfg = Config().load(config)
+    entity = entity_descriptor(entity_cfg)
+
+    if envelope:
+        # To make sure signing information only shows up on the enclosing
+        # envelope, remove it for the entity configuration.
+        key_file = config.pop('key_file', '')
+        cert_file = config.pop('cert_file', '')
+
+        # Configuration for the XML EntityDescriptors envelope
+        pysaml2_conf = Config()
+        pysaml2_conf.key_file = key_file
+        pysaml2_conf.cert_file = cert_file
+        pysaml2_conf.debug = 1
+        pysaml2_conf.xmlsec_binary = config.get('xmlsec1_binary')
+        security_ctx = security_context(pysaml2_conf)
+
+        entities, xmldoc = entities_descriptor([entity],
+                                               entity_cfg.valid_for,
+                                               '',  # name argument
+                                               uid,  # id argument
+                                               sign,
+                                               security_ctx)
+        valid_instance(entities)
+        xmldoc = metadata_tostring_fix(entities, nspair, xmldoc)
+    else:
+        valid_instance(entity)
+        if sign:
+            security_ctx = security_context(entity_cfg)
+            entity, xmldoc = sign_entity_descriptor(
+                entity, config['entityid'], security_ctx)
+        xmldoc = metadata_tostring_fix(entity, nspair, xmldoc)
+
+    if isinstance(xmldoc, bytes):
+        xmldoc = xmldoc.decode("utf-8")
+
+    # Transform to a pretty representation
+    data_dom = parseString(xmldoc)
+    return data_dom.toprettyxml(indent='  ')
+
+
+def clearMetadataDocument(uid):
+    """ Remove the rendered metadata of a plugin and stop signing it
+
+    Args:
+        uid (str): The plugin UID
+    """
+    with METADATA_LOCK:
+        cached = METADATA_DOCUMENTS.pop(uid, None)
+    if cached is not None and isinstance(cached[2], MetadataSigner):
+        cached[2].cancel()
+
+
+def stopMetadataSigning(plugin, event):
+    """ Stop signing metadata for a plugin that is removed """
+    clearMetadataDocument(plugin._uid)
+
+
+def clearMetadataDocuments():
+    """ Remove all rendered metadata documents and stop signing them """
+    with METADATA_LOCK:
+        for cached in METADATA_DOCUMENTS.values():
+            if isinstance(cached[2], MetadataSigner):
+                cached[2].cancel()
+        METADATA_DOCUMENTS.clear()
+
 
 class SAML2MetadataProvider:
 
@@ -41,6 +287,62 @@ class SAML2MetadataProvider:
         except Exception as exc:
             return (f'Error creating metadata XML:\n{exc}')
 
+    @security.private
+    def getMetadataDocument(self):
+        """ Get the rendered metadata for the current configuration
+
+        The metadata is rendered once for each loaded ``pysaml2``
+        configuration and metadata settings. If the configuration sets
+        ``valid_for``, it is rendered again after half of that time.
+
+        Signed metadata is signed by a ``MetadataSigner`` in a worker
+        thread, never in the thread of the calling request, which does not
+        wait for it either.
+
+        Returns:
+            A ``MetadataDocument`` instance or None if no signed document
+            is available yet
+
+        Raises the same exceptions as ``generateMetadata`` for unsigned
+        metadata
+        """
+        cfg = self.getPySAML2Configuration()
+        if cfg is None:
+            if self.metadata_sign:
+                logger.warning(
+                    'getMetadataDocument: Invalid configuration, cannot sign')
+                return None
+            return MetadataDocument(self.generateMetadata())
+
+        settings = (bool(self.metadata_sign), bool(self.metadata_envelope))
+        valid_for = getattr(cfg, 'valid_for', None)
+        with METADATA_LOCK:
+            cached = METADATA_DOCUMENTS.get(self._uid)
+            if cached is None or cached[0] is not cfg or \
+               cached[1] != settings or cached[2].isExpired():
+                if cached is not None and \
+                   isinstance(cached[2], MetadataSigner):
+                    cached[2].cancel()
+                if self.metadata_sign:
+                    # Sign a snapshot, the configuration may be changed
+                    # by other threads
+                    render = functools.partial(
+                        renderMetadata,
+                        copy.deepcopy(self.getConfiguration()),
+                        self._uid,
+                        sign=True,
+                        envelope=self.metadata_envelope)
+                    source = MetadataSigner(render, valid_for)
+                else:
+                    source = MetadataDocument(self.generateMetadata(),
+                                              valid_for)
+                cached = METADATA_DOCUMENTS[self._uid] = (cfg, settings,
+                                                          source)
+
+        if isinstance(cached[2], MetadataSigner):
+            return cached[2].getDocument()
+        return cached[2]
+
     @security.protected(manage_users)
     def generateMetadata(self):
         """ Generate XML metadata output from configuration
@@ -51,52 +353,9 @@ class SAML2MetadataProvider:
         Returns:
             An unencoded string representing the XML metadata description
         """
-        nspair = {"xs": "http://www.w3.org/2001/XMLSchema"}
-        config = copy.deepcopy(self.getConfiguration())
-        xmldoc = None
-
-        # Configuration for a single entity (XML EntityDescriptor element)
-        entity_cfg = Config().load(config)
-        entity = entity_descriptor(entity_cfg)
-
-        if self.metadata_envelope:
-            # To make sure signing information only shows up on the enclosing
-            # envelope, remove it for the entity configuration.
-            key_file = config.pop('key_file', '')
-            cert_file = config.pop('cert_file', '')
-
-            # Configuration for the XML EntityDescriptors envelope
-            pysaml2_conf = Config()
-            pysaml2_conf.key_file = key_file
-            pysaml2_conf.cert_file = cert_file
-            pysaml2_conf.debug = 1
-            pysaml2_conf.xmlsec_binary = config.get('xmlsec1_binary')
-            security_ctx = security_context(pysaml2_conf)
-
-            entities, xmldoc = entities_descriptor([entity],
-                                                   entity_cfg.valid_for,
-                                                   '',  # name argument
-                                                   self._uid,  # id argument
-                                                   self.metadata_sign,
-                                                   security_ctx)
-            valid_instance(entities)
-            xmldoc = metadata_tostring_fix(entities, nspair, xmldoc)
-        else:
-            valid_instance(entity)
-            if self.metadata_sign:
-                security_ctx = security_context(entity_cfg)
-                entity, xmldoc = sign_entity_descriptor(
-                    entity, config['entityid'], security_ctx)
-            xmldoc = metadata_tostring_fix(entity, nspair, xmldoc)
-
-        if isinstance(xmldoc, bytes):
-            xmldoc = xmldoc.decode("utf-8")
-
-        # Transform to a pretty representation
-        data_dom = parseString(xmldoc)
-        return data_dom.toprettyxml(indent='  ')
-
-        return xmldoc
+        return renderMetadata(self.getConfiguration(), self._uid,
+                              sign=self.metadata_sign,
+                              envelope=self.metadata_envelope)
 
 
 InitializeClass(SAML2MetadataProvider)
@@ -15,15 +15,60 @@
 
 import logging
 import os
-
-from xmlschema.resources import XMLResource
+import threading
 
 
 logger = logging.getLogger('Products.SAML2Plugins')
+PATCHES_LOCK = threading.Lock()
+PATCHES_APPLIED = False
+SCHEMA_DATA_FOLDER = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), 'data')
+
+
+class LazySchemaValidator:
+    """ Schema validator that adds more schemata on first use
+
+    Building a schema with ``xmlschema`` is expensive, so the additional
+    schemata are only added to the wrapped pysaml2 validator when the first
+    document gets validated instead of at import time.
+    """
+
+    def __init__(self, validator, schema_files):
+        self._validator = validator
+        self._schema_files = tuple(schema_files)
+        self._built = False
+        self._lock = threading.Lock()
+
+    def getValidator(self):
+        """ Get the wrapped validator, building it if necessary """
+        if not self._built:
+            with self._lock:
+                if not self._built:
+                    self._build()
+        return self._validator
+
+    def _build(self):
+        from xmlschema.resources import XMLResource
+
+        for filename in self._schema_files:
+            schema_path = os.path.join(SCHEMA_DATA_FOLDER, filename)
+            xml_resource = XMLResource(source=schema_path,
+                                       base_url=SCHEMA_DATA_FOLDER,
+                                       allow='sandbox')
+            self._validator.add_schema(source=xml_resource, build=True)
+            logger.debug(f'LazySchemaValidator: Added schema {filename}')
+        self._built = True
+
+    def validate(self, *args, **kw):
+        return self.getValidator().validate(*args, **kw)
+
+    def __getattr__(self, name):
+        return getattr(self.getValidator(), name)
 
 
 def pysaml2_add_signature_support():
     from saml2 import entity
+    from saml2 import pack
     from saml2 import xmldsig
 
     # pysaml2 has a hardcoded list of signature algorithms, but the xmlsec1
@@ -39,29 +84,67 @@ def pysaml2_add_signature_support():
     xmldsig.SIG_ALLOWED_ALG = xmldsig.SIG_ALLOWED_ALG + additional_algs
     xmldsig.SIG_AVAIL_ALG = xmldsig.SIG_AVAIL_ALG + additional_algs
     entity.SIG_ALLOWED_ALG = xmldsig.SIG_ALLOWED_ALG
+    pack.SIG_ALLOWED_ALG = xmldsig.SIG_ALLOWED_ALG
+
+
+def pysaml2_add_redirect_signers():
+    from saml2 import sigver
+
+    from .signing import REDIRECT_SIGNATURE_ALGORITHMS
+    from .signing import RedirectSigner
+    from .signing import rsacrypto_get_signer
+
+    # The HTTP-Redirect binding signs the query string in-process, but
+    # pysaml2 only knows PKCS#1 v1.5 RSA signers. Register signers for all
+    # supported algorithms, including RSA-MGF1, and stop sharing one
+    # signer instance and its key between threads.
+    for sigalg in REDIRECT_SIGNATURE_ALGORITHMS:
+        sigver.SIGNER_ALGS.setdefault(sigalg, RedirectSigner(sigalg))
+    sigver.RSACrypto.get_signer = rsacrypto_get_signer
+
+
+def pysaml2_add_decryption_key_hints():
+    from saml2.sigver import SecurityContext
+
+    from .encryption import decrypt_with_key_hints
+
+    # pysaml2 tries every configured private key in turn when decrypting,
+    # which means one xmlsec1 invocation per key. Select the key named by
+    # the KeyInfo element of the EncryptedKey instead.
+    SecurityContext.decrypt = decrypt_with_key_hints
 
 
 def pysaml_add_xml_schemata():
     from saml2.xml import schema
 
     # pysaml2 has a hardcoded list of supported XML schemata and namespaces,
-    # which does not include newer versions.
-    parent_folder_path = os.path.dirname(os.path.abspath(__file__))
-    schema_data_folder = os.path.join(parent_folder_path, 'data')
+    # which does not include newer versions. The additional schemata are
+    # built when the first document is validated.
     additional_schemata = ('xenc-schema-11.xsd',)
     schema_validator_default = schema._schema_validator_default
 
-    for filename in additional_schemata:
-        schema_path = os.path.join(schema_data_folder, filename)
-        xml_resource = XMLResource(source=schema_path,
-                                   base_url=schema_data_folder,
-                                   allow='sandbox')
-        schema_validator_default.add_schema(source=xml_resource, build=True)
-
-    schema._schema_validator_default = schema_validator_default
+    if not isinstance(schema_validator_default, LazySchemaValidator):
+        schema._schema_validator_default = LazySchemaValidator(
+            schema_validator_default, additional_schemata)
 
 
 def applyPatches():
-    logger.debug('Applying monkey patches')
-    pysaml2_add_signature_support()
-    pysaml_add_xml_schemata()
+    """ Patch pysaml2 before it is used for the first time
+
+    Importing pysaml2 is expensive, so the patches are not applied when
+    this package is imported but by the code paths that load pysaml2.
+    Calling this function more than once is safe.
+    """
+    global PATCHES_APPLIED
+
+    if PATCHES_APPLIED:
+        return
+
+    with PATCHES_LOCK:
+        if not PATCHES_APPLIED:
+            logger.debug('Applying monkey patches')
+            pysaml2_add_signature_support()
+            pysaml2_add_redirect_signers()
+            pysaml2_add_decryption_key_hints()
+            pysaml_add_xml_schemata()
+            PATCHES_APPLIED = True
@@ -0,0 +1,194 @@
+##############################################################################
+#
+# Copyright (c) 2023 Jens Vagelpohl and Contributors. All Rights Reserved.
+#
+# This software is subject to the provisions of the Zope Public License,
+# Version 2.1 (ZPL).  A copy of the ZPL should accompany this distribution.
+# THIS SOFTWARE IS PROVIDED "AS IS" AND ANY AND ALL EXPRESS OR IMPLIED
+# WARRANTIES ARE DISCLAIMED, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF TITLE, MERCHANTABILITY, AGAINST INFRINGEMENT, AND FITNESS
+# FOR A PARTICULAR PURPOSE.
+#
+##############################################################################
+""" Attribute projection rules applied to SAML assertions at login time
+
+Each rule is one line of the plugin ``attribute_rules`` property:
+
+- ``keep <name>``: Keep the attribute
+- ``rename <name> <new name>``: Keep the attribute under a new name
+- ``drop <name>``: Never store the attribute
+- ``truncate <name> <length>``: Shorten the attribute value
+
+As soon as there is a ``keep`` or ``rename`` rule, all attributes not
+named in one of them are dropped.
+"""
+
+import logging
+
+
+logger = logging.getLogger('Products.SAML2Plugins')
+PROJECTIONS = {}
+PROJECTED_CONVERTERS = {}
+
+
+class AttributeProjection:
+    """ Compiled attribute projection rules """
+
+    def __init__(self, rules=()):
+        self.names = {}
+        self.drop = set()
+        self.truncate = {}
+
+        for line in rules or ():
+            words = line.split()
+            if not words or words[0].startswith('#'):
+                continue
+            try:
+                action, name = words[0].lower(), words[1]
+                if action == 'keep' and len(words) == 2:
+                    self.names[name] = name
+                elif action == 'rename' and len(words) == 3:
+                    self.names[name] = words[2]
+                elif action == 'drop' and len(words) == 2:
+                    self.drop.add(name)
+                elif action == 'truncate' and len(words) == 3:
+                    self.truncate[name] = int(words[2])
+                else:
+                    raise ValueError(line)
+            except (IndexError, ValueError):
+                logger.warning(f'AttributeProjection: Invalid rule {line}')
+
+    def __bool__(self):
+        return bool(self.names or self.drop or self.truncate)
+
+    def wants(self, name):
+        """ Is an attribute stored at all?
+
+        Args:
+            name (str): The local attribute name
+
+        Returns:
+            True or False
+        """
+        if name in self.drop:
+            return False
+        return not self.names or name in self.names
+
+    def project(self, name, value):
+        """ Apply the rules to a single attribute
+
+        Args:
+            name (str): The local attribute name
+
+            value: The attribute value
+
+        Returns:
+            A tuple of the new name and value, or None if it is dropped
+        """
+        if not self.wants(name):
+            return None
+
+        max_length = self.truncate.get(name)
+        if max_length is not None and isinstance(value, str):
+            value = value[:max_length]
+
+        return (self.names.get(name, name), value)
+
+    def wrapConverters(self, converters, required=()):
+        """ Wrap pysaml2 attribute converters to skip unwanted attributes
+
+        Args:
+            converters (list): pysaml2 AttributeConverter instances, they
+                may already be wrapped
+
+        Kwargs:
+            required (iterable): Local attribute names that are always
+                converted, like the login attribute
+
+        Returns:
+            A list of attribute converters
+        """
+        converters = [getattr(conv, 'converter', conv)
+                      for conv in converters or ()]
+        if not (self.names or self.drop):
+            return converters
+        return [ProjectingConverter(conv, self, required)
+                for conv in converters]
+
+
+class ProjectingConverter:
+    """ Attribute converter that skips attributes dropped by a projection
+
+    pysaml2 skips an attribute when the converter raises AttributeError,
+    so the attribute values of unwanted attributes are never touched.
+    """
+
+    def __init__(self, converter, projection, required=()):
+        self.converter = converter
+        self.projection = projection
+        self.required = frozenset(name for name in required if name)
+
+    def _check(self, attribute, name=None):
+        if name is None:
+            name = (attribute.name or '').strip()
+        if name not in self.required and not self.projection.wants(name):
+            raise AttributeError(f'Attribute {name} dropped by projection')
+
+    def ava_from(self, attribute, allow_unknown=False):
+        name = getattr(attribute, 'name', None)
+        if name:
+            # Unknown attributes keep their SAML name if they are allowed
+            mapping = self.converter._fro or {}
+            self._check(attribute, mapping.get(name.strip().lower(),
+                                               name.strip()))
+        return self.converter.ava_from(attribute, allow_unknown)
+
+    def lcd_ava_from(self, attribute):
+        self._check(attribute)
+        return self.converter.lcd_ava_from(attribute)
+
+    def __getattr__(self, name):
+        return getattr(self.converter, name)
+
+
+def getAttributeProjection(rules):
+    """ Get or create the compiled projection for a list of rules """
+    cache_key = tuple(rules or ())
+    if cache_key not in PROJECTIONS:
+        PROJECTIONS[cache_key] = AttributeProjection(cache_key)
+    return PROJECTIONS[cache_key]
+
+
+def installProjectedConverters(uid, config, projection, required=()):
+    """ Put the attribute converters for a projection into a configuration
+
+    ``pysaml2`` reads the attribute converters from its configuration. They
+    are wrapped once for each loaded configuration, projection and set of
+    required attributes, and the configuration is only changed when the
+    wrapped converters are not in place yet.
+
+    Args:
+        uid (str): The plugin UID
+
+        config (saml2.config.Config): The pysaml2 configuration
+
+        projection (AttributeProjection): The attribute projection
+
+    Kwargs:
+        required (iterable): Local attribute names that are always
+            converted, like the login attribute
+    """
+    key = (projection, frozenset(name for name in required if name))
+    cached = PROJECTED_CONVERTERS.get(uid)
+    if cached is None or cached[0] is not config or cached[1] != key:
+        converters = projection.wrapConverters(config.attribute_converters,
+                                               required=key[1])
+        cached = PROJECTED_CONVERTERS[uid] = (config, key, converters)
+    if config.attribute_converters is not cached[2]:
+        config.attribute_converters = cached[2]
+
+
+def clearAttributeProjections():
+    """ Clear all compiled attribute projections """
+    PROJECTIONS.clear()
+    PROJECTED_CONVERTERS.clear()
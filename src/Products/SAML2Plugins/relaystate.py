@@ -0,0 +1,112 @@
+##############################################################################
+#
+# Copyright (c) 2023 Jens Vagelpohl and Contributors. All Rights Reserved.
+#
+# This software is subject to the provisions of the Zope Public License,
+# Version 2.1 (ZPL).  A copy of the ZPL should accompany this distribution.
+# THIS SOFTWARE IS PROVIDED "AS IS" AND ANY AND ALL EXPRESS OR IMPLIED
+# WARRANTIES ARE DISCLAIMED, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF TITLE, MERCHANTABILITY, AGAINST INFRINGEMENT, AND FITNESS
+# FOR A PARTICULAR PURPOSE.
+#
+##############################################################################
+""" Login return URLs kept in signed browser cookies
+
+Instead of the full return URL, authentication requests carry a short
+random token as RelayState. The return URL travels in a cookie signed
+with the credential ticket keys and bound to the token, so nothing is
+kept in process memory and any Zope process can resolve the token when
+the identity provider sends the user back.
+"""
+
+import hashlib
+import hmac
+import secrets
+import time
+
+from .ticket import decodeTicket
+from .ticket import encodeTicket
+
+
+RELAY_STATE_TTL = 1800  # seconds
+TOKEN_PREFIX = 'rs-'
+COOKIE_PREFIX = '__saml2_rs_'
+
+
+def _relayStateKey(key):
+    # Separate from the credential ticket keys, a return URL cookie must
+    # never be accepted as credential ticket
+    key_id, secret = key
+    return (key_id, hmac.new(secret, b'relaystate', hashlib.sha256).digest())
+
+
+def createRelayStateToken():
+    """ Create a new random RelayState token
+
+    Returns:
+        The token, 25 characters long
+    """
+    return TOKEN_PREFIX + secrets.token_urlsafe(16)
+
+
+def isRelayStateToken(relay_state):
+    """ Is a RelayState value a token created by ``createRelayStateToken``? """
+    return bool(relay_state) and relay_state.startswith(TOKEN_PREFIX)
+
+
+def getRelayStateCookieName(token):
+    """ Get the name of the cookie carrying the return URL for a token """
+    return COOKIE_PREFIX + token[len(TOKEN_PREFIX):]
+
+
+def encodeReturnURL(token, url, key, ttl=RELAY_STATE_TTL, now=None):
+    """ Create the cookie value carrying a return URL
+
+    Args:
+        token (str): The RelayState token
+
+        url (str): The return URL
+
+        key (tuple): Key ID and secret as returned by ``createTicketKey``
+
+    Kwargs:
+        ttl (int): Lifetime in seconds
+
+        now (float): The current time, defaults to ``time.time()``
+
+    Returns:
+        The signed cookie value
+    """
+    if now is None:
+        now = time.time()
+    return encodeTicket({'t': token, 'u': url, 'x': int(now + ttl)},
+                        _relayStateKey(key))
+
+
+def decodeReturnURL(token, value, keys, now=None):
+    """ Get the return URL from a cookie value
+
+    Args:
+        token (str): The RelayState token sent by the identity provider
+
+        value (str): The cookie value created by ``encodeReturnURL``
+
+        keys (iterable): Key ID and secret tuples that are accepted
+
+    Kwargs:
+        now (float): The current time, defaults to ``time.time()``
+
+    Returns:
+        The return URL or None for invalid, expired or foreign values
+    """
+    data = None
+    if value:
+        data = decodeTicket(value, [_relayStateKey(key) for key in keys])
+    if not isinstance(data, dict) or data.get('t') != token:
+        return None
+    if now is None:
+        now = time.time()
+    if not isinstance(data.get('x'), int) or data['x'] < now:
+        return None
+    url = data.get('u')
+    return url if isinstance(url, str) else None
@@ -0,0 +1,125 @@
+##############################################################################
+#
+# Copyright (c) 2023 Jens Vagelpohl and Contributors. All Rights Reserved.
+#
+# This software is subject to the provisions of the Zope Public License,
+# Version 2.1 (ZPL).  A copy of the ZPL should accompany this distribution.
+# THIS SOFTWARE IS PROVIDED "AS IS" AND ANY AND ALL EXPRESS OR IMPLIED
+# WARRANTIES ARE DISCLAIMED, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF TITLE, MERCHANTABILITY, AGAINST INFRINGEMENT, AND FITNESS
+# FOR A PARTICULAR PURPOSE.
+#
+##############################################################################
+""" Attribute-driven role mapping
+
+Each rule is one line of the plugin ``role_rules`` property::
+
+    <attribute> <exact|prefix|regex> <value> <role> [<role> ...]
+
+A user is granted the roles of every rule where at least one value of the
+attribute equals the rule value (``exact``), starts with it (``prefix``)
+or contains a match for the regular expression (``regex``).
+"""
+
+import logging
+import re
+
+
+logger = logging.getLogger('Products.SAML2Plugins')
+ROLE_MAPPERS = {}
+
+
+class RoleMapper:
+    """ Role mapping rules compiled into lookup tables """
+
+    def __init__(self, rules=()):
+        self.exact = {}     # attribute: {value: roles}
+        self.prefix = {}    # attribute: {prefix: roles}
+        self.prefix_lengths = {}  # attribute: sorted prefix lengths
+        self.regex = {}     # attribute: [(compiled pattern, roles)]
+
+        for line in rules or ():
+            words = line.split()
+            if not words or words[0].startswith('#'):
+                continue
+            if len(words) < 4 or words[1] not in ('exact', 'prefix', 'regex'):
+                logger.warning(f'RoleMapper: Invalid rule {line}')
+                continue
+
+            attribute, match_type, value = words[:3]
+            roles = frozenset(words[3:])
+            if match_type == 'regex':
+                try:
+                    pattern = re.compile(value)
+                except re.error as exc:
+                    logger.warning(f'RoleMapper: Invalid rule {line}: {exc}')
+                    continue
+                self.regex.setdefault(attribute, []).append((pattern, roles))
+            else:
+                table = getattr(self, match_type).setdefault(attribute, {})
+                table[value] = table.get(value, frozenset()) | roles
+
+        for attribute, table in self.prefix.items():
+            self.prefix_lengths[attribute] = sorted({len(p) for p in table})
+        self.attributes = tuple(sorted(self.exact.keys() | self.prefix.keys()
+                                       | self.regex.keys()))
+
+    def __bool__(self):
+        return bool(self.exact or self.prefix or self.regex)
+
+    def getRoles(self, identity):
+        """ Compute the roles for a user
+
+        Args:
+            identity (dict): Mapping of attribute names to a value or a
+                list of values
+
+        Returns:
+            A frozenset of role names
+        """
+        roles = set()
+
+        for attribute in self.attributes:
+            values = identity.get(attribute)
+            if not values:
+                continue
+            if isinstance(values, str):
+                values = (values,)
+
+            exact = self.exact.get(attribute)
+            if exact:
+                for value in values:
+                    roles.update(exact.get(value, ()))
+
+            prefixes = self.prefix.get(attribute)
+            if prefixes:
+                lengths = self.prefix_lengths[attribute]
+                for value in values:
+                    for length in lengths:
+                        if length > len(value):
+                            break
+                        roles.update(prefixes.get(value[:length], ()))
+
+            for pattern, rule_roles in self.regex.get(attribute, ()):
+                # Skip patterns that cannot grant anything new
+                if rule_roles <= roles:
+                    continue
+                for value in values:
+                    if isinstance(value, str) and pattern.search(value):
+                        roles.update(rule_roles)
+                        break
+
+        return frozenset(roles)
+
+
+def getRoleMapper(rules):
+    """ Get or create the compiled role mapper for a list of rules """
+    cache_key = tuple(rules or ())
+    if cache_key not in ROLE_MAPPERS:
+        ROLE_MAPPERS[cache_key] = RoleMapper(cache_key)
+    return ROLE_MAPPERS[cache_key]
+
+
+def clearRoleMappers():
+    """ Clear all compiled role mappers """
+    ROLE_MAPPERS.clear()
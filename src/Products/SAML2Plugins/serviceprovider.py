@@ -18,14 +18,31 @@ import time
 
 from saml2 import BINDING_HTTP_POST
 from saml2 import BINDING_HTTP_REDIRECT
-from saml2.cache import Cache
-from saml2.client import Saml2Client
+from saml2 import BINDING_SOAP
 from saml2.ident import code as nameid_to_str
 from saml2.ident import decode as str_to_nameid
 
 from AccessControl import ClassSecurityInfo
 from AccessControl.class_init import InitializeClass
 
+from .artifact import extractResponse
+from .artifact import getArtifactResolutionPool
+from .authnrequest import getAuthnRequestTemplate
+from .endpoints import getEndpointIndex
+from .monkeypatch import applyPatches
+from .projection import getAttributeProjection
+from .projection import installProjectedConverters
+from .relaystate import RELAY_STATE_TTL
+from .relaystate import createRelayStateToken
+from .relaystate import decodeReturnURL
+from .relaystate import encodeReturnURL
+from .relaystate import getRelayStateCookieName
+from .relaystate import isRelayStateToken
+from .roles import getRoleMapper
+from .sessioninfo import SessionInfo
+from .sessionregistry import SessionRegistry
+from .ticket import TICKET_MAX_SIZE
+
 
 logger = logging.getLogger('Products.SAML2Plugins')
 CACHES = {}
@@ -36,11 +53,14 @@ class SAML2ServiceProvider:
     security = ClassSecurityInfo()
     _v_saml2client = None
     _v_saml2cache = None
+    _session_registry = None
 
     @security.private
     def getPySAML2Cache(self):
         """ Get or create a cache for caching SAML 2.0 data """
         if self._uid not in CACHES:
+            from saml2.cache import Cache
+
             CACHES[self._uid] = Cache()
         return CACHES[self._uid]
 
@@ -48,12 +68,53 @@ class SAML2ServiceProvider:
     def getPySAML2Client(self):
         """ Get a SAML 2.0 client that delegates interactions to pysaml2 """
         if self._v_saml2client is None:
+            applyPatches()
+            from saml2.client import Saml2Client
+
             self._v_saml2client = Saml2Client(
                 config=self.getPySAML2Configuration(),
                 identity_cache=self.getPySAML2Cache())
 
         return self._v_saml2client
 
+    @security.private
+    def getEndpointIndex(self):
+        """ Get the index of service endpoints from the loaded metadata """
+        return getEndpointIndex(self._uid, self.getPySAML2Client().metadata)
+
+    @security.private
+    def getSessionRegistry(self):
+        """ Get the registry of login sessions for identity provider logout
+
+        The registry is created on first use and stored with the plugin.
+        Its entries are kept until no session or credential ticket they
+        apply to can be valid anymore.
+        """
+        hours = max(self.inactivity_timeout, self.ticket_max_lifetime, 1)
+        ttl = hours * 3600
+        if self._session_registry is None:
+            self._session_registry = SessionRegistry(ttl)
+        elif self._session_registry.ttl != ttl:
+            self._session_registry.ttl = ttl
+        return self._session_registry
+
+    @security.private
+    def isSessionRevoked(self, session_info):
+        """ Was the login session ended by an identity provider logout?
+
+        Args:
+            session_info (dict): The user session information
+
+        Returns:
+            True or False
+        """
+        name_id = session_info.get('name_id')
+        if not name_id or self._session_registry is None:
+            return False
+        return self._session_registry.isRevoked(
+            name_id, session_info.get('session_index'),
+            login_time=session_info.get('login_time'))
+
     @security.private
     def isLoggedIn(self, name_id):
         """ Is the user in the PySAML2 cache?
@@ -78,7 +139,7 @@ class SAML2ServiceProvider:
             REQUEST (Zope REQUEST object): Zope will provide this parameter
                 automatically when invoking this method through the web.
         """
-        session_info = REQUEST.SESSION.get(self._uid, None)
+        session_info = self.getSessionInfo(REQUEST)
         saml_resp_dict = {}
 
         if not session_info:
@@ -95,13 +156,15 @@ class SAML2ServiceProvider:
             logger.debug(f'logout: User {login} is not logged into SAML')
         else:
             client = self.getPySAML2Client()
-            md = client.metadata
             logger.debug(f'logout: Logging out {login}')
 
             # Only attempt to call the full SAML logout if the identity
-            # provider offers a single logout service
-            if md.any2('idp', 'single_logout_service', BINDING_HTTP_POST) or \
-               md.any2('idp', 'single_logout_service', BINDING_HTTP_REDIRECT):
+            # provider offers a single logout service. Sessions without
+            # issuer accept any identity provider offering one.
+            if self.getEndpointIndex().supports(
+                    session_info.get('issuer') or None,
+                    'single_logout_service',
+                    (BINDING_HTTP_POST, BINDING_HTTP_REDIRECT)):
                 saml_resp_dict = client.global_logout(
                     str_to_nameid(session_info['name_id']),
                     reason='Manual logout')
@@ -205,29 +268,205 @@ class SAML2ServiceProvider:
                 if qs:
                     return_url = f'{return_url}?{qs}'
 
+        if return_url and self.relay_state_tokens:
+            return_url = self._storeReturnURL(request, return_url)
+
         if not idp_entityid:
             idp_entityid = self.getDefaultIdPEntityID()
 
+        # The binding is negotiated once per metadata load, pysaml2 then
+        # only looks up the single sign-on service for that binding. For
+        # unknown identity providers pysaml2 negotiates and raises itself.
+        sso = self.getEndpointIndex().ssoDestination(idp_entityid)
         client = self.getPySAML2Client()
+
+        if sso is not None and self.authn_request_templates and \
+           (sso[0] == BINDING_HTTP_REDIRECT or not client.should_sign):
+            # Requests without XML signature only differ in ID and
+            # IssueInstant, fill those into a pre-rendered request.
+            binding, destination = sso
+            template = getAuthnRequestTemplate(self._uid, client,
+                                               binding, destination)
+            if template is not None:
+                from saml2.s_utils import sid
+                from saml2.time_util import instant
+
+                # HTTP-Redirect requests are signed in the query string
+                # as configured by ``authn_requests_signed``
+                return client.apply_binding(
+                    binding,
+                    template.render(sid(), instant()),
+                    destination,
+                    return_url,
+                    sign=None if binding == BINDING_HTTP_REDIRECT else False)
+
         (req_id,
          binding,
          http_info) = client.prepare_for_negotiated_authenticate(
             entityid=idp_entityid,
-            relay_state=return_url)
+            relay_state=return_url,
+            binding=sso[0] if sso is not None else None)
 
         return http_info
 
+    @security.private
+    def _storeReturnURL(self, request, url):
+        """ Put a return URL into a cookie and get a RelayState token for it
+
+        The cookie is signed with the credential ticket key. Browsers only
+        send cookies with the identity provider's HTTP-POST response to
+        the assertion consumer service if they are marked ``SameSite=None``,
+        which requires HTTPS.
+
+        Args:
+            request (Zope request): The incoming Zope request instance
+
+            url (str): The return URL
+
+        Returns:
+            The RelayState token or the URL if it is too long for a cookie
+        """
+        if not self._ticket_keys:
+            self.manage_rotateTicketKeys()
+        token = createRelayStateToken()
+        value = encodeReturnURL(token, url, self._ticket_keys[0])
+        if len(value) > TICKET_MAX_SIZE:
+            logger.warning(
+                '_storeReturnURL: Return URL too long, sending it as is')
+            return url
+
+        secure = request.get('SERVER_URL', '').startswith('https')
+        request.RESPONSE.setCookie(getRelayStateCookieName(token),
+                                   value,
+                                   path='/',
+                                   max_age=RELAY_STATE_TTL,
+                                   http_only=True,
+                                   same_site='None' if secure else 'Lax',
+                                   secure=secure)
+        return token
+
+    @security.private
+    def resolveRelayState(self, relay_state, request):
+        """ Get the return URL for a RelayState value
+
+        Args:
+            relay_state (str): The RelayState sent by the identity provider
+
+            request (Zope request): The incoming Zope request instance
+
+        Returns:
+            The URL stored for a RelayState token, ``/`` for unknown or
+            expired tokens and any other value unchanged
+        """
+        if not isRelayStateToken(relay_state):
+            return relay_state
+
+        url = None
+        cookie_name = getRelayStateCookieName(relay_state)
+        value = (getattr(request, 'cookies', None) or {}).get(cookie_name)
+        if value:
+            # Tokens are only used once
+            request.RESPONSE.expireCookie(cookie_name, path='/')
+            url = decodeReturnURL(relay_state, value, self._ticket_keys)
+        if url is None:
+            logger.debug(
+                f'resolveRelayState: Unknown RelayState token {relay_state}')
+            return '/'
+        return url
+
+    @security.private
+    def resolveArtifact(self, artifact):
+        """ Get the SAML response for an HTTP-Artifact binding artifact
+
+        The artifact is sent to the artifact resolution service of the
+        identity provider that issued it, using a pooled keep-alive
+        connection to the identity provider.
+
+        Args:
+            artifact (str): The ``SAMLart`` value sent by the browser
+
+        Returns:
+            The SAML response, base64-encoded like for the HTTP-POST binding
+
+        Raises ``ValueError`` if the artifact or the artifact resolution
+        service response are invalid, ``TimeoutError`` or ``requests``
+        exceptions if the artifact resolution service cannot be reached.
+        """
+        import base64
+
+        from saml2.s_utils import sid
+
+        client = self.getPySAML2Client()
+        try:
+            destination = client.artifact2destination(artifact, 'idpsso')
+        except KeyError:
+            destination = None
+        if not destination:
+            raise ValueError('Unknown artifact issuer or resolution service')
+
+        _, resolve_request = client.create_artifact_resolve(artifact,
+                                                            destination,
+                                                            sid())
+        soap_info = client.use_soap(resolve_request, destination)
+        pool = getArtifactResolutionPool(self._uid,
+                                         destination,
+                                         self.artifact_timeout,
+                                         self.artifact_max_concurrency)
+        soap_response = pool.post(soap_info['url'],
+                                  soap_info['data'],
+                                  soap_info['headers'],
+                                  verify=client.request_args['verify'],
+                                  cert=client.request_args.get('cert'))
+
+        # Check the status and signature of the ArtifactResponse
+        client.parse_artifact_resolve_response(soap_response)
+
+        saml_response = extractResponse(soap_response)
+        if saml_response is None:
+            raise ValueError('Artifact response contains no SAML response')
+
+        return base64.b64encode(saml_response).decode('ascii')
+
     @security.private
     def handleACSRequest(self, saml_response, binding='POST'):
-        """ Handle incoming SAML 2.0 assertions """
+        """ Handle incoming SAML 2.0 assertions
+
+        Args:
+            saml_response (str): The SAML response or, for the ``ARTIFACT``
+                binding, the artifact to resolve
+
+        Kwargs:
+            binding (str): ``POST``, ``REDIRECT`` or ``ARTIFACT``
+
+        Returns:
+            A mapping with user information, empty if the login failed
+        """
         user_info = {}
         client = self.getPySAML2Client()
+        projection = getAttributeProjection(self.attribute_rules)
+        role_mapper = getRoleMapper(self.role_rules)
+
+        if binding == 'ARTIFACT':
+            try:
+                saml_response = self.resolveArtifact(saml_response)
+            except Exception as exc:
+                logger.error(
+                    f'handleACSRequest: Resolving artifact failed:\n{exc}')
+                return user_info
+            # The resolved response is handled like a POSTed one
+            binding = 'POST'
 
         if binding == 'POST':
             saml_binding = BINDING_HTTP_POST
         else:
             saml_binding = BINDING_HTTP_REDIRECT
 
+        # Don't even convert attributes that will be dropped
+        installProjectedConverters(self._uid, client.config, projection,
+                                   required=(self.login_attribute,
+                                             self.group_attribute,
+                                             *role_mapper.attributes))
+
         try:
             saml_resp = client.parse_authn_request_response(saml_response,
                                                             saml_binding)
@@ -245,27 +484,49 @@ class SAML2ServiceProvider:
             name_id_object = saml_resp.get_subject()
             user_info['name_id'] = nameid_to_str(name_id_object)
             user_info['issuer'] = saml_resp.issuer()
+            try:
+                session_index = \
+                    saml_resp.session_info()['session_index'] or None
+            except Exception:
+                session_index = None
+            if session_index:
+                user_info['session_index'] = session_index
 
             if not self.login_attribute:
                 # If no login attribute has been specified, use the token
                 # sent as the subject text value.
                 user_info['_login'] = name_id_object.text
 
-            for key, value in saml_resp.get_identity().items():
+            identity = saml_resp.get_identity()
+            if role_mapper:
+                # All values of multi-valued attributes are matched
+                user_info['_roles'] = tuple(
+                    sorted(role_mapper.getRoles(identity)))
+            if self.group_attribute:
+                groups = identity.get(self.group_attribute) or ()
+                if isinstance(groups, str):
+                    groups = (groups,)
+                user_info['_groups'] = tuple(sorted(set(groups)))
+
+            for key, value in identity.items():
                 if isinstance(value, (list, tuple)):
                     if not value:
                         value = ''
                     else:
                         value = value[0]
-                user_info[key] = value
 
                 # If a login attribute has been specified, use
                 # that as Zope login
                 if self.login_attribute and key == self.login_attribute:
                     user_info['_login'] = value
 
-                # Initialize session activity marker
-                user_info['last_active'] = int(time.time())
+                projected = projection.project(key, value)
+                if projected is not None:
+                    user_info[projected[0]] = projected[1]
+
+            # Initialize session activity marker
+            user_info['login_time'] = time.time()
+            user_info['last_active'] = int(user_info['login_time'])
 
             if not user_info.get('_login'):
                 logger.warning(
@@ -276,14 +537,27 @@ class SAML2ServiceProvider:
 
             logger.debug(
                 f'handleACSRequest: Got data for {user_info["_login"]}')
+            user_info = SessionInfo.fromMapping(user_info)
+            self.getSessionRegistry().register(
+                user_info['name_id'], session_index,
+                login_time=user_info['login_time'])
+
+            if self.user_directory:
+                self.updateUserDirectory(user_info)
+            if self.group_attribute:
+                self.registerGroups(user_info['_groups'])
         else:
             logger.debug('handleACSRequest: Invalid SamlResponse, no user')
 
         return user_info
 
     @security.private
-    def handleSLORequest(self, saml_response, binding='POST'):
-        """ Handle incoming SAML 2.0 logout request or response """
+    def handleSLORequest(self, saml_response, binding='POST', query_string=''):
+        """ Handle incoming SAML 2.0 logout request or response
+
+        For the HTTP-Redirect binding the raw ``query_string`` is used to
+        verify the query string signature, if the identity provider sent one.
+        """
         client = self.getPySAML2Client()
         target_path = self.logout_path or ''
 
@@ -300,6 +574,13 @@ class SAML2ServiceProvider:
             logger.error(
                 f'handleSLORequest: Parsing SAML response failed:\n{exc}')
 
+        if saml_resp is not None and saml_binding == BINDING_HTTP_REDIRECT:
+            issuer = saml_resp.issuer()
+            if not self._verifyRedirectSignature(issuer, query_string):
+                logger.error('handleSLORequest: Invalid query string '
+                             f'signature from {issuer}')
+                saml_resp = None
+
         if saml_resp is not None:
             try:
                 saml_resp.status_ok() and \
@@ -311,5 +592,136 @@ class SAML2ServiceProvider:
 
         return target_path
 
+    @security.private
+    def handleLogoutRequest(self, saml_request, binding='POST',
+                            query_string='', relay_state=''):
+        """ Handle a SAML 2.0 logout request sent by the identity provider
+
+        The sessions named in the request are revoked in the session
+        registry, so the next request using them is no longer authenticated.
+
+        Args:
+            saml_request (str): The encoded SAML logout request
+
+        Anyone who knows a user's NameID could end the user's sessions, so
+        requests must be signed with a signing certificate of the issuing
+        identity provider from the metadata. HTTP-Redirect binding requests
+        are signed in the query string, all others in the XML document.
+
+        Kwargs:
+            binding (str): ``POST``, ``REDIRECT`` or ``SOAP``
+
+            query_string (str): The raw query string for verifying
+                HTTP-Redirect binding signatures
+
+            relay_state (str): The RelayState sent with the request
+
+        Returns:
+            Data to send the logout response to the identity provider, a
+            mapping with keys ``headers``, ``data`` and ``status``, or None
+        """
+        from saml2.s_utils import status_message_factory
+        from saml2.s_utils import success_status_factory
+        from saml2.samlp import STATUS_UNKNOWN_PRINCIPAL
+
+        client = self.getPySAML2Client()
+
+        if binding == 'POST':
+            saml_binding = BINDING_HTTP_POST
+        elif binding == 'SOAP':
+            saml_binding = BINDING_SOAP
+        else:
+            saml_binding = BINDING_HTTP_REDIRECT
+
+        try:
+            saml_req = client.parse_logout_request(saml_request, saml_binding)
+        except Exception as exc:
+            logger.error(
+                f'handleLogoutRequest: Parsing SAML request failed:\n{exc}')
+            return None
+
+        if saml_req is None:
+            logger.debug('handleLogoutRequest: Failure, got no SAML request')
+            return None
+
+        issuer = getattr(saml_req.issuer, 'text', None)
+        message = saml_req.message
+        if not self._getSigningCertificates(issuer):
+            logger.error('handleLogoutRequest: No signing certificate for '
+                         f'{issuer} in the metadata')
+            return None
+
+        if saml_binding == BINDING_HTTP_REDIRECT:
+            if not self._verifyRedirectSignature(issuer, query_string,
+                                                 required=True):
+                logger.error('handleLogoutRequest: Missing or invalid query '
+                             f'string signature from {issuer}')
+                return None
+        elif message.signature is None:
+            # pysaml2 has verified signatures that are present against the
+            # metadata certificates while parsing the request
+            logger.error(
+                f'handleLogoutRequest: Unsigned request from {issuer}')
+            return None
+
+        if message.name_id is None:
+            logger.warning('handleLogoutRequest: No usable NameID')
+            status = status_message_factory('Unknown user',
+                                            STATUS_UNKNOWN_PRINCIPAL)
+        else:
+            name_id = nameid_to_str(message.name_id)
+            session_indexes = [idx.text for idx in message.session_index
+                               if idx.text]
+            count = self.getSessionRegistry().revoke(name_id,
+                                                     session_indexes)
+            self.logoutLocally(name_id)
+            logger.debug(f'handleLogoutRequest: Revoked {count} session(s)')
+            status = success_status_factory()
+
+        sign = client.logout_responses_signed
+        sign_redirect = sign and saml_binding == BINDING_HTTP_REDIRECT
+        try:
+            response = client.create_logout_response(
+                message, bindings=[saml_binding], status=status,
+                sign=sign and not sign_redirect)
+            response_info = client.response_args(message, [saml_binding])
+            return client.apply_binding(response_info['binding'],
+                                        response,
+                                        response_info['destination'],
+                                        relay_state,
+                                        response=True,
+                                        sign=sign_redirect)
+        except Exception as exc:
+            logger.error(
+                f'handleLogoutRequest: Creating the response failed:\n{exc}')
+            return None
+
+    def _getSigningCertificates(self, issuer):
+        """ Get the signing certificates of an identity provider
+
+        Returns:
+            A list of certificates from the metadata, empty for unknown
+            identity providers
+        """
+        client = self.getPySAML2Client()
+        try:
+            return list(client.metadata.certs(issuer, 'idpsso', 'signing'))
+        except Exception:
+            return []
+
+    def _verifyRedirectSignature(self, issuer, query_string, required=False):
+        """ Verify a HTTP-Redirect binding query string signature
+
+        Returns False for invalid signatures, True for valid signatures.
+        Unsigned query strings return True unless ``required`` is set.
+        """
+        from .signing import verify_redirect_query
+
+        valid = verify_redirect_query(query_string,
+                                      self._getSigningCertificates(issuer))
+        if valid is None:
+            return not required
+        return valid
+
 
 InitializeClass(SAML2ServiceProvider)
@@ -0,0 +1,192 @@
+##############################################################################
+#
+# Copyright (c) 2023 Jens Vagelpohl and Contributors. All Rights Reserved.
+#
+# This software is subject to the provisions of the Zope Public License,
+# Version 2.1 (ZPL).  A copy of the ZPL should accompany this distribution.
+# THIS SOFTWARE IS PROVIDED "AS IS" AND ANY AND ALL EXPRESS OR IMPLIED
+# WARRANTIES ARE DISCLAIMED, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF TITLE, MERCHANTABILITY, AGAINST INFRINGEMENT, AND FITNESS
+# FOR A PARTICULAR PURPOSE.
+#
+##############################################################################
+""" Compact user session information record
+"""
+
+import sys
+from collections.abc import Mapping
+
+
+# Mapping keys of the fixed record fields and their attribute names
+CORE_FIELDS = (('_login', 'login'),
+               ('name_id', 'name_id'),
+               ('issuer', 'issuer'),
+               ('session_index', 'session_index'),
+               ('last_active', 'last_active'),
+               ('_roles', 'roles'),
+               ('_groups', 'groups'),
+               ('login_time', 'login_time'))
+CORE_KEYS = dict(CORE_FIELDS)
+
+# Attribute name tuples are shared between all records, and so are the
+# mappings of attribute names to value positions for each tuple
+NAME_TUPLES = {}
+NAME_INDEXES = {}
+NAME_TUPLES_MAX = 1024
+
+# Attribute names are pickled as one string joined with this separator
+NAME_SEPARATOR = '\x1f'
+# Constructor argument defaults of the current pickle layout
+PICKLE_DEFAULTS = (None, None, None, None, '', (), None, None, None, None)
+
+
+def intern_names(names):
+    """ Get the shared instance of a tuple of attribute or group names """
+    names = tuple(names)
+    shared = NAME_TUPLES.get(names)
+    if shared is None:
+        shared = tuple(sys.intern(name) for name in names)
+        if len(NAME_TUPLES) < NAME_TUPLES_MAX:
+            NAME_TUPLES[shared] = shared
+    return shared
+
+
+def name_index(names):
+    """ Get the shared mapping of names to positions for a name tuple """
+    index = NAME_INDEXES.get(names)
+    if index is None:
+        index = {name: position for position, name in enumerate(names)}
+        if len(NAME_INDEXES) < NAME_TUPLES_MAX:
+            NAME_INDEXES[names] = index
+    return index
+
+
+class SessionInfo(Mapping):
+    """ User information stored in the session after login
+
+    Behaves like the mapping it replaces, with keys ``_login``,
+    ``name_id``, ``issuer``, ``session_index``, ``last_active``, ``_roles``,
+    ``_groups``, ``login_time`` and one key per SAML attribute. Attribute
+    names and group IDs are kept in tuples shared by all records with the
+    same values, and the record pickles as one flat tuple of values.
+
+    Pickles name the module-level constructor for their layout, currently
+    ``_restore1``. A changed layout gets a new constructor, and older ones
+    stay for sessions that are already stored.
+    """
+
+    __slots__ = ('login', 'name_id', 'issuer', 'last_active',
+                 '_names', '_index', '_values', 'roles', 'groups',
+                 'session_index', 'login_time')
+
+    def __init__(self, login=None, name_id=None, issuer=None,
+                 last_active=None, names=(), values=(), roles=None,
+                 groups=None, session_index=None, login_time=None):
+        self.login = login
+        self.name_id = name_id
+        self.issuer = issuer
+        self.last_active = last_active
+        self._names = intern_names(names)
+        self._index = name_index(self._names)
+        self._values = tuple(values)
+        self.roles = roles
+        self.groups = None if groups is None else intern_names(groups)
+        self.session_index = session_index
+        self.login_time = login_time
+
+    @classmethod
+    def fromMapping(cls, mapping):
+        """ Create a record from a session information mapping """
+        core = {}
+        names = []
+        values = []
+        for key, value in mapping.items():
+            if key in CORE_KEYS:
+                core[CORE_KEYS[key]] = value
+            else:
+                names.append(key)
+                values.append(value)
+        return cls(names=names, values=values, **core)
+
+    def __reduce__(self):
+        names = NAME_SEPARATOR.join(self._names)
+        if any(NAME_SEPARATOR in name for name in self._names):
+            names = self._names
+        args = [self.login, self.name_id, self.issuer, self.last_active,
+                names, self._values, self.roles, self.groups,
+                self.session_index, self.login_time]
+        # Fields at the end that have their default value are left out
+        while args:
+            default = PICKLE_DEFAULTS[len(args) - 1]
+            if args[-1] is not default and \
+               (default is None or args[-1] != default):
+                break
+            args.pop()
+        return (_restore1, tuple(args))
+
+    def __getitem__(self, key):
+        attr = CORE_KEYS.get(key)
+        if attr is not None:
+            value = getattr(self, attr)
+            if value is not None:
+                return value
+        else:
+            position = self._index.get(key)
+            if position is not None:
+                return self._values[position]
+        raise KeyError(key)
+
+    def __contains__(self, key):
+        attr = CORE_KEYS.get(key)
+        if attr is not None:
+            return getattr(self, attr) is not None
+        return key in self._index
+
+    def get(self, key, default=None):
+        attr = CORE_KEYS.get(key)
+        if attr is not None:
+            value = getattr(self, attr)
+            return default if value is None else value
+        position = self._index.get(key)
+        if position is None:
+            return default
+        return self._values[position]
+
+    def __setitem__(self, key, value):
+        attr = CORE_KEYS.get(key)
+        if attr is not None:
+            setattr(self, attr, value)
+            return
+
+        position = self._index.get(key)
+        if position is not None:
+            self._values = (self._values[:position] + (value,)
+                            + self._values[position + 1:])
+        else:
+            self._names = intern_names(self._names + (key,))
+            self._index = name_index(self._names)
+            self._values = self._values + (value,)
+
+    def __iter__(self):
+        for key, attr in CORE_FIELDS:
+            if getattr(self, attr) is not None:
+                yield key
+        yield from self._names
+
+    def __len__(self):
+        return len(list(iter(self)))
+
+    def __repr__(self):
+        return f'<SessionInfo for {self.login}>'
+
+
+def _restore1(login=None, name_id=None, issuer=None, last_active=None,
+              names='', values=(), roles=None, groups=None,
+              session_index=None, login_time=None):
+    """ Unpickle a ``SessionInfo`` record """
+    if isinstance(names, str):
+        names = names.split(NAME_SEPARATOR) if names else ()
+    return SessionInfo(login=login, name_id=name_id, issuer=issuer,
+                       last_active=last_active, names=names, values=values,
+                       roles=roles, groups=groups,
+                       session_index=session_index, login_time=login_time)
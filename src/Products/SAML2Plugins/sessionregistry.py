@@ -0,0 +1,192 @@
+##############################################################################
+#
+# Copyright (c) 2023 Jens Vagelpohl and Contributors. All Rights Reserved.
+#
+# This software is subject to the provisions of the Zope Public License,
+# Version 2.1 (ZPL).  A copy of the ZPL should accompany this distribution.
+# THIS SOFTWARE IS PROVIDED "AS IS" AND ANY AND ALL EXPRESS OR IMPLIED
+# WARRANTIES ARE DISCLAIMED, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF TITLE, MERCHANTABILITY, AGAINST INFRINGEMENT, AND FITNESS
+# FOR A PARTICULAR PURPOSE.
+#
+##############################################################################
+""" Persistent registry of SAML login sessions for identity provider logout
+
+The identity provider identifies sessions to log out by NameID and
+SessionIndex. The registry maps NameID and SessionIndex to the sessions
+seen at login time and records the sessions revoked by identity provider
+logout requests. A logout request without SessionIndex revokes all
+sessions of the NameID that started before the request arrived, including
+sessions the registry has never seen. Logging out locally ends only the
+login session of the current user, so copies of a credential ticket are
+not accepted after logout.
+
+The registry is stored in the ZODB with the plugin, so revocations reach
+all Zope processes and ZEO clients and survive restarts.
+"""
+
+import time
+
+from BTrees.OOBTree import OOBTree
+from Persistence import Persistent
+
+
+CLEANUP_INTERVAL = 3600  # seconds
+
+
+def _key(name_id, session_index):
+    # BTree keys must be comparable, None is not comparable to strings
+    return (name_id, session_index or '')
+
+
+class SessionRegistry(Persistent):
+    """ Registered and revoked sessions, keyed by NameID and SessionIndex
+
+    Sessions and revocations are kept in BTrees keyed by NameID and
+    SessionIndex, so logins and logout requests for different users
+    rarely conflict. Entries expire after ``ttl`` seconds, which should be
+    at least the session inactivity timeout. Expired entries are removed
+    at most once per cleanup interval and Zope process while registering
+    or revoking sessions.
+
+    A revocation applies to sessions that started before it. Sessions
+    without login time are treated as started before any revocation.
+    """
+
+    _v_next_cleanup = 0
+
+    def __init__(self, ttl):
+        self.ttl = ttl
+        # (name_id, session_index): (login time, expiration)
+        self._sessions = OOBTree()
+        # (name_id, session_index): (revocation time, expiration)
+        self._revoked = OOBTree()
+        # name_id: (revocation time, expiration)
+        self._revoked_all = OOBTree()
+        # (name_id, session_index, login time): (logout time, expiration)
+        self._logged_out = OOBTree()
+
+    def _cleanup(self, now):
+        if now < self._v_next_cleanup:
+            return
+        self._v_next_cleanup = now + CLEANUP_INTERVAL
+
+        for tree in (self._sessions, self._revoked, self._revoked_all,
+                     self._logged_out):
+            expired = [key for key, (_, expiration) in tree.items()
+                       if expiration < now]
+            for key in expired:
+                del tree[key]
+
+    def register(self, name_id, session_index=None, login_time=None):
+        """ Register a new login session
+
+        Args:
+            name_id (str): The string representation of the NameID
+
+        Kwargs:
+            session_index (str): The SessionIndex from the assertion
+
+            login_time (float): The login time stamp, defaults to now
+        """
+        now = time.time()
+        if login_time is None:
+            login_time = now
+        self._sessions[_key(name_id, session_index)] = (login_time,
+                                                        now + self.ttl)
+        self._cleanup(now)
+
+    def sessions(self, name_id):
+        """ Get the registered session indexes of a NameID
+
+        Args:
+            name_id (str): The string representation of the NameID
+
+        Returns:
+            A list of session indexes, None for sessions without index
+        """
+        session_indexes = []
+        for key in self._sessions.keys(min=(name_id,)):
+            if key[0] != name_id:
+                break
+            session_indexes.append(key[1] or None)
+        return session_indexes
+
+    def revoke(self, name_id, session_indexes=()):
+        """ Revoke login sessions
+
+        Args:
+            name_id (str): The string representation of the NameID
+
+        Kwargs:
+            session_indexes (iterable): The session indexes to revoke. If
+                empty, all sessions of the NameID that started until now
+                are revoked, whether they are registered or not.
+
+        Returns:
+            The number of registered sessions that were revoked
+        """
+        now = time.time()
+        entry = (now, now + self.ttl)
+        if session_indexes:
+            keys = [_key(name_id, idx) for idx in session_indexes]
+            for key in keys:
+                self._revoked[key] = entry
+        else:
+            keys = [_key(name_id, idx) for idx in self.sessions(name_id)]
+            self._revoked_all[name_id] = entry
+
+        count = 0
+        for key in keys:
+            if self._sessions.pop(key, None) is not None:
+                count += 1
+        self._cleanup(now)
+
+        return count
+
+    def logout(self, name_id, session_index=None, login_time=None):
+        """ End a single login session
+
+        Unlike ``revoke`` this only ends the session with the given login
+        time. Sessions without login time cannot be told apart, logging
+        out one of them ends all of them.
+
+        Args:
+            name_id (str): The string representation of the NameID
+
+        Kwargs:
+            session_index (str): The SessionIndex from the assertion
+
+            login_time (float): The login time stamp of the session
+        """
+        now = time.time()
+        key = _key(name_id, session_index)
+        self._sessions.pop(key, None)
+        self._logged_out[key + (login_time or 0,)] = (now, now + self.ttl)
+        self._cleanup(now)
+
+    def isRevoked(self, name_id, session_index=None, login_time=None):
+        """ Was a login session revoked?
+
+        Args:
+            name_id (str): The string representation of the NameID
+
+        Kwargs:
+            session_index (str): The SessionIndex from the assertion
+
+            login_time (float): The login time stamp. Sessions without it
+                are revoked by any revocation for their NameID and
+                SessionIndex.
+
+        Returns:
+            True or False
+        """
+        key = _key(name_id, session_index)
+        if key + (login_time or 0,) in self._logged_out:
+            return True
+        for revoked in (self._revoked.get(key),
+                        self._revoked_all.get(name_id)):
+            if revoked is not None and \
+               (login_time is None or login_time <= revoked[0]):
+                return True
+        return False
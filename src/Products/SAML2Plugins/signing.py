@@ -0,0 +1,187 @@
+##############################################################################
+#
+# Copyright (c) 2023 Jens Vagelpohl and Contributors. All Rights Reserved.
+#
+# This software is subject to the provisions of the Zope Public License,
+# Version 2.1 (ZPL).  A copy of the ZPL should accompany this distribution.
+# THIS SOFTWARE IS PROVIDED "AS IS" AND ANY AND ALL EXPRESS OR IMPLIED
+# WARRANTIES ARE DISCLAIMED, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF TITLE, MERCHANTABILITY, AGAINST INFRINGEMENT, AND FITNESS
+# FOR A PARTICULAR PURPOSE.
+#
+##############################################################################
+""" In-process signatures for the SAML 2.0 HTTP-Redirect binding
+"""
+
+import base64
+import binascii
+import logging
+from urllib.parse import unquote_plus
+
+from saml2 import xmldsig
+from saml2.sigver import Signer
+from saml2.sigver import pem_format
+
+from cryptography import x509
+from cryptography.exceptions import InvalidSignature
+from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives.asymmetric import padding
+from cryptography.hazmat.primitives.asymmetric.rsa import RSAPrivateKey
+
+
+logger = logging.getLogger('Products.SAML2Plugins')
+
+SIG_SHA256_RSA_MGF1 = \
+    'http://www.w3.org/2007/05/xmldsig-more#sha256-rsa-MGF1'
+
+# Signature algorithm URI: (hash algorithm class, use RSASSA-PSS padding)
+REDIRECT_SIGNATURE_ALGORITHMS = {
+    xmldsig.SIG_RSA_SHA1: (hashes.SHA1, False),
+    xmldsig.SIG_RSA_SHA224: (hashes.SHA224, False),
+    xmldsig.SIG_RSA_SHA256: (hashes.SHA256, False),
+    xmldsig.SIG_RSA_SHA384: (hashes.SHA384, False),
+    xmldsig.SIG_RSA_SHA512: (hashes.SHA512, False),
+    SIG_SHA256_RSA_MGF1: (hashes.SHA256, True),
+}
+
+# Query string parameters covered by the signature, in signing order
+SIGNED_PARAMETERS = {
+    'SAMLRequest': ('SAMLRequest', 'RelayState', 'SigAlg'),
+    'SAMLResponse': ('SAMLResponse', 'RelayState', 'SigAlg'),
+}
+
+
+class RedirectSigner(Signer):
+    """ RSA signer for HTTP-Redirect binding query strings
+
+    Supports PKCS#1 v1.5 and RSASSA-PSS (MGF1) padding. Unlike the signers
+    shipped with pysaml2 each instance is bound to a single key, so it is
+    safe to use from several threads at once.
+    """
+
+    def __init__(self, sigalg, key=None):
+        hash_class, use_pss = REDIRECT_SIGNATURE_ALGORITHMS[sigalg]
+        super().__init__(key)
+        self.sigalg = sigalg
+        self.digest = hash_class()
+        self.use_pss = use_pss
+
+    def _padding(self):
+        if self.use_pss:
+            # RFC 6931: MGF1 with the signature digest, salt length equal
+            # to the digest length
+            return padding.PSS(mgf=padding.MGF1(self.digest),
+                               salt_length=self.digest.digest_size)
+        return padding.PKCS1v15()
+
+    def sign(self, msg, key=None):
+        """ Sign ``msg`` and return the raw signature bytes """
+        return (key or self.key).sign(msg, self._padding(), self.digest)
+
+    def verify(self, msg, sig, key=None):
+        """ Return True if ``sig`` is a valid signature for ``msg`` """
+        key = key or self.key
+        if isinstance(key, RSAPrivateKey):
+            key = key.public_key()
+
+        try:
+            key.verify(sig, msg, self._padding(), self.digest)
+        except (InvalidSignature, ValueError, TypeError):
+            return False
+        return True
+
+
+def getRedirectSigner(sigalg, key=None):
+    """ Get a signer for a HTTP-Redirect binding signature algorithm
+
+    Args:
+        sigalg (str): The signature algorithm URI
+
+    Kwargs:
+        key: A private or public key object from ``cryptography``
+
+    Returns:
+        A RedirectSigner instance or None for unsupported algorithms
+    """
+    if sigalg not in REDIRECT_SIGNATURE_ALGORITHMS:
+        return None
+    return RedirectSigner(sigalg, key=key)
+
+
+def rsacrypto_get_signer(self, sigalg, sigkey=None):
+    """ Get a signer bound to the signing key
+
+    Drop-in replacement for ``saml2.sigver.RSACrypto.get_signer``, which
+    hands out shared signer instances after setting the key on them.
+    """
+    return getRedirectSigner(sigalg, key=sigkey or self.key)
+
+
+def parse_redirect_query(query_string):
+    """ Split a query string without decoding the values
+
+    The signature covers the parameter values exactly as they were encoded
+    by the sender, so they must not be decoded and re-encoded.
+
+    Returns:
+        A mapping of parameter names to raw (still quoted) values
+    """
+    params = {}
+    for item in (query_string or '').lstrip('?').split('&'):
+        name, _, value = item.partition('=')
+        if name and name not in params:
+            params[name] = value
+    return params
+
+
+def verify_redirect_query(query_string, certificates):
+    """ Verify the SigAlg/Signature parameters of a HTTP-Redirect message
+
+    Args:
+        query_string (str): The raw query string as received
+
+        certificates (list): Base64-encoded certificates (without PEM
+            armor) as returned by pysaml2 ``MetadataStore.certs``, or
+            tuples of key name and certificate.
+
+    Returns:
+        None if the query string carries no signature, otherwise True or
+        False for a valid or invalid signature.
+    """
+    params = parse_redirect_query(query_string)
+    if 'Signature' not in params or 'SigAlg' not in params:
+        return None
+
+    sigalg = unquote_plus(params['SigAlg'])
+    signer = getRedirectSigner(sigalg)
+    if signer is None:
+        logger.warning(f'verify_redirect_query: Unsupported SigAlg {sigalg}')
+        return False
+
+    for msg_type, signed_params in SIGNED_PARAMETERS.items():
+        if msg_type in params:
+            break
+    else:
+        logger.warning('verify_redirect_query: No SAML message to verify')
+        return False
+
+    try:
+        signed = '&'.join(f'{name}={params[name]}' for name in signed_params
+                          if name in params).encode('ascii')
+        signature = base64.b64decode(unquote_plus(params['Signature']),
+                                     validate=True)
+    except (binascii.Error, ValueError):
+        return False
+
+    for cert in certificates:
+        if isinstance(cert, (tuple, list)):
+            cert = cert[1]
+        try:
+            public_key = x509.load_pem_x509_certificate(
+                pem_format(cert)).public_key()
+        except ValueError:
+            continue
+        if signer.verify(signed, signature, public_key):
+            return True
+
+    return False
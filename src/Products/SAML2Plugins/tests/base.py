@@ -19,13 +19,17 @@ import time
 import unittest
 import urllib
 from unittest.mock import MagicMock
+from unittest.mock import patch
 
 from AccessControl.SecurityManagement import newSecurityManager
 from AccessControl.SecurityManagement import noSecurityManager
 
+from ..artifact import clearArtifactResolutionPools
 from ..configuration import clearConfigurationCaches
+from .dummy import DummyBrowserIdManager
 from .dummy import DummyNameId
 from .dummy import DummyRequest
+from .dummy import DummySession
 from .dummy import DummyUser
 
 
@@ -38,6 +42,7 @@ class PluginTestCase(unittest.TestCase):
     def setUp(self):
         super().setUp()
         clearConfigurationCaches()
+        clearArtifactResolutionPools()
 
     def _makeOne(self, *args, **kw):
         configuration_folder = kw.pop('configuration_folder', None)
@@ -83,17 +88,26 @@ class InterfaceTestMixin:
             ICredentialsResetPlugin
         from Products.PluggableAuthService.interfaces.plugins import \
             IExtractionPlugin
+        from Products.PluggableAuthService.interfaces.plugins import \
+            IGroupEnumerationPlugin
+        from Products.PluggableAuthService.interfaces.plugins import \
+            IGroupsPlugin
         from Products.PluggableAuthService.interfaces.plugins import \
             IPropertiesPlugin
         from Products.PluggableAuthService.interfaces.plugins import \
             IRolesPlugin
+        from Products.PluggableAuthService.interfaces.plugins import \
+            IUserEnumerationPlugin
 
         verifyClass(IAuthenticationPlugin, self._getTargetClass())
         verifyClass(IChallengePlugin, self._getTargetClass())
         verifyClass(ICredentialsResetPlugin, self._getTargetClass())
         verifyClass(IExtractionPlugin, self._getTargetClass())
+        verifyClass(IGroupEnumerationPlugin, self._getTargetClass())
+        verifyClass(IGroupsPlugin, self._getTargetClass())
         verifyClass(IPropertiesPlugin, self._getTargetClass())
         verifyClass(IRolesPlugin, self._getTargetClass())
+        verifyClass(IUserEnumerationPlugin, self._getTargetClass())
 
 
 class SAML2PluginBaseTests:
@@ -198,6 +212,36 @@ class SAML2PluginBaseTests:
         self.assertIn(f'RelayState={urllib.parse.quote(full_url, safe="")}',
                       response.redirected)
 
+    def test_challenge_noninteractive(self):
+        plugin = self._makeOne('test1')
+        self._create_valid_configuration(plugin)
+        req = DummyRequest()
+        req.headers['X-Requested-With'] = 'XMLHttpRequest'
+        response = req.RESPONSE
+
+        # By default all requests are sent to the identity provider
+        self.assertTrue(plugin.challenge(req, response))
+        self.assertEqual(response.status, 303)
+        self.assertIn('SAMLRequest=', response.redirected)
+
+        # Non-interactive requests get a plain status without preparing an
+        # authentication request
+        for status in ('401', '403'):
+            plugin.noninteractive_challenge = status
+            response.redirected = ''
+            with patch.object(plugin, 'getIdPAuthenticationData',
+                              side_effect=AssertionError):
+                self.assertTrue(plugin.challenge(req, response))
+            self.assertEqual(response.status, int(status))
+            self.assertFalse(response.redirected)
+
+        # Browser navigations still log in
+        req.headers.clear()
+        req.headers['Accept'] = 'text/html,application/xhtml+xml,*/*;q=0.8'
+        self.assertTrue(plugin.challenge(req, response))
+        self.assertEqual(response.status, 303)
+        self.assertIn('SAMLRequest=', response.redirected)
+
     def test_challenge_binding_post(self):
         plugin = self._makeOne('test1')
         self._create_valid_configuration(plugin)
@@ -358,14 +402,17 @@ class SAML2PluginBaseTests:
 
         # Add session info to delete
         self.assertFalse(session.get(plugin._uid))
-        session[plugin._uid] = {'name_id': DummyNameId('foo')}
+        session[plugin._uid] = {'name_id': '0=,1=,2=,3=,4=foo'}
         self.assertTrue(session.get(plugin._uid))
         plugin.resetCredentials(req, req.RESPONSE)
         self.assertFalse(session.get(plugin._uid))
+        # The login session is ended for all copies of the credentials
+        self.assertTrue(plugin.isSessionRevoked({'name_id':
+                                                 '0=,1=,2=,3=,4=foo'}))
 
         # act like the user was logged in
         plugin.logoutLocally = MagicMock(return_value=True)
-        session[plugin._uid] = {'name_id': DummyNameId('foo')}
+        session[plugin._uid] = {'name_id': '0=,1=,2=,3=,4=foo'}
         self.assertTrue(session.get(plugin._uid))
         plugin.resetCredentials(req, req.RESPONSE)
         self.assertFalse(session.get(plugin._uid))
@@ -408,6 +455,112 @@ class SAML2PluginBaseTests:
                                int(time.time()),
                                delta=5)
 
+    def test_anonymous_no_session_access(self):
+        plugin = self._makeOne('test1')
+        self._create_valid_configuration(plugin)
+        plugin.browser_id_manager = DummyBrowserIdManager()
+        plugin.logoutLocally = MagicMock()
+        user = DummyUser('testuser')
+        req = DummyRequest()
+        req.SESSION = MagicMock()
+
+        # Without a browser ID the session is never touched
+        self.assertEqual(plugin.extractCredentials(req),
+                         {'plugin_uid': plugin._uid})
+        self.assertEqual(plugin.getPropertiesForUser(user, req), {})
+        self.assertEqual(plugin.getRolesForPrincipal(user, req), ())
+        self.assertFalse(plugin.loggedInHere(req))
+        plugin.resetCredentials(req, req.RESPONSE)
+        self.assertEqual(req.SESSION.mock_calls, [])
+
+        # With a browser ID the session is used
+        plugin.browser_id_manager.browser_id = 'abc'
+        req.SESSION = DummySession()
+        req.expire_cache()
+        req.SESSION.set(plugin._uid, {'_login': 'testuser',
+                                      'name_id': DummyNameId('testuser'),
+                                      'last_active': int(time.time())})
+        self.assertEqual(plugin.extractCredentials(req)['login'], 'testuser')
+        plugin.resetCredentials(req, req.RESPONSE)
+        self.assertEqual(req.SESSION[plugin._uid], {})
+
+    def test_getSessionInfo_request_cache(self):
+        plugin = self._makeOne('test1')
+        self._create_valid_configuration(plugin)
+        plugin.logoutLocally = MagicMock()
+        user = DummyUser('testuser')
+        req = DummyRequest()
+        req.SESSION.set(plugin._uid, {'_login': 'testuser',
+                                      'name_id': DummyNameId('testuser'),
+                                      'last_active': int(time.time())})
+        req.SESSION.get = MagicMock(wraps=req.SESSION.get)
+
+        # All plugin interfaces share one session lookup per request
+        self.assertEqual(plugin.extractCredentials(req)['login'], 'testuser')
+        self.assertEqual(plugin.getPropertiesForUser(user, req)['_login'],
+                         'testuser')
+        plugin.getRolesForPrincipal(user, req)
+        plugin.loggedInHere(req)
+        req.SESSION.get.assert_called_once()
+
+        # Storing new information updates the cached value
+        new_info = {'_login': 'otheruser', 'name_id': 'foo'}
+        plugin.setSessionInfo(req, new_info)
+        self.assertEqual(plugin.getSessionInfo(req), new_info)
+
+        # Logging out removes it
+        plugin.resetCredentials(req, req.RESPONSE)
+        self.assertIsNone(plugin.getSessionInfo(req))
+        req.SESSION.get.assert_called_once()
+
+    def test_getActivityUpdateInterval(self):
+        plugin = self._makeOne('test1')
+        self.assertEqual(plugin.getActivityUpdateInterval(), 60)
+
+        plugin.activity_update_interval = 0
+        self.assertEqual(plugin.getActivityUpdateInterval(), 0)
+
+        # The interval is capped at a tenth of the inactivity timeout
+        plugin.activity_update_interval = 3600
+        plugin.inactivity_timeout = 1
+        self.assertEqual(plugin.getActivityUpdateInterval(), 360)
+
+    def test_extractCredentials_activity_update(self):
+        plugin = self._makeOne('test1')
+        self._create_valid_configuration(plugin)
+        plugin.activity_update_interval = 60
+        req = DummyRequest()
+        session = req.SESSION
+        session.set = MagicMock(wraps=session.set)
+        now = int(time.time())
+        session[plugin._uid] = {'name_id': DummyNameId('foo'),
+                                '_login': 'testuser1',
+                                'last_active': now - 30}
+
+        # Recent activity marker: No session write
+        self.assertEqual(plugin.extractCredentials(req)['login'], 'testuser1')
+        session.set.assert_not_called()
+        self.assertEqual(session[plugin._uid]['last_active'], now - 30)
+
+        # Activity marker older than the update interval gets updated
+        session[plugin._uid]['last_active'] = now - 61
+        self.assertEqual(plugin.extractCredentials(req)['login'], 'testuser1')
+        session.set.assert_called_once()
+        self.assertAlmostEqual(session[plugin._uid]['last_active'], now,
+                               delta=5)
+
+        # The expiry check does not depend on the update interval
+        max_age = int(time.time()) - (plugin.inactivity_timeout * 3600)
+        session[plugin._uid]['last_active'] = max_age - 1
+        self.assertNotIn('login', plugin.extractCredentials(req))
+
+        # Without an update interval every request updates the session
+        plugin.activity_update_interval = 0
+        session.set.reset_mock()
+        session[plugin._uid]['last_active'] = now
+        plugin.extractCredentials(req)
+        session.set.assert_called_once()
+
     def test_getPropertiesForUser(self):
         plugin = self._makeOne('test1')
         self._create_valid_configuration(plugin)
@@ -430,6 +583,12 @@ class SAML2PluginBaseTests:
                          {'_login': 'testuser',
                           'someproperty': 'foo'})
 
+        # The properties are a read-only view of the session data
+        properties = plugin.getPropertiesForUser(user, req)
+        with self.assertRaises(TypeError):
+            properties['someproperty'] = 'bar'
+        self.assertEqual(session[plugin._uid]['someproperty'], 'foo')
+
     def test_getCandidateRoles(self):
         plugin = self._makeOne('test1')
         self._create_valid_configuration(plugin)
@@ -475,6 +634,12 @@ class SAML2PluginBaseTests:
         self.assertEqual(plugin.getRolesForPrincipal(user, req),
                          ('role1', 'role2'))
 
+        # Roles computed from role rules at login time are added
+        session.set(plugin._uid, {'_login': 'testuser',
+                                  '_roles': ['role2', 'role3']})
+        self.assertEqual(plugin.getRolesForPrincipal(user, req),
+                         ('role1', 'role2', 'role3'))
+
     def test_loggedInHere(self):
         plugin = self._makeOne('test1')
         self._create_valid_configuration(plugin)
@@ -17,11 +17,39 @@ from saml2.ident import decode as str_to_nameid
 
 
 class DummySession(dict):
+    """ Session stand-in
+
+    Tests change the session directly to simulate the state at the next
+    request, so writes drop the session lookups cached on the request.
+    """
+
+    request = None
+
+    def _expire_request_cache(self):
+        if self.request is not None:
+            self.request.expire_cache()
+
+    def __setitem__(self, key, value):
+        self._expire_request_cache()
+        super().__setitem__(key, value)
+
+    def clear(self):
+        self._expire_request_cache()
+        super().clear()
 
     def set(self, key, value):
         self[key] = value
 
 
+class DummyBrowserIdManager:
+
+    def __init__(self, browser_id=None):
+        self.browser_id = browser_id
+
+    def hasBrowserId(self):
+        return self.browser_id is not None
+
+
 class DummyUser:
 
     def __init__(self, name):
@@ -39,6 +67,7 @@ class DummyResponse:
         self.headers = {}
         self.status = None
         self.body = ''
+        self.cookies = {}
 
     def redirect(self, target, status=302, lock=False):
         self.redirected = target
@@ -51,20 +80,44 @@ class DummyResponse:
     def setBody(self, body):
         self.body = body
 
+    def setStatus(self, status):
+        self.status = status
+
+    def setCookie(self, name, value, **kw):
+        self.cookies[name] = dict(kw, value=value)
+
+    def expireCookie(self, name, **kw):
+        self.cookies[name] = dict(kw, value='deleted', max_age=0)
+
 
 class DummyRequest:
 
     def __init__(self):
         self.RESPONSE = self.response = DummyResponse()
         self.SESSION = DummySession()
-        self.data = {}
+        self.SESSION.request = self
+        self.cookies = {}
+        self.headers = {}
+        self.other = self.data = {}
 
     def set(self, key, value):
         self.data[key] = value
 
+    def expire_cache(self):
+        """ Remove plugin data cached for the duration of a request """
+        for key in list(self.data):
+            if key.startswith('_saml2_'):
+                del self.data[key]
+
     def get(self, key, default=None):
         return self.data.get(key, default)
 
+    def getHeader(self, name, default=None):
+        for key, value in self.headers.items():
+            if key.lower() == name.lower():
+                return value
+        return default
+
 
 class DummyNameId:
 
@@ -87,16 +140,32 @@ class DummyNameId:
 
 class DummyPySAML2Metadata:
 
-    def __init__(self, services=[]):
+    def __init__(self, services=[], entity_id='https://saml.test'):
         self._services = services
+        self._entity_id = entity_id
 
     def any2(self, typ, service, binding=None):
         return (service, binding) in self._services
 
+    def items(self):
+        descriptor = {}
+        for service, binding in self._services:
+            descriptor.setdefault(service, []).append(
+                {'binding': binding,
+                 'location': f'{self._entity_id}/{service}'})
+        return {self._entity_id: {'idpsso_descriptor': [descriptor]}}.items()
+
+
+class DummyPySAML2Config:
+
+    def __init__(self):
+        self.attribute_converters = []
+
 
 class DummyPySAML2Client:
 
     def __init__(self, parse_result=None, services=[]):
+        self.config = DummyPySAML2Config()
         self.users = {}
         self.parse_result = parse_result
         self.global_logout_result = {}
@@ -130,11 +199,16 @@ class DummyPySAML2Client:
 
 class DummySAMLResponse:
 
-    def __init__(self, subject=None, issuer='', identity={}, status='ok'):
+    def __init__(self, subject=None, issuer='', identity={}, status='ok',
+                 session_index=None):
         self._subject = subject
         self._issuer = issuer
         self._identity = identity
         self._status = status
+        self._session_index = session_index
+
+    def session_info(self):
+        return {'session_index': self._session_index}
 
     def get_subject(self):
         return self._subject
@@ -0,0 +1,392 @@
+##############################################################################
+#
+# Copyright (c) 2023 Jens Vagelpohl and Contributors. All Rights Reserved.
+#
+# This software is subject to the provisions of the Zope Public License,
+# Version 2.1 (ZPL).  A copy of the ZPL should accompany this distribution.
+# THIS SOFTWARE IS PROVIDED "AS IS" AND ANY AND ALL EXPRESS OR IMPLIED
+# WARRANTIES ARE DISCLAIMED, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF TITLE, MERCHANTABILITY, AGAINST INFRINGEMENT, AND FITNESS
+# FOR A PARTICULAR PURPOSE.
+#
+##############################################################################
+""" Tests for HTTP-Artifact binding resolution
+"""
+
+import os
+import shutil
+import socket
+import tempfile
+import threading
+import time
+import unittest
+from http.server import BaseHTTPRequestHandler
+from http.server import ThreadingHTTPServer
+
+from saml2 import BINDING_HTTP_REDIRECT
+from saml2 import BINDING_SOAP
+from saml2.saml import NAMEID_FORMAT_PERSISTENT
+from saml2.saml import NameID
+
+from ..configuration import clearConfigurationCaches
+from .base import PluginTestCase
+
+
+ACS_URL = 'http://sp.example.com/'
+SP_ENTITY_ID = 'http://sp.example.com/metadata.xml'
+
+
+class LocalServer:
+    """ Threaded HTTP/1.1 server with keep-alive connections
+
+    ``respond`` is called with the request body and returns the response
+    body. The server counts connections and the highest number of
+    requests handled at the same time.
+    """
+
+    def __init__(self, respond, delay=0):
+        self.respond = respond
+        self.delay = delay
+        self.connections = 0
+        self.sockets = []
+        self.active = 0
+        self.max_active = 0
+        self.lock = threading.Lock()
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def setup(self):
+                with server.lock:
+                    server.connections += 1
+                    server.sockets.append(self.request)
+                super().setup()
+
+            def log_message(self, *args):
+                pass
+
+            def do_POST(self):
+                with server.lock:
+                    server.active += 1
+                    server.max_active = max(server.max_active, server.active)
+                try:
+                    length = int(self.headers['Content-Length'])
+                    body = self.rfile.read(length).decode('utf-8')
+                    time.sleep(server.delay)
+                    status, data = server.respond(body)
+                finally:
+                    with server.lock:
+                        server.active -= 1
+                data = data.encode('utf-8')
+                self.send_response(status)
+                self.send_header('Content-Type', 'text/xml')
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+        self.httpd = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        # Wait for request threads on shutdown, ignore errors from requests
+        # the client stopped waiting for
+        self.httpd.daemon_threads = False
+        self.httpd.handle_error = lambda request, client_address: None
+        self.url = f'http://127.0.0.1:{self.httpd.server_address[1]}/ars'
+        self.thread = threading.Thread(target=self.httpd.serve_forever,
+                                       daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.httpd.shutdown()
+        # End idle keep-alive connections, then wait for request threads
+        for sock in self.sockets:
+            try:
+                sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+        self.httpd.server_close()
+
+
+class LocalArtifactIdP:
+    """ Stand-in identity provider with an artifact resolution service """
+
+    entity_id = 'https://idp.test/metadata'
+
+    def __init__(self, sp_config, key_file, cert_file, folder):
+        from saml2.config import IdPConfig
+        from saml2.metadata import entity_descriptor
+        from saml2.server import Server
+
+        self.tamper = False
+        self.server = LocalServer(self.resolve)
+        sp_metadata_file = os.path.join(folder, 'sp.xml')
+        with open(sp_metadata_file, 'w') as fp:
+            fp.write(str(entity_descriptor(sp_config)))
+
+        config = IdPConfig().load({
+            'entityid': self.entity_id,
+            'service': {'idp': {'endpoints': {
+                'single_sign_on_service': [
+                    ('https://idp.test/sso', BINDING_HTTP_REDIRECT)],
+                'artifact_resolution_service': [
+                    (self.server.url, BINDING_SOAP, 0)]}}},
+            'metadata': {'local': [sp_metadata_file]},
+            'key_file': key_file,
+            'cert_file': cert_file,
+            'xmlsec_binary': sp_config.xmlsec_binary})
+        self.idp = Server(config=config)
+        self.metadata_file = os.path.join(folder, 'local_idp.xml')
+        with open(self.metadata_file, 'w') as fp:
+            fp.write(str(entity_descriptor(config)))
+
+    def artifact(self, name='jdoe'):
+        """ Create a SAML response and return an artifact for it """
+        response = self.idp.create_authn_response(
+            {}, None, ACS_URL, SP_ENTITY_ID,
+            name_id=NameID(text=name, format=NAMEID_FORMAT_PERSISTENT),
+            userid=name,
+            authn={'class_ref': 'urn:oasis:names:tc:SAML:2.0:ac:classes:'
+                                'Password'})
+        return self.idp.use_artifact(response, 0)
+
+    def resolve(self, body):
+        """ Answer an ArtifactResolve request with a signed response """
+        request = self.idp.parse_artifact_resolve(body)
+        response = self.idp.create_artifact_response(
+            request, request.artifact.text, bindings=[BINDING_SOAP],
+            issuer=self.idp._issuer())
+        signed = self.idp.sign(response)
+        data = self.idp.apply_binding(BINDING_SOAP, signed, ACS_URL)['data']
+        if self.tamper:
+            data = data.replace('>jdoe<', '>root<')
+        return 200, data
+
+    def stop(self):
+        self.server.stop()
+
+
+class ArtifactResolutionPoolTests(unittest.TestCase):
+
+    def setUp(self):
+        self.server = LocalServer(lambda body: (200, body.upper()))
+
+    def tearDown(self):
+        self.server.stop()
+
+    def _makeOne(self, timeout=2, max_concurrency=10):
+        from ..artifact import ArtifactResolutionPool
+        pool = ArtifactResolutionPool(timeout, max_concurrency)
+        self.addCleanup(pool.close)
+        return pool
+
+    def test_keep_alive(self):
+        pool = self._makeOne()
+        for i in range(5):
+            self.assertEqual(pool.post(self.server.url, f'msg{i}'),
+                             f'MSG{i}')
+
+        # All calls shared one connection
+        self.assertEqual(self.server.connections, 1)
+
+    def test_timeout(self):
+        import requests
+
+        pool = self._makeOne(timeout=0.2)
+        self.server.delay = 1
+        start = time.time()
+        with self.assertRaises(requests.Timeout):
+            pool.post(self.server.url, 'msg')
+        self.assertLess(time.time() - start, 1)
+
+    def test_http_error(self):
+        import requests
+
+        pool = self._makeOne()
+        self.server.respond = lambda body: (500, 'Failure')
+        with self.assertRaises(requests.HTTPError):
+            pool.post(self.server.url, 'msg')
+
+    def test_max_concurrency(self):
+        pool = self._makeOne(max_concurrency=2)
+        self.server.delay = 0.1
+        threads = [threading.Thread(target=pool.post,
+                                    args=(self.server.url, 'msg'))
+                   for _ in range(6)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(self.server.max_active, 2)
+        self.assertLessEqual(self.server.connections, 2)
+
+    def test_no_free_connection(self):
+        pool = self._makeOne(timeout=0.1, max_concurrency=1)
+        # Simulate a call that keeps the only connection busy
+        pool._slots.acquire()
+        with self.assertRaises(TimeoutError):
+            pool.post(self.server.url, 'msg')
+        self.assertEqual(self.server.connections, 0)
+
+        pool._slots.release()
+        self.assertEqual(pool.post(self.server.url, 'msg'), 'MSG')
+
+
+class ArtifactResolutionPoolRegistryTests(unittest.TestCase):
+
+    def setUp(self):
+        from ..artifact import clearArtifactResolutionPools
+        clearArtifactResolutionPools()
+        self.addCleanup(clearArtifactResolutionPools)
+
+    def test_getArtifactResolutionPool(self):
+        from ..artifact import getArtifactResolutionPool
+
+        pool = getArtifactResolutionPool('uid', 'https://idp/ars', 5, 10)
+        self.assertEqual(pool.timeout, 5)
+        self.assertEqual(pool.max_concurrency, 10)
+
+        # Services on the same host share a pool
+        self.assertIs(
+            getArtifactResolutionPool('uid', 'https://idp/other', 5, 10),
+            pool)
+        self.assertIsNot(
+            getArtifactResolutionPool('uid', 'https://idp2/ars', 5, 10),
+            pool)
+        self.assertIsNot(
+            getArtifactResolutionPool('uid2', 'https://idp/ars', 5, 10),
+            pool)
+
+        # Changed settings replace the pool
+        new_pool = getArtifactResolutionPool('uid', 'https://idp/ars', 1, 10)
+        self.assertIsNot(new_pool, pool)
+        self.assertEqual(new_pool.timeout, 1)
+
+        # At least one connection is allowed
+        pool = getArtifactResolutionPool('uid', 'https://idp/ars', 1, 0)
+        self.assertEqual(pool.max_concurrency, 1)
+
+    def test_clearArtifactResolutionPools(self):
+        from ..artifact import POOLS
+        from ..artifact import clearArtifactResolutionPools
+        from ..artifact import getArtifactResolutionPool
+
+        getArtifactResolutionPool('uid', 'https://idp/ars', 5, 10)
+        self.assertTrue(POOLS)
+        clearArtifactResolutionPools()
+        self.assertFalse(POOLS)
+
+
+class ExtractResponseTests(unittest.TestCase):
+
+    def _callFUT(self, xmlstr):
+        from ..artifact import extractResponse
+        return extractResponse(xmlstr)
+
+    def test_extract(self):
+        xmlstr = (
+            '<soap:Envelope xmlns:soap="urn:soap">'
+            '<soap:Body xmlns:s="urn:oasis:names:tc:SAML:2.0:assertion">'
+            '<p:ArtifactResponse '
+            'xmlns:p="urn:oasis:names:tc:SAML:2.0:protocol" ID="a">'
+            '<s:Issuer>idp</s:Issuer>'
+            '<p:Response ID="r" Attr="1 &gt; 0">'
+            '<s:Assertion>ä</s:Assertion>'
+            '<p:Response/>'
+            '</p:Response>'
+            '</p:ArtifactResponse></soap:Body></soap:Envelope>')
+
+        # The original text is kept, inherited namespaces are declared
+        self.assertEqual(
+            self._callFUT(xmlstr),
+            ('<p:Response xmlns:soap="urn:soap" '
+             'xmlns:s="urn:oasis:names:tc:SAML:2.0:assertion" '
+             'xmlns:p="urn:oasis:names:tc:SAML:2.0:protocol" '
+             'ID="r" Attr="1 &gt; 0">'
+             '<s:Assertion>ä</s:Assertion>'
+             '<p:Response/>'
+             '</p:Response>').encode('utf-8'))
+
+    def test_default_namespace(self):
+        xmlstr = (b'<ArtifactResponse '
+                  b'xmlns="urn:oasis:names:tc:SAML:2.0:protocol">'
+                  b'<Response ID="r"/></ArtifactResponse>')
+        self.assertEqual(
+            self._callFUT(xmlstr),
+            b'<Response xmlns="urn:oasis:names:tc:SAML:2.0:protocol"'
+            b' ID="r"/>')
+
+    def test_no_response(self):
+        self.assertIsNone(self._callFUT('<Response xmlns="urn:other"/>'))
+
+    def test_doctype(self):
+        xmlstr = ('<!DOCTYPE x [<!ENTITY a "aaaa">]>'
+                  '<Response xmlns="urn:oasis:names:tc:SAML:2.0:protocol">'
+                  '&a;</Response>')
+        with self.assertRaises(ValueError):
+            self._callFUT(xmlstr)
+
+
+class ArtifactBindingTests(PluginTestCase):
+
+    def _getTargetClass(self):
+        from ..SAML2Plugin import SAML2Plugin
+        return SAML2Plugin
+
+    def setUp(self):
+        super().setUp()
+        self.tmpdir = tempfile.mkdtemp()
+        self.plugin = self._makeOne('test')
+        self._create_valid_configuration(self.plugin)
+        cfg = self.plugin.getConfiguration()
+        # The stand-in signs the ArtifactResponse, not the inner response
+        cfg['service']['sp']['want_response_signed'] = False
+        self.idp = LocalArtifactIdP(self.plugin.getPySAML2Configuration(),
+                                    cfg['key_file'], cfg['cert_file'],
+                                    self.tmpdir)
+        cfg['metadata']['local'].append(self.idp.metadata_file)
+        clearConfigurationCaches()
+
+    def tearDown(self):
+        self.idp.stop()
+        shutil.rmtree(self.tmpdir)
+        super().tearDown()
+
+    def test_login(self):
+        user_info = self.plugin.handleACSRequest(self.idp.artifact(),
+                                                 'ARTIFACT')
+        self.assertEqual(user_info['_login'], 'jdoe')
+        self.assertEqual(user_info['issuer'], self.idp.entity_id)
+        self.assertTrue(user_info['session_index'])
+
+        # Later logins reuse the connection to the identity provider
+        user_info = self.plugin.handleACSRequest(self.idp.artifact('jane'),
+                                                 'ARTIFACT')
+        self.assertEqual(user_info['_login'], 'jane')
+        self.assertEqual(self.idp.server.connections, 1)
+
+    def test_invalid_artifacts(self):
+        # Garbage
+        self.assertEqual(
+            self.plugin.handleACSRequest('garbage', 'ARTIFACT'), {})
+
+        # An artifact from an unknown identity provider
+        artifact = self.idp.artifact()
+        self.plugin.getPySAML2Client().sourceid = {}
+        self.assertEqual(self.plugin.handleACSRequest(artifact, 'ARTIFACT'),
+                         {})
+        self.assertEqual(self.idp.server.connections, 0)
+
+    def test_tampered(self):
+        self.idp.tamper = True
+        self.assertEqual(
+            self.plugin.handleACSRequest(self.idp.artifact(), 'ARTIFACT'),
+            {})
+
+    def test_timeout(self):
+        self.plugin.artifact_timeout = 0.2
+        self.idp.server.delay = 1
+        start = time.time()
+        self.assertEqual(
+            self.plugin.handleACSRequest(self.idp.artifact(), 'ARTIFACT'),
+            {})
+        self.assertLess(time.time() - start, 1)
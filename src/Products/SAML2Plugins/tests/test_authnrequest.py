@@ -0,0 +1,195 @@
+##############################################################################
+#
+# Copyright (c) 2023 Jens Vagelpohl and Contributors. All Rights Reserved.
+#
+# This software is subject to the provisions of the Zope Public License,
+# Version 2.1 (ZPL).  A copy of the ZPL should accompany this distribution.
+# THIS SOFTWARE IS PROVIDED "AS IS" AND ANY AND ALL EXPRESS OR IMPLIED
+# WARRANTIES ARE DISCLAIMED, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF TITLE, MERCHANTABILITY, AGAINST INFRINGEMENT, AND FITNESS
+# FOR A PARTICULAR PURPOSE.
+#
+##############################################################################
+""" Tests for pre-rendered authentication request templates
+"""
+
+import unittest
+from unittest.mock import patch
+
+from saml2 import BINDING_HTTP_POST
+from saml2 import BINDING_HTTP_REDIRECT
+
+from .base import PluginTestCase
+from .dummy import DummyRequest
+
+
+MESSAGE_ID = 'id-Zx8Yq3Lm0Pa1Rb2Sc'
+ISSUE_INSTANT = '2024-02-29T12:34:56Z'
+
+
+class AuthnRequestTemplateTests(unittest.TestCase):
+
+    def _makeOne(self, xml):
+        from ..authnrequest import AuthnRequestTemplate
+        return AuthnRequestTemplate(xml)
+
+    def test_render(self):
+        template = self._makeOne(
+            '<?xml version="1.0"?>\n'
+            '<p:AuthnRequest xmlns:p="urn:p" ID="id-template" Version="2.0"'
+            ' IssueInstant="2000-01-01T00:00:00Z"><a:Ext ID="keep"'
+            ' IssueInstant="keep"/></p:AuthnRequest>')
+
+        self.assertEqual(
+            template.render('id-new', '2024-01-01T00:00:00Z'),
+            '<?xml version="1.0"?>\n'
+            '<p:AuthnRequest xmlns:p="urn:p" ID="id-new" Version="2.0"'
+            ' IssueInstant="2024-01-01T00:00:00Z"><a:Ext ID="keep"'
+            ' IssueInstant="keep"/></p:AuthnRequest>')
+
+        # Values are escaped
+        self.assertIn(' ID="a&quot;&lt;b"',
+                      template.render('a"<b', '2024-01-01T00:00:00Z'))
+
+    def test_invalid(self):
+        with self.assertRaises(ValueError):
+            self._makeOne('<AuthnRequest ID="a"><Issuer/></AuthnRequest>')
+        with self.assertRaises(ValueError):
+            self._makeOne('<AuthnRequest><Ext ID="a" IssueInstant="b"/>'
+                          '</AuthnRequest>')
+
+
+class AuthnRequestTemplateFunctionalTests(PluginTestCase):
+
+    def _getTargetClass(self):
+        from ..SAML2Plugin import SAML2Plugin
+        return SAML2Plugin
+
+    def _makeOne(self, metadata='mocksaml_metadata.xml', **sp_settings):
+        from ..configuration import clearConfigurationCaches
+
+        clearConfigurationCaches()
+        plugin = super()._makeOne('test')
+        self._create_valid_configuration(plugin)
+        plugin._configuration['metadata']['local'] = [
+            self._test_path(metadata)]
+        plugin._configuration['service']['sp'].update(sp_settings)
+        plugin.authn_request_templates = True
+        return plugin
+
+    def _fixed_values(self):
+        """ Make pysaml2 and the templates use the same ID and time stamp
+        """
+        patches = [patch('saml2.entity.sid', return_value=MESSAGE_ID),
+                   patch('saml2.entity.instant', return_value=ISSUE_INSTANT),
+                   patch('saml2.s_utils.sid', return_value=MESSAGE_ID),
+                   patch('saml2.time_util.instant',
+                         return_value=ISSUE_INSTANT)]
+        for p in patches:
+            p.start()
+            self.addCleanup(p.stop)
+
+    def test_matches_pysaml2(self):
+        from ..authnrequest import getAuthnRequestTemplate
+
+        destination = 'https://mocksaml.com/api/saml/sso'
+        settings = (
+            {},
+            {'name_id_policy_format':
+                'urn:oasis:names:tc:SAML:2.0:nameid-format:persistent',
+             'force_authn': True,
+             'requested_authn_context': {
+                 'authn_context_class_ref': [
+                     'urn:oasis:names:tc:SAML:2.0:ac:classes:Password'],
+                 'comparison': 'minimum'}},
+        )
+        for sp_settings in settings:
+            plugin = self._makeOne(**sp_settings)
+            client = plugin.getPySAML2Client()
+
+            for binding in (BINDING_HTTP_REDIRECT, BINDING_HTTP_POST):
+                template = getAuthnRequestTemplate(plugin._uid, client,
+                                                   binding, destination)
+                with patch('saml2.entity.instant',
+                           return_value=ISSUE_INSTANT):
+                    _, reference = client.create_authn_request(
+                        destination=destination,
+                        binding=BINDING_HTTP_POST,
+                        message_id=MESSAGE_ID,
+                        sign=False)
+                self.assertEqual(
+                    template.render(MESSAGE_ID, ISSUE_INSTANT).encode(),
+                    str(reference).encode())
+
+    def test_getIdPAuthenticationData_redirect(self):
+        for signed in (False, True):
+            plugin = self._makeOne(authn_requests_signed=signed)
+            req = DummyRequest()
+            req.set('came_from', 'https://foo/bar?a=b&c="d"')
+            self._fixed_values()
+
+            plugin.authn_request_templates = False
+            reference = plugin.getIdPAuthenticationData(req)
+            plugin.authn_request_templates = True
+            # The first call renders the template, later calls reuse it
+            http_info = plugin.getIdPAuthenticationData(req)
+            with patch.object(plugin.getPySAML2Client(),
+                              'create_authn_request',
+                              side_effect=AssertionError):
+                self.assertEqual(plugin.getIdPAuthenticationData(req),
+                                 http_info)
+
+            location = dict(http_info['headers'])['Location']
+            self.assertEqual(location,
+                             dict(reference['headers'])['Location'])
+            self.assertEqual('Signature=' in location, signed)
+
+    def test_getIdPAuthenticationData_post(self):
+        plugin = self._makeOne('mocksaml_metadata_binding_post.xml')
+        req = DummyRequest()
+        req.set('came_from', 'https://foo/<bar>')
+        self._fixed_values()
+
+        plugin.authn_request_templates = False
+        reference = plugin.getIdPAuthenticationData(req)
+        plugin.authn_request_templates = True
+        http_info = plugin.getIdPAuthenticationData(req)
+
+        self.assertEqual(http_info['data'].encode(),
+                         reference['data'].encode())
+
+    def test_getIdPAuthenticationData_post_signed(self):
+        # Signed XML documents cannot be templated
+        plugin = self._makeOne('mocksaml_metadata_binding_post.xml',
+                               authn_requests_signed=True)
+        client = plugin.getPySAML2Client()
+
+        with patch('Products.SAML2Plugins.serviceprovider.'
+                   'getAuthnRequestTemplate') as template:
+            with patch.object(client, 'create_authn_request',
+                              wraps=client.create_authn_request) as create:
+                plugin.getIdPAuthenticationData(DummyRequest())
+        template.assert_not_called()
+        create.assert_called_once()
+        self.assertIsNone(create.call_args.kwargs['sign'])
+
+    def test_configuration_reload(self):
+        from ..authnrequest import getAuthnRequestTemplate
+        from ..configuration import clearConfigurationCaches
+
+        plugin = self._makeOne()
+        client = plugin.getPySAML2Client()
+        template = getAuthnRequestTemplate(plugin._uid, client,
+                                           BINDING_HTTP_REDIRECT, 'https://a')
+        self.assertIs(getAuthnRequestTemplate(plugin._uid, client,
+                                              BINDING_HTTP_REDIRECT,
+                                              'https://a'),
+                      template)
+
+        clearConfigurationCaches()
+        plugin._v_saml2client = None
+        self.assertIsNot(getAuthnRequestTemplate(plugin._uid,
+                                                 plugin.getPySAML2Client(),
+                                                 BINDING_HTTP_REDIRECT,
+                                                 'https://a'),
+                         template)
@@ -0,0 +1,121 @@
+##############################################################################
+#
+# Copyright (c) 2023 Jens Vagelpohl and Contributors. All Rights Reserved.
+#
+# This software is subject to the provisions of the Zope Public License,
+# Version 2.1 (ZPL).  A copy of the ZPL should accompany this distribution.
+# THIS SOFTWARE IS PROVIDED "AS IS" AND ANY AND ALL EXPRESS OR IMPLIED
+# WARRANTIES ARE DISCLAIMED, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF TITLE, MERCHANTABILITY, AGAINST INFRINGEMENT, AND FITNESS
+# FOR A PARTICULAR PURPOSE.
+#
+##############################################################################
+""" Tests for the non-interactive request classifier
+"""
+
+import unittest
+
+from .dummy import DummyRequest
+
+
+def request(method='GET', path='/folder/page', **headers):
+    req = DummyRequest()
+    req.set('REQUEST_METHOD', method)
+    req.set('PATH_INFO', path)
+    req.headers.update({k.replace('_', '-'): v for k, v in headers.items()})
+    return req
+
+
+class ChallengeClassifierTests(unittest.TestCase):
+
+    def _makeOne(self, rules=None):
+        from ..challenge import NONINTERACTIVE_RULES
+        from ..challenge import ChallengeClassifier
+        if rules is None:
+            rules = NONINTERACTIVE_RULES
+        return ChallengeClassifier(rules)
+
+    def test_no_rules(self):
+        classifier = self._makeOne(())
+        self.assertFalse(classifier)
+        self.assertTrue(classifier.isInteractive(
+            request('HEAD', '/x.css', X_Requested_With='XMLHttpRequest')))
+
+    def test_default_rules(self):
+        classifier = self._makeOne()
+        self.assertTrue(classifier)
+
+        # Browser navigations
+        self.assertTrue(classifier.isInteractive(request()))
+        self.assertTrue(classifier.isInteractive(request('POST')))
+        self.assertTrue(classifier.isInteractive(request(
+            Accept='text/html,application/xhtml+xml,*/*;q=0.8',
+            Sec_Fetch_Mode='navigate')))
+        self.assertTrue(classifier.isInteractive(request(Accept='*/*')))
+
+        # Methods
+        self.assertFalse(classifier.isInteractive(request('HEAD')))
+        self.assertFalse(classifier.isInteractive(request('options')))
+
+        # Script calls
+        self.assertFalse(classifier.isInteractive(
+            request(X_Requested_With='XMLHttpRequest')))
+        self.assertFalse(classifier.isInteractive(
+            request(Accept='*/*', Sec_Fetch_Mode='cors')))
+        self.assertFalse(classifier.isInteractive(
+            request(Accept='application/json')))
+
+        # Feed readers
+        self.assertFalse(classifier.isInteractive(request(
+            Accept='application/rss+xml, application/atom+xml;q=0.9')))
+
+        # Assets
+        self.assertFalse(classifier.isInteractive(request(
+            path='/++resource++site/style.css')))
+        self.assertFalse(classifier.isInteractive(request(
+            path='/logo.PNG')))
+        self.assertTrue(classifier.isInteractive(request(
+            path='/javascript-guide')))
+
+    def test_rules(self):
+        classifier = self._makeOne(
+            ['# Comment',
+             'method propfind',
+             'header X-Api-Client',
+             'header Sec-Fetch-Dest image',
+             'header Sec-Fetch-Dest script',
+             'path ^/api/',
+             'unknown value',
+             'path',
+             'path ([',
+             ''])
+        self.assertEqual(classifier.methods, {'PROPFIND'})
+        self.assertEqual(classifier.headers,
+                         {'X-Api-Client': set(),
+                          'Sec-Fetch-Dest': {'image', 'script'}})
+        self.assertEqual(len(classifier.paths), 1)
+
+        self.assertFalse(classifier.isInteractive(request('PROPFIND')))
+        self.assertFalse(classifier.isInteractive(request(X_Api_Client='')))
+        self.assertFalse(classifier.isInteractive(
+            request(Sec_Fetch_Dest='Image')))
+        self.assertTrue(classifier.isInteractive(
+            request(Sec_Fetch_Dest='document')))
+        self.assertFalse(classifier.isInteractive(request(path='/api/x')))
+        self.assertTrue(classifier.isInteractive(request(path='/x/api/')))
+        # No accept rule
+        self.assertTrue(classifier.isInteractive(
+            request(Accept='application/json')))
+
+        # A header rule without values matches any value
+        classifier = self._makeOne(['header X-Client a', 'header X-Client'])
+        self.assertEqual(classifier.headers, {'X-Client': set()})
+
+    def test_getChallengeClassifier(self):
+        from ..challenge import clearChallengeClassifiers
+        from ..challenge import getChallengeClassifier
+
+        classifier = getChallengeClassifier(['method HEAD'])
+        self.assertIs(getChallengeClassifier(('method HEAD',)), classifier)
+        clearChallengeClassifiers()
+        self.assertIsNot(getChallengeClassifier(['method HEAD']), classifier)
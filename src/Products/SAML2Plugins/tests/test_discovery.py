@@ -0,0 +1,301 @@
+##############################################################################
+#
+# Copyright (c) 2023 Jens Vagelpohl and Contributors. All Rights Reserved.
+#
+# This software is subject to the provisions of the Zope Public License,
+# Version 2.1 (ZPL).  A copy of the ZPL should accompany this distribution.
+# THIS SOFTWARE IS PROVIDED "AS IS" AND ANY AND ALL EXPRESS OR IMPLIED
+# WARRANTIES ARE DISCLAIMED, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF TITLE, MERCHANTABILITY, AGAINST INFRINGEMENT, AND FITNESS
+# FOR A PARTICULAR PURPOSE.
+#
+##############################################################################
+""" Tests for the identity provider discovery index and logo cache
+"""
+
+import random
+import time
+import unittest
+from unittest.mock import MagicMock
+from unittest.mock import patch
+
+from .base import PluginTestCase
+
+
+def entry(entity_id, name, names=(), keywords=(), domains=(), logo=''):
+    return {'entity_id': entity_id,
+            'name': name,
+            'names': tuple(names) or (name,),
+            'keywords': tuple(keywords),
+            'domains': tuple(domains),
+            'logo': logo}
+
+
+class DiscoveryIndexTests(unittest.TestCase):
+
+    def _makeOne(self, entries=None):
+        from ..discovery import DiscoveryIndex
+        if entries is None:
+            entries = [
+                entry('https://idp.uni.example/idp', 'University of Example',
+                      names=('University of Example',
+                             'Universität Beispiel'),
+                      keywords=('research', 'campus library'),
+                      domains=('uni.example',)),
+                entry('https://login.college.example/saml',
+                      'Example Community College'),
+                entry('https://idp.other.example/idp', 'Ärzteverband',
+                      domains=('aerzte.example',))]
+        return DiscoveryIndex(entries)
+
+    def _ids(self, results):
+        return [x['entity_id'] for x in results]
+
+    def test_search(self):
+        index = self._makeOne()
+        self.assertEqual(len(index), 3)
+
+        # Word prefixes of display names in any language
+        self.assertEqual(self._ids(index.search('univ')),
+                         ['https://idp.uni.example/idp'])
+        self.assertEqual(self._ids(index.search('BEISP')),
+                         ['https://idp.uni.example/idp'])
+        self.assertEqual(self._ids(index.search('com col')),
+                         ['https://login.college.example/saml'])
+
+        # Accents are ignored
+        self.assertEqual(self._ids(index.search('universitat')),
+                         ['https://idp.uni.example/idp'])
+        self.assertEqual(self._ids(index.search('arzte')),
+                         ['https://idp.other.example/idp'])
+
+        # Keywords, domains and entity ID host names
+        self.assertEqual(self._ids(index.search('library')),
+                         ['https://idp.uni.example/idp'])
+        self.assertEqual(self._ids(index.search('uni.exam')),
+                         ['https://idp.uni.example/idp'])
+        self.assertEqual(self._ids(index.search('login.coll')),
+                         ['https://login.college.example/saml'])
+
+        # Results are sorted by display name
+        self.assertEqual(self._ids(index.search('example')),
+                         ['https://idp.other.example/idp',
+                          'https://login.college.example/saml',
+                          'https://idp.uni.example/idp'])
+        self.assertEqual(self._ids(index.search('example', limit=1)),
+                         ['https://idp.other.example/idp'])
+
+        # All words must match
+        self.assertEqual(index.search('university college'), [])
+        self.assertEqual(index.search('nothing'), [])
+
+    def test_search_empty(self):
+        index = self._makeOne()
+        self.assertEqual(len(index.search('')), 3)
+        self.assertEqual(len(index.search(' - ', limit=2)), 2)
+
+    def test_search_long_words(self):
+        from ..discovery import MAX_PREFIX_LENGTH
+
+        index = self._makeOne([
+            entry('https://a/', 'Forschungsgemeinschaft Nord'),
+            entry('https://b/', 'Forschungsgemeinschaftsverbund Süd')])
+        self.assertLess(MAX_PREFIX_LENGTH, len('forschungsgemeinschafts'))
+
+        self.assertEqual(self._ids(index.search('forschungsgemeinschaft')),
+                         ['https://a/', 'https://b/'])
+        self.assertEqual(
+            self._ids(index.search('forschungsgemeinschafts')),
+            ['https://b/'])
+        self.assertEqual(index.search('forschungsgemeinschaftx'), [])
+
+    def test_get(self):
+        index = self._makeOne()
+        self.assertEqual(index.get('https://idp.uni.example/idp')['name'],
+                         'University of Example')
+        self.assertIsNone(index.get('https://unknown/'))
+
+    def test_benchmark(self):
+        rnd = random.Random(42)
+        syllables = ['ba', 'ker', 'lin', 'mo', 'nu', 'ra', 'sto', 'ter',
+                     'vi', 'wen', 'zu', 'dor', 'fel', 'gan', 'hol', 'is']
+
+        def word():
+            return ''.join(rnd.choice(syllables)
+                           for _ in range(rnd.randint(2, 4)))
+
+        entries = []
+        for i in range(5000):
+            name = f'{word().title()} {rnd.choice(("University", "College", "Institute", "Hospital"))} {word().title()}'  # noqa: E501
+            entries.append(entry(f'https://idp{i}.example/idp', name,
+                                 keywords=(word(), word()),
+                                 domains=(f'{word()}{i}.example',)))
+        index = self._makeOne(entries)
+
+        queries = []
+        for text in [x['name'] for x in rnd.sample(entries, 100)]:
+            # Typeahead: every prefix of the typed text
+            queries.extend(text[:length] for length in range(1, 12))
+        queries.extend(['u', 'univ', 'college ba', 'z', 'ter lin',
+                        'institute of', 'wen.example'])
+
+        start = time.perf_counter()
+        for query in queries:
+            index.search(query)
+        elapsed = (time.perf_counter() - start) / len(queries)
+
+        # Generous upper bound, a query takes about 0.05 ms
+        self.assertLess(elapsed, 0.005)
+
+
+class DiscoveryEntriesTests(PluginTestCase):
+
+    def _getTargetClass(self):
+        from ..SAML2Plugin import SAML2Plugin
+        return SAML2Plugin
+
+    def _makeOne(self):
+        from ..configuration import clearConfigurationCaches
+
+        plugin = super()._makeOne('test')
+        self._create_valid_configuration(plugin)
+        plugin.getConfiguration()['metadata']['local'] = [
+            self._test_path('discovery_metadata.xml')]
+        clearConfigurationCaches()
+        return plugin
+
+    def test_discoveryEntries(self):
+        from ..discovery import discoveryEntries
+
+        plugin = self._makeOne()
+        metadata = plugin.getPySAML2Configuration().metadata
+        entries = {x['entity_id']: x for x in discoveryEntries(metadata)}
+
+        # Service providers are left out
+        self.assertEqual(sorted(entries),
+                         ['https://idp.uni.example/idp',
+                          'https://login.college.example/saml',
+                          'https://plain.example/idp'])
+
+        uni = entries['https://idp.uni.example/idp']
+        # The English display name is preferred
+        self.assertEqual(uni['name'], 'University of Example')
+        self.assertEqual(uni['names'], ('Universität Beispiel',
+                                        'University of Example'))
+        self.assertEqual(uni['keywords'], ('research', 'campus library'))
+        self.assertEqual(uni['domains'], ('uni.example',))
+        # The smallest logo is used
+        self.assertEqual(uni['logo'], 'data:image/png;base64,iVBORw0KGgo=')
+
+        # Without UIInfo the organization name is used
+        plain = entries['https://plain.example/idp']
+        self.assertEqual(plain['name'], 'Plain Organization')
+        self.assertEqual(plain['logo'], '')
+
+    def test_getDiscoveryIndex(self):
+        from ..configuration import clearConfigurationCaches
+
+        plugin = self._makeOne()
+        index = plugin.getDiscoveryIndex()
+        self.assertEqual(
+            [x['entity_id'] for x in index.search('plain')],
+            ['https://plain.example/idp'])
+
+        # The index is built once for the loaded metadata
+        self.assertIs(plugin.getDiscoveryIndex(), index)
+
+        # Loading the configuration again builds a new index
+        clearConfigurationCaches()
+        self.assertIsNot(plugin.getDiscoveryIndex(), index)
+
+        # Without configuration the index is empty
+        with patch.object(plugin, 'getPySAML2Configuration',
+                          return_value=None):
+            self.assertEqual(len(plugin.getDiscoveryIndex()), 0)
+
+
+class LogoCacheTests(unittest.TestCase):
+
+    def setUp(self):
+        from ..discovery import clearLogoCache
+        clearLogoCache()
+        self.addCleanup(clearLogoCache)
+
+    def _callFUT(self, url):
+        from ..discovery import getLogo
+        return getLogo(url, timeout=1)
+
+    def test_data_url(self):
+        self.assertEqual(self._callFUT('data:image/png;base64,iVBORw0KGgo='),
+                         ('image/png', b'\x89PNG\r\n\x1a\n'))
+        self.assertEqual(self._callFUT('data:image/GIF;base64,R0lGODlh'),
+                         ('image/gif', b'GIF89a'))
+
+    def test_data_url_not_raster(self):
+        for url in ('data:image/svg+xml,%3Csvg%2F%3E',
+                    'data:image/svg+xml;base64,PHN2Zy8+',
+                    'data:text/html,%3Cscript%3E%3C%2Fscript%3E'):
+            self.assertIsNone(self._callFUT(url))
+
+    def _fetch(self, content_type, data=b'\x89PNG\r\n\x1a\n'):
+        # Each content type gets its own URL, bypassing the cache
+        response = MagicMock()
+        response.headers = {'Content-Type': content_type}
+        response.raw.read.return_value = data
+        get = MagicMock()
+        get.return_value.__enter__.return_value = response
+        with patch('requests.get', get):
+            return self._callFUT(f'https://idp.example/logo?{content_type}')
+
+    def test_fetched(self):
+        self.assertEqual(self._fetch('image/png'),
+                         ('image/png', b'\x89PNG\r\n\x1a\n'))
+        self.assertEqual(self._fetch('image/jpeg; charset=binary',
+                                     data=b'JPEG'),
+                         ('image/jpeg', b'JPEG'))
+
+    def test_fetched_not_raster(self):
+        for content_type in ('image/svg+xml', 'text/html', ''):
+            self.assertIsNone(self._fetch(content_type, data=b'<svg/>'))
+
+    def test_invalid(self):
+        from ..discovery import MAX_LOGO_SIZE
+
+        self.assertIsNone(self._callFUT('ftp://idp.example/logo.png'))
+        self.assertIsNone(self._callFUT('data:image/png;base64,!!!'))
+        self.assertIsNone(self._callFUT(
+            'data:image/png,' + 'x' * (MAX_LOGO_SIZE + 1)))
+
+    def test_cache(self):
+        from ..discovery import LOGOS
+
+        url = 'https://idp.example/logo.png'
+        with patch('Products.SAML2Plugins.discovery._fetchLogo',
+                   return_value=('image/png', b'PNG')) as fetch:
+            self.assertEqual(self._callFUT(url), ('image/png', b'PNG'))
+            self.assertEqual(self._callFUT(url), ('image/png', b'PNG'))
+        self.assertEqual(fetch.call_count, 1)
+
+        # Failures are cached as well, but not for as long
+        failing = 'https://idp.example/broken.png'
+        with patch('Products.SAML2Plugins.discovery._fetchLogo',
+                   side_effect=OSError) as fetch:
+            self.assertIsNone(self._callFUT(failing))
+            self.assertIsNone(self._callFUT(failing))
+        self.assertEqual(fetch.call_count, 1)
+        self.assertLess(LOGOS[failing][0], LOGOS[url][0])
+
+        # Expired entries are fetched again
+        LOGOS[url] = (0, LOGOS[url][1])
+        with patch('Products.SAML2Plugins.discovery._fetchLogo',
+                   return_value=('image/png', b'NEW')):
+            self.assertEqual(self._callFUT(url), ('image/png', b'NEW'))
+
+    def test_cache_size(self):
+        from ..discovery import LOGOS
+
+        with patch('Products.SAML2Plugins.discovery.MAX_LOGOS', 2):
+            for i in range(3):
+                self._callFUT(f'data:image/png,{i}')
+        self.assertEqual(list(LOGOS), ['data:image/png,1',
+                                       'data:image/png,2'])
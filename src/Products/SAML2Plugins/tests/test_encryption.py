@@ -0,0 +1,218 @@
+##############################################################################
+#
+# Copyright (c) 2023 Jens Vagelpohl and Contributors. All Rights Reserved.
+#
+# This software is subject to the provisions of the Zope Public License,
+# Version 2.1 (ZPL).  A copy of the ZPL should accompany this distribution.
+# THIS SOFTWARE IS PROVIDED "AS IS" AND ANY AND ALL EXPRESS OR IMPLIED
+# WARRANTIES ARE DISCLAIMED, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF TITLE, MERCHANTABILITY, AGAINST INFRINGEMENT, AND FITNESS
+# FOR A PARTICULAR PURPOSE.
+#
+##############################################################################
+""" Tests for decryption key selection
+"""
+
+import base64
+import hashlib
+import unittest
+
+from saml2.sigver import DecryptError
+from saml2.sigver import XmlsecError
+
+from cryptography import x509
+from cryptography.hazmat.primitives.serialization import Encoding
+
+from .base import TEST_CONFIG_FOLDER
+
+
+ENCRYPTED_DOC = """\
+<samlp:Response xmlns:samlp="urn:oasis:names:tc:SAML:2.0:protocol"
+                xmlns:saml="urn:oasis:names:tc:SAML:2.0:assertion">
+  <saml:EncryptedAssertion>
+    <xenc:EncryptedData xmlns:xenc="http://www.w3.org/2001/04/xmlenc#">
+      <ds:KeyInfo xmlns:ds="http://www.w3.org/2000/09/xmldsig#">
+        <xenc:EncryptedKey>
+          <ds:KeyInfo>%s</ds:KeyInfo>
+          <xenc:CipherData><xenc:CipherValue>abc=</xenc:CipherValue>
+          </xenc:CipherData>
+        </xenc:EncryptedKey>
+      </ds:KeyInfo>
+    </xenc:EncryptedData>
+  </saml:EncryptedAssertion>
+</samlp:Response>"""
+
+
+def _path(filename):
+    return f'{TEST_CONFIG_FOLDER}/{filename}'
+
+
+def _load_cert(filename):
+    with open(_path(filename), 'rb') as fp:
+        return x509.load_pem_x509_certificate(fp.read())
+
+
+def _b64(data):
+    return base64.b64encode(data).decode('ascii')
+
+
+class DummyCrypto:
+
+    def __init__(self, good_key):
+        self.good_key = good_key
+        self.tried = []
+
+    def decrypt(self, enctext, key_file):
+        self.tried.append(key_file)
+        if key_file != self.good_key:
+            raise XmlsecError('Bad key')
+        return 'decrypted'
+
+
+class DummySecurityContext:
+
+    def __init__(self, crypto, keypairs):
+        self.crypto = crypto
+        self.encryption_keypairs = keypairs
+        self.enc_key_files = [kp['key_file'] for kp in keypairs]
+
+    def decrypt(self, enctext, key_file=None):
+        from ..encryption import decrypt_with_key_hints
+        return decrypt_with_key_hints(self, enctext, key_file=key_file)
+
+
+class EncryptionKeyIndexTests(unittest.TestCase):
+
+    def setUp(self):
+        from ..encryption import clearEncryptionKeyIndexes
+        clearEncryptionKeyIndexes()
+        self.keypairs = [
+            {'key_file': _path('saml2plugintest.key'),
+             'cert_file': _path('saml2plugintest.pem')},
+            {'key_file': _path('saml2plugintest_enc.key'),
+             'cert_file': _path('saml2plugintest_enc.pem')}]
+        self.cert = _load_cert('saml2plugintest_enc.pem')
+
+    def _makeOne(self, keypairs=None):
+        from ..encryption import EncryptionKeyIndex
+        return EncryptionKeyIndex(keypairs or self.keypairs)
+
+    def _doc(self, key_info):
+        return ENCRYPTED_DOC % key_info
+
+    def test_select_certificate(self):
+        index = self._makeOne()
+        der = self.cert.public_bytes(Encoding.DER)
+        key_info = ('<ds:X509Data><ds:X509Certificate>'
+                    f'{_b64(der)}</ds:X509Certificate></ds:X509Data>')
+        self.assertEqual(index.select(self._doc(key_info)),
+                         [_path('saml2plugintest_enc.key')])
+
+    def test_select_ski(self):
+        index = self._makeOne()
+        ski = x509.SubjectKeyIdentifier.from_public_key(
+            self.cert.public_key()).digest
+        key_info = ('<ds:X509Data><ds:X509SKI>'
+                    f'{_b64(ski)}</ds:X509SKI></ds:X509Data>')
+        self.assertEqual(index.select(self._doc(key_info)),
+                         [_path('saml2plugintest_enc.key')])
+
+    def test_select_digest(self):
+        index = self._makeOne()
+        der = self.cert.public_bytes(Encoding.DER)
+        key_info = (
+            '<ds:X509Data xmlns:dsig11="http://www.w3.org/2009/xmldsig11#">'
+            '<dsig11:X509Digest '
+            'Algorithm="http://www.w3.org/2001/04/xmlenc#sha256">'
+            f'{_b64(hashlib.sha256(der).digest())}</dsig11:X509Digest>'
+            '</ds:X509Data>')
+        self.assertEqual(index.select(self._doc(key_info)),
+                         [_path('saml2plugintest_enc.key')])
+
+    def test_select_modulus(self):
+        index = self._makeOne()
+        modulus = self.cert.public_key().public_numbers().n
+        modulus = modulus.to_bytes((modulus.bit_length() + 7) // 8, 'big')
+        key_info = ('<ds:KeyValue><ds:RSAKeyValue><ds:Modulus>'
+                    f'{_b64(modulus)}</ds:Modulus><ds:Exponent>AQAB'
+                    '</ds:Exponent></ds:RSAKeyValue></ds:KeyValue>')
+        self.assertEqual(index.select(self._doc(key_info)),
+                         [_path('saml2plugintest_enc.key')])
+
+    def test_select_serial(self):
+        index = self._makeOne()
+        key_info = ('<ds:X509Data><ds:X509IssuerSerial><ds:X509IssuerName>'
+                    'CN=foo</ds:X509IssuerName><ds:X509SerialNumber>'
+                    f'{self.cert.serial_number}</ds:X509SerialNumber>'
+                    '</ds:X509IssuerSerial></ds:X509Data>')
+        self.assertEqual(index.select(self._doc(key_info)),
+                         [_path('saml2plugintest_enc.key')])
+
+    def test_select_no_hint(self):
+        index = self._makeOne()
+
+        # No KeyInfo content
+        self.assertEqual(index.select(self._doc('')), [])
+
+        # Unknown certificate
+        key_info = ('<ds:X509Data><ds:X509Certificate>'
+                    f'{_b64(b"foo")}</ds:X509Certificate></ds:X509Data>')
+        self.assertEqual(index.select(self._doc(key_info)), [])
+
+        # Garbage data
+        key_info = ('<ds:X509Data><ds:X509SKI>!!!</ds:X509SKI>'
+                    '<ds:X509SerialNumber>x</ds:X509SerialNumber>'
+                    '</ds:X509Data>')
+        self.assertEqual(index.select(self._doc(key_info)), [])
+        self.assertEqual(index.select('<not xml'), [])
+
+    def test_bad_certificate_file(self):
+        keypairs = [{'key_file': _path('saml2plugintest.key'),
+                     'cert_file': _path('non_existing.pem')},
+                    {'cert_file': _path('saml2plugintest.pem')}]
+        index = self._makeOne(keypairs)
+        self.assertEqual(len(index), 0)
+        self.assertEqual(index.key_files, [_path('saml2plugintest.key')])
+
+    def test_getEncryptionKeyIndex(self):
+        from ..encryption import getEncryptionKeyIndex
+        index = getEncryptionKeyIndex(self.keypairs)
+        self.assertTrue(len(index))
+        self.assertIs(index, getEncryptionKeyIndex(list(self.keypairs)))
+        self.assertIsNot(index, getEncryptionKeyIndex(self.keypairs[:1]))
+
+    def test_decrypt_with_key_hints(self):
+        good_key = _path('saml2plugintest_enc.key')
+        der = self.cert.public_bytes(Encoding.DER)
+        hinted_doc = self._doc('<ds:X509Data><ds:X509Certificate>'
+                               f'{_b64(der)}</ds:X509Certificate>'
+                               '</ds:X509Data>')
+
+        # With a key hint only the correct key is tried
+        crypto = DummyCrypto(good_key)
+        sec = DummySecurityContext(crypto, self.keypairs)
+        self.assertEqual(sec.decrypt(hinted_doc), 'decrypted')
+        self.assertEqual(crypto.tried, [good_key])
+
+        # Without a hint all keys are tried in turn
+        crypto = DummyCrypto(good_key)
+        sec = DummySecurityContext(crypto, self.keypairs)
+        self.assertEqual(sec.decrypt(self._doc('')), 'decrypted')
+        self.assertEqual(crypto.tried,
+                         [_path('saml2plugintest.key'), good_key])
+
+        # No key works
+        crypto = DummyCrypto('unknown')
+        sec = DummySecurityContext(crypto, self.keypairs)
+        with self.assertRaises(DecryptError):
+            sec.decrypt(hinted_doc)
+        self.assertEqual(crypto.tried,
+                         [good_key, _path('saml2plugintest.key')])
+
+    def test_monkeypatch(self):
+        from saml2.sigver import SecurityContext
+
+        from ..encryption import decrypt_with_key_hints
+        from ..monkeypatch import applyPatches
+        applyPatches()
+        self.assertIs(SecurityContext.decrypt, decrypt_with_key_hints)
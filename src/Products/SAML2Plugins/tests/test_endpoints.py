@@ -0,0 +1,158 @@
+##############################################################################
+#
+# Copyright (c) 2023 Jens Vagelpohl and Contributors. All Rights Reserved.
+#
+# This software is subject to the provisions of the Zope Public License,
+# Version 2.1 (ZPL).  A copy of the ZPL should accompany this distribution.
+# THIS SOFTWARE IS PROVIDED "AS IS" AND ANY AND ALL EXPRESS OR IMPLIED
+# WARRANTIES ARE DISCLAIMED, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF TITLE, MERCHANTABILITY, AGAINST INFRINGEMENT, AND FITNESS
+# FOR A PARTICULAR PURPOSE.
+#
+##############################################################################
+""" Tests for the metadata service endpoint index
+"""
+
+from saml2 import BINDING_HTTP_ARTIFACT
+from saml2 import BINDING_HTTP_POST
+from saml2 import BINDING_HTTP_REDIRECT
+from saml2 import BINDING_SOAP
+from saml2.s_utils import UnknownSystemEntity
+from saml2.s_utils import UnsupportedBinding
+
+from .base import PluginTestCase
+
+
+class EndpointIndexTests(PluginTestCase):
+
+    def _getTargetClass(self):
+        from ..SAML2Plugin import SAML2Plugin
+        return SAML2Plugin
+
+    def _makeOne(self):
+        plugin = super()._makeOne('test')
+        self._create_valid_configuration(plugin)
+        return plugin
+
+    def _getMetadata(self, plugin):
+        return plugin.getPySAML2Configuration().metadata
+
+    def test_index_matches_metadata(self):
+        from ..endpoints import SERVICES
+
+        plugin = self._makeOne()
+        metadata = self._getMetadata(plugin)
+        index = plugin.getEndpointIndex()
+
+        for entity_id in metadata.keys():
+            for typ, services in SERVICES.items():
+                for service in services:
+                    for binding in (BINDING_HTTP_POST,
+                                    BINDING_HTTP_REDIRECT,
+                                    BINDING_HTTP_ARTIFACT,
+                                    BINDING_SOAP):
+                        try:
+                            expected = metadata.service(
+                                entity_id, f'{typ}_descriptor', service,
+                                binding) or ()
+                        except (UnknownSystemEntity, UnsupportedBinding):
+                            expected = ()
+                        locations = [x['location'] for x in expected]
+                        self.assertEqual(
+                            index.location(entity_id, service, binding, typ),
+                            locations[0] if locations else None)
+                        self.assertEqual(
+                            index.supports(entity_id, service, (binding,),
+                                           typ),
+                            bool(locations))
+
+    def test_supports(self):
+        plugin = self._makeOne()
+        index = plugin.getEndpointIndex()
+        idp = 'https://saml.example.com/entityid'
+        self.assertIn(idp, self._getMetadata(plugin).keys())
+
+        self.assertTrue(index.supports(
+            idp, 'single_sign_on_service', (BINDING_HTTP_REDIRECT,)))
+        self.assertTrue(index.supports(
+            idp, 'single_sign_on_service', (BINDING_SOAP, BINDING_HTTP_POST)))
+        self.assertFalse(index.supports(
+            idp, 'single_sign_on_service', (BINDING_SOAP,)))
+        self.assertFalse(index.supports(idp, 'single_sign_on_service', ()))
+
+        # The test identity provider has no single logout service
+        self.assertFalse(index.supports(
+            idp, 'single_logout_service',
+            (BINDING_HTTP_POST, BINDING_HTTP_REDIRECT)))
+        self.assertFalse(index.supports(
+            'https://unknown', 'single_sign_on_service',
+            (BINDING_HTTP_POST, BINDING_HTTP_REDIRECT)))
+
+        # Without entity ID any entity will do
+        self.assertTrue(index.supports(
+            None, 'single_sign_on_service', (BINDING_HTTP_POST,)))
+        self.assertFalse(index.supports(
+            None, 'single_logout_service', (BINDING_HTTP_POST,)))
+
+        self.assertEqual(index.bindings(idp, 'single_sign_on_service'),
+                         (BINDING_HTTP_REDIRECT, BINDING_HTTP_POST))
+        self.assertEqual(index.endpoints(idp, 'single_sign_on_service'),
+                         ((BINDING_HTTP_REDIRECT,
+                           'https://mocksaml.com/api/saml/sso'),
+                          (BINDING_HTTP_POST,
+                           'https://mocksaml.com/api/saml/sso')))
+        self.assertEqual(index.bindings(idp, 'assertion_consumer_service'),
+                         ())
+        self.assertEqual(index.endpoints('https://unknown',
+                                         'single_sign_on_service'), ())
+
+    def test_ssoDestination(self):
+        from ..configuration import clearConfigurationCaches
+
+        plugin = self._makeOne()
+        index = plugin.getEndpointIndex()
+        idp = 'https://saml.example.com/entityid'
+        sso = (BINDING_HTTP_REDIRECT, 'https://mocksaml.com/api/saml/sso')
+
+        # HTTP-Redirect is preferred
+        self.assertEqual(index.ssoDestination(idp), sso)
+        # The only identity provider is the default
+        self.assertEqual(index.ssoDestination(), sso)
+        self.assertIsNone(index.ssoDestination('https://unknown'))
+
+        # HTTP-POST only
+        plugin._configuration['metadata']['local'] = [
+            self._test_path('mocksaml_metadata_binding_post.xml')]
+        clearConfigurationCaches()
+        plugin._v_saml2client = None
+        index = plugin.getEndpointIndex()
+        self.assertEqual(index.ssoDestination(idp)[0], BINDING_HTTP_POST)
+
+        # No default with more than one identity provider
+        plugin._configuration['metadata']['local'].append(
+            self._test_path('discovery_metadata.xml'))
+        clearConfigurationCaches()
+        plugin._v_saml2client = None
+        index = plugin.getEndpointIndex()
+        self.assertIsNone(index.ssoDestination())
+        self.assertEqual(index.ssoDestination(idp)[0], BINDING_HTTP_POST)
+
+    def test_getEndpointIndex(self):
+        from ..configuration import clearConfigurationCaches
+        from ..endpoints import getEndpointIndex
+
+        plugin = self._makeOne()
+        index = plugin.getEndpointIndex()
+
+        # The index is built once for the loaded metadata
+        self.assertIs(plugin.getEndpointIndex(), index)
+
+        # Loading the configuration again builds a new index
+        clearConfigurationCaches()
+        plugin._v_saml2client = None
+        self.assertIsNot(plugin.getEndpointIndex(), index)
+
+        # Without metadata the index is empty
+        empty = getEndpointIndex('other', None)
+        self.assertFalse(empty.supports(None, 'single_sign_on_service',
+                                        (BINDING_HTTP_REDIRECT,)))
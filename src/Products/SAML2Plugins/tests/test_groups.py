@@ -0,0 +1,109 @@
+##############################################################################
+#
+# Copyright (c) 2023 Jens Vagelpohl and Contributors. All Rights Reserved.
+#
+# This software is subject to the provisions of the Zope Public License,
+# Version 2.1 (ZPL).  A copy of the ZPL should accompany this distribution.
+# THIS SOFTWARE IS PROVIDED "AS IS" AND ANY AND ALL EXPRESS OR IMPLIED
+# WARRANTIES ARE DISCLAIMED, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF TITLE, MERCHANTABILITY, AGAINST INFRINGEMENT, AND FITNESS
+# FOR A PARTICULAR PURPOSE.
+#
+##############################################################################
+""" Tests for groups taken from a group membership attribute
+"""
+
+from unittest.mock import MagicMock
+
+from .base import PluginTestCase
+from .dummy import DummyNameId
+from .dummy import DummyPySAML2Client
+from .dummy import DummyRequest
+from .dummy import DummySAMLResponse
+from .dummy import DummyUser
+
+
+class GroupsTests(PluginTestCase):
+
+    def _getTargetClass(self):
+        from ..PluginBase import SAML2PluginBase
+        return SAML2PluginBase
+
+    def _login(self, plugin, uid, groups):
+        identity = {'uid': [uid], 'isMemberOf': groups}
+        saml_response = DummySAMLResponse(subject=DummyNameId(uid),
+                                          issuer='https://idp',
+                                          identity=identity)
+        dummy_client = DummyPySAML2Client(parse_result=saml_response)
+        plugin.getPySAML2Client = MagicMock(return_value=dummy_client)
+        return plugin.handleACSRequest(saml_response)
+
+    def _makePlugin(self):
+        plugin = self._makeOne('test')
+        self._create_valid_configuration(plugin)
+        plugin.login_attribute = 'uid'
+        plugin.attribute_rules = ('keep uid',)
+        return plugin
+
+    def test_no_group_attribute(self):
+        plugin = self._makePlugin()
+        user_info = self._login(plugin, 'jdoe', ['staff'])
+        self.assertNotIn('_groups', user_info)
+        self.assertIsNone(plugin._known_groups)
+        self.assertEqual(plugin.enumerateGroups(), ())
+
+    def test_getGroupsForPrincipal(self):
+        plugin = self._makePlugin()
+        plugin.group_attribute = 'isMemberOf'
+        user_info = self._login(plugin, 'jdoe', ['staff', 'admins', 'staff'])
+        self.assertEqual(user_info['_groups'], ('admins', 'staff'))
+
+        req = DummyRequest()
+        user = DummyUser('jdoe')
+        self.assertEqual(plugin.getGroupsForPrincipal(user, req), ())
+
+        plugin.setSessionInfo(req, user_info)
+        self.assertEqual(plugin.getGroupsForPrincipal(user, req),
+                         ('admins', 'staff'))
+        self.assertIs(plugin.getGroupsForPrincipal(user, req),
+                      user_info.groups)
+        self.assertEqual(plugin.getGroupsForPrincipal(DummyUser('x'), req),
+                         ())
+        self.assertEqual(plugin.getGroupsForPrincipal(user), ())
+
+        # Group tuples are shared between users
+        other_info = self._login(plugin, 'jane', ['admins', 'staff'])
+        self.assertIs(other_info.groups, user_info.groups)
+
+    def test_enumerateGroups(self):
+        plugin = self._makePlugin()
+        plugin.group_attribute = 'isMemberOf'
+        self._login(plugin, 'jdoe', ['staff', 'admins'])
+        self._login(plugin, 'jane', ['staff', 'students'])
+
+        def ids(*args, **kw):
+            return [info['id'] for info in plugin.enumerateGroups(*args, **kw)]
+
+        self.assertEqual(ids(), ['admins', 'staff', 'students'])
+        self.assertEqual(ids(id='st'), ['staff', 'students'])
+        self.assertEqual(ids(id='st', exact_match=True), [])
+        self.assertEqual(ids(id=['staff', 'x'], exact_match=True), ['staff'])
+        self.assertEqual(ids(id=['adm', 'stu']), ['admins', 'students'])
+        self.assertEqual(ids(max_results=1), ['admins'])
+        self.assertEqual(plugin.enumerateGroups(id='admins'),
+                         ({'id': 'admins', 'title': 'admins',
+                           'pluginid': 'test'},))
+
+    def test_registerGroups(self):
+        plugin = self._makePlugin()
+        plugin.registerGroups(['a', 'b'])
+        self.assertEqual(list(plugin._known_groups), ['a', 'b'])
+
+        known = plugin._known_groups = MagicMock()
+        known.__contains__.side_effect = lambda group_id: group_id in 'ab'
+
+        # Known groups are not written again
+        plugin.registerGroups(['b', 'a'])
+        known.update.assert_not_called()
+        plugin.registerGroups(['a', 'c'])
+        known.update.assert_called_once_with(['c'])
@@ -0,0 +1,72 @@
+##############################################################################
+#
+# Copyright (c) 2023 Jens Vagelpohl and Contributors. All Rights Reserved.
+#
+# This software is subject to the provisions of the Zope Public License,
+# Version 2.1 (ZPL).  A copy of the ZPL should accompany this distribution.
+# THIS SOFTWARE IS PROVIDED "AS IS" AND ANY AND ALL EXPRESS OR IMPLIED
+# WARRANTIES ARE DISCLAIMED, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF TITLE, MERCHANTABILITY, AGAINST INFRINGEMENT, AND FITNESS
+# FOR A PARTICULAR PURPOSE.
+#
+##############################################################################
+""" Import time benchmark for the package
+"""
+
+import subprocess
+import sys
+import unittest
+
+
+# Modules that take most of the pysaml2 import time. They must only be
+# loaded when pysaml2 is actually used.
+HEAVY_MODULES = ('saml2.client',
+                 'saml2.config',
+                 'saml2.metadata',
+                 'saml2.sigver',
+                 'saml2.xml.schema',
+                 'xmlschema')
+
+
+def _importtime(statement):
+    """ Run ``statement`` with ``python -X importtime``
+
+    Returns:
+        A mapping of module names to cumulative import times in microseconds
+    """
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c',
+                             statement],
+                            capture_output=True, text=True, check=True)
+    timings = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        timings[name.strip()] = int(cumulative)
+    return timings
+
+
+class ImportTimeTests(unittest.TestCase):
+
+    def test_no_pysaml2_machinery_on_import(self):
+        timings = _importtime('import Products.SAML2Plugins')
+        self.assertIn('Products.SAML2Plugins', timings)
+        for module_name in HEAVY_MODULES:
+            self.assertNotIn(module_name, timings)
+
+        # The package itself adds little to what the PluggableAuthService
+        # needs anyway. Compare against the pysaml2 client import, which
+        # is several times more expensive.
+        own_time = timings['Products.SAML2Plugins'] - timings.get(
+            'Products.PluggableAuthService.PluggableAuthService', 0)
+        client_time = _importtime('import saml2.client')['saml2.client']
+        self.assertLess(own_time, client_time / 2)
+
+    def test_patches_applied_on_first_use(self):
+        timings = _importtime(
+            'import Products.SAML2Plugins.monkeypatch as m; '
+            'assert not m.PATCHES_APPLIED; '
+            'm.applyPatches(); '
+            'from saml2 import xmldsig; '
+            'assert xmldsig.SIG_SHA256_RSA_MGF1')
+        self.assertIn('saml2.sigver', timings)
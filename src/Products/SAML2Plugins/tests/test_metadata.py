@@ -13,8 +13,188 @@
 """ Tests for SAML 2.0 metadata generation
 """
 
+import threading
+import unittest
+from unittest.mock import patch
+
 from .base import TEST_CONFIG_FOLDER
 from .base import PluginTestCase
+from .dummy import DummyRequest
+
+
+class MetadataDocumentTests(unittest.TestCase):
+
+    def _makeOne(self, xml='<?xml version="1.0" ?>\n<a>\u00e4</a>\n',
+                 valid_for=None):
+        from ..metadata import MetadataDocument
+        return MetadataDocument(xml, valid_for)
+
+    def test_validators(self):
+        with patch('time.time', return_value=1700000000.5):
+            document = self._makeOne()
+        self.assertEqual(document.data,
+                         b'<?xml version="1.0" ?>\n<a>\xc3\xa4</a>\n')
+        self.assertEqual(len(document.etag), 34)
+        self.assertEqual(document.etag, self._makeOne().etag)
+        self.assertNotEqual(document.etag, self._makeOne('<b/>').etag)
+        self.assertEqual(document.last_modified,
+                         'Tue, 14 Nov 2023 22:13:20 GMT')
+
+    def test_expiration(self):
+        document = self._makeOne()
+        self.assertFalse(document.isExpired(now=document.generated + 1e9))
+        self.assertEqual(document.maxAge(3600), 3600)
+        self.assertEqual(document.maxAge(-5), 0)
+
+        # Half of 24 hours
+        document = self._makeOne(valid_for=24)
+        now = document.generated
+        self.assertFalse(document.isExpired(now=now + 43199))
+        self.assertTrue(document.isExpired(now=now + 43200))
+        self.assertEqual(document.maxAge(3600, now=now), 3600)
+        self.assertEqual(document.maxAge(3600, now=now + 42000), 1200)
+        self.assertEqual(document.maxAge(3600, now=now + 50000), 0)
+
+    def test_isNotModified(self):
+        document = self._makeOne()
+        self.assertFalse(document.isNotModified())
+        self.assertTrue(document.isNotModified(document.etag))
+        self.assertTrue(document.isNotModified(f'"x",W/{document.etag}'))
+        self.assertTrue(document.isNotModified('*'))
+        self.assertFalse(document.isNotModified('"x"'))
+        self.assertFalse(document.isNotModified(document.etag[1:-1]))
+
+        self.assertTrue(document.isNotModified(
+            if_modified_since=document.last_modified))
+        self.assertTrue(document.isNotModified(
+            if_modified_since='Fri, 01 Jan 2100 00:00:00 -0000'))
+        self.assertFalse(document.isNotModified(
+            if_modified_since='Sat, 01 Jan 2000 00:00:00 GMT'))
+        self.assertFalse(document.isNotModified(if_modified_since='foo'))
+
+
+class ManualTimer:
+    """ Timer stand-in, runs its function only when fired by the test """
+
+    def __init__(self, scheduled, delay, function):
+        self.delay = delay
+        self.function = function
+        self.cancelled = False
+        self.started = False
+        scheduled.append(self)
+
+    def start(self):
+        self.started = True
+
+    def cancel(self):
+        self.cancelled = True
+
+    def fire(self):
+        assert self.started and not self.cancelled
+        self.function()
+
+
+class MetadataSignerTests(unittest.TestCase):
+
+    def setUp(self):
+        self.rendered = []
+        self.scheduled = []
+        self.signers = []
+
+    def tearDown(self):
+        for signer in self.signers:
+            signer.cancel()
+
+    def _makeOne(self, render=None, valid_for=None):
+        from ..metadata import MetadataSigner
+        signer = MetadataSigner(render or self._render, valid_for,
+                                timer=self._timer)
+        self.signers.append(signer)
+        return signer
+
+    def _timer(self, delay, function):
+        return ManualTimer(self.scheduled, delay, function)
+
+    def _render(self):
+        self.rendered.append(threading.current_thread())
+        return f'<a n="{len(self.rendered)}"/>'
+
+    def test_worker_thread(self):
+        from ..metadata import MetadataSigner
+
+        signer = MetadataSigner(self._render)
+        self.signers.append(signer)
+        signer._timer.join()
+        self.assertEqual(signer.getDocument().data, b'<a n="1"/>')
+        self.assertIsNot(self.rendered[0], threading.current_thread())
+
+    def test_getDocument(self):
+        signer = self._makeOne()
+
+        # The first signature is not ready yet
+        self.assertEqual([timer.delay for timer in self.scheduled], [0])
+        self.assertIsNone(signer.getDocument())
+
+        self.scheduled[0].fire()
+        document = signer.getDocument()
+        self.assertEqual(document.data, b'<a n="1"/>')
+
+        # Without a validity period the document is signed only once
+        self.assertIs(signer.getDocument(), document)
+        self.assertEqual(len(self.scheduled), 1)
+        self.assertFalse(signer.isExpired())
+
+    def test_resigning(self):
+        signer = self._makeOne(valid_for=1)
+        self.scheduled[0].fire()
+        first = signer.getDocument()
+
+        # Signed again after half of the validity period, until then the
+        # first document is served
+        self.assertAlmostEqual(self.scheduled[1].delay, 1800, delta=2)
+        self.assertIs(signer.getDocument(), first)
+        self.scheduled[1].fire()
+        self.assertIsNot(signer.getDocument(), first)
+        self.assertEqual(len(self.rendered), 2)
+
+        # Cancelling stops the pending and all future runs
+        signer.cancel()
+        self.assertTrue(self.scheduled[2].cancelled)
+        signer._schedule(0)
+        self.assertEqual(len(self.scheduled), 3)
+
+    def test_errors(self):
+        from ..metadata import SIGNING_RETRY_INTERVAL
+
+        results = [ValueError('broken'), '<a/>', ValueError('broken')]
+
+        def render():
+            result = results.pop(0)
+            if isinstance(result, Exception):
+                raise result
+            return result
+
+        signer = self._makeOne(render, valid_for=1)
+        with self.assertLogs('Products.SAML2Plugins', level='ERROR'):
+            self.scheduled[0].fire()
+
+        # Without document the view answers with 503, only the message
+        # of the error is kept
+        self.assertIsNone(signer.getDocument())
+        self.assertEqual(signer.error, 'broken')
+        self.assertEqual(self.scheduled[1].delay, SIGNING_RETRY_INTERVAL)
+
+        self.scheduled[1].fire()
+        document = signer.getDocument()
+        self.assertEqual(document.data, b'<a/>')
+        self.assertIsNone(signer.error)
+
+        # After another error the last document is still served
+        with self.assertLogs('Products.SAML2Plugins', level='ERROR'):
+            self.scheduled[2].fire()
+        self.assertIs(signer.getDocument(), document)
+        self.assertEqual(signer.error, 'broken')
+        self.assertEqual(self.scheduled[3].delay, SIGNING_RETRY_INTERVAL)
 
 
 class SAML2MetadataTests(PluginTestCase):
@@ -73,3 +253,123 @@ class SAML2MetadataTests(PluginTestCase):
         plugin.metadata_envelope = False
         xml_string = plugin.getMetadataZMIRepresentation()
         self.assertIn('<ns0:EntityDescriptor', xml_string)
+
+    def test_getMetadataDocument(self):
+        from ..configuration import clearConfigurationCaches
+
+        plugin = self._makeOne('test1')
+        self._create_valid_configuration(plugin)
+
+        document = plugin.getMetadataDocument()
+        self.assertTrue(document.data.startswith(
+                        b'<?xml version="1.0" ?>\n<ns0:EntityDescriptor'))
+        with patch.object(plugin, 'generateMetadata',
+                          side_effect=AssertionError):
+            self.assertIs(plugin.getMetadataDocument(), document)
+
+        # Changed settings render the metadata again
+        plugin.metadata_envelope = True
+        enveloped = plugin.getMetadataDocument()
+        self.assertIn(b'<ns0:EntitiesDescriptor', enveloped.data)
+        self.assertNotEqual(enveloped.etag, document.etag)
+
+        # So does a configuration reload
+        clearConfigurationCaches()
+        self.assertIsNot(plugin.getMetadataDocument(), enveloped)
+
+        # And the expiration of a document
+        plugin.getConfiguration()['valid_for'] = 1
+        clearConfigurationCaches()
+        document = plugin.getMetadataDocument()
+        self.assertIn(b' validUntil=', document.data)
+        with patch('time.time', return_value=document.generated + 1800):
+            self.assertIsNot(plugin.getMetadataDocument(), document)
+
+    def _signer(self, plugin):
+        from ..metadata import METADATA_DOCUMENTS
+        return METADATA_DOCUMENTS[plugin._uid][2]
+
+    def test_getMetadataDocument_signed(self):
+        from ..metadata import renderMetadata
+
+        plugin = self._makeOne('test1')
+        self._create_valid_configuration(plugin)
+        plugin.metadata_sign = True
+        threads = []
+        release = threading.Event()
+
+        def render(*args, **kw):
+            threads.append(threading.current_thread())
+            release.wait(5)
+            return renderMetadata(*args, **kw)
+
+        with patch('Products.SAML2Plugins.metadata.renderMetadata',
+                   side_effect=render):
+            # The request does not wait for the signature
+            self.assertIsNone(plugin.getMetadataDocument())
+            release.set()
+            self._signer(plugin)._timer.join(5)
+            document = plugin.getMetadataDocument()
+            self.assertIs(plugin.getMetadataDocument(), document)
+
+        self.assertIn(b'<ns1:SignatureValue>', document.data)
+        self.assertEqual(len(threads), 1)
+        self.assertIsNot(threads[0], threading.current_thread())
+
+        # Switching signing off replaces the signed document
+        plugin.metadata_sign = False
+        self.assertNotIn(b'<ns1:SignatureValue>',
+                         plugin.getMetadataDocument().data)
+
+    def test_getMetadataDocument_signed_invalid_configuration(self):
+        plugin = self._makeOne('test1')
+        self._create_valid_configuration(plugin)
+        plugin.metadata_sign = True
+        with patch.object(plugin, 'getPySAML2Configuration',
+                          return_value=None):
+            with patch.object(plugin, 'generateMetadata') as generate:
+                with self.assertLogs('Products.SAML2Plugins', 'WARNING'):
+                    self.assertIsNone(plugin.getMetadataDocument())
+        generate.assert_not_called()
+
+    def test_signing_cancelled(self):
+        from ..metadata import METADATA_DOCUMENTS
+        from ..metadata import stopMetadataSigning
+
+        plugin = self._makeOne('test1')
+        self._create_valid_configuration(plugin)
+        plugin.metadata_sign = True
+        signers = []
+        self.addCleanup(lambda: [signer._timer.join(5)
+                                 for signer in signers])
+
+        # Changing metadata settings stops signing
+        plugin.getMetadataDocument()
+        signer = self._signer(plugin)
+        signers.append(signer)
+        plugin._updateProperty('metadata_envelope', True)
+        self.assertTrue(signer._cancelled)
+        self.assertNotIn(plugin._uid, METADATA_DOCUMENTS)
+
+        # So does reloading the configuration
+        plugin.getMetadataDocument()
+        signer = self._signer(plugin)
+        signers.append(signer)
+        plugin.manage_reloadConfiguration(DummyRequest())
+        self.assertTrue(signer._cancelled)
+
+        # And removing the plugin
+        plugin.getMetadataDocument()
+        signer = self._signer(plugin)
+        signers.append(signer)
+        stopMetadataSigning(plugin, None)
+        self.assertTrue(signer._cancelled)
+        self.assertNotIn(plugin._uid, METADATA_DOCUMENTS)
+
+        # Other settings don't
+        plugin.getMetadataDocument()
+        signer = self._signer(plugin)
+        signers.append(signer)
+        plugin._updateProperty('title', 'New title')
+        self.assertFalse(signer._cancelled)
+        signer.cancel()
@@ -0,0 +1,98 @@
+##############################################################################
+#
+# Copyright (c) 2023 Jens Vagelpohl and Contributors. All Rights Reserved.
+#
+# This software is subject to the provisions of the Zope Public License,
+# Version 2.1 (ZPL).  A copy of the ZPL should accompany this distribution.
+# THIS SOFTWARE IS PROVIDED "AS IS" AND ANY AND ALL EXPRESS OR IMPLIED
+# WARRANTIES ARE DISCLAIMED, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF TITLE, MERCHANTABILITY, AGAINST INFRINGEMENT, AND FITNESS
+# FOR A PARTICULAR PURPOSE.
+#
+##############################################################################
+""" Tests for the run-time monkey patches
+"""
+
+import unittest
+
+
+METADATA = """\
+<md:EntityDescriptor xmlns:md="urn:oasis:names:tc:SAML:2.0:metadata"
+                     entityID="https://sp.example.com">
+  <md:SPSSODescriptor
+      protocolSupportEnumeration="urn:oasis:names:tc:SAML:2.0:protocol">
+    <md:AssertionConsumerService Location="https://sp.example.com/acs"
+        Binding="urn:oasis:names:tc:SAML:2.0:bindings:HTTP-POST" index="1"/>
+  </md:SPSSODescriptor>
+</md:EntityDescriptor>"""
+
+
+class DummyValidator:
+
+    def __init__(self):
+        self.added = []
+        self.validated = []
+        self.name = 'dummy'
+
+    def add_schema(self, source, build=False):
+        self.added.append((source.url, build))
+
+    def validate(self, doc):
+        self.validated.append(doc)
+
+
+class LazySchemaValidatorTests(unittest.TestCase):
+
+    def _makeOne(self, validator, schema_files=('xenc-schema-11.xsd',)):
+        from ..monkeypatch import LazySchemaValidator
+        return LazySchemaValidator(validator, schema_files)
+
+    def test_build_on_first_use(self):
+        validator = DummyValidator()
+        lazy = self._makeOne(validator)
+        self.assertEqual(validator.added, [])
+
+        lazy.validate('<doc/>')
+        self.assertEqual(validator.validated, ['<doc/>'])
+        self.assertEqual(len(validator.added), 1)
+        url, build = validator.added[0]
+        self.assertTrue(url.endswith('/data/xenc-schema-11.xsd'))
+        self.assertTrue(build)
+
+        # Schemata are only added once
+        lazy.validate('<doc/>')
+        self.assertIs(lazy.getValidator(), validator)
+        self.assertEqual(len(validator.added), 1)
+
+    def test_attribute_access(self):
+        validator = DummyValidator()
+        lazy = self._makeOne(validator)
+        self.assertEqual(lazy.name, 'dummy')
+        self.assertEqual(len(validator.added), 1)
+
+    def test_monkeypatch(self):
+        from saml2.xml import schema
+
+        from ..monkeypatch import LazySchemaValidator
+        from ..monkeypatch import applyPatches
+        from ..monkeypatch import pysaml_add_xml_schemata
+        applyPatches()
+        lazy = schema._schema_validator_default
+        self.assertIsInstance(lazy, LazySchemaValidator)
+
+        # Applying the patch again does not wrap the validator twice
+        pysaml_add_xml_schemata()
+        self.assertIs(schema._schema_validator_default, lazy)
+
+        schema.validate(METADATA)
+        self.assertIn('http://www.w3.org/2009/xmlenc11#',
+                      lazy.getValidator().maps.namespaces)
+
+    def test_applyPatches_idempotent(self):
+        from saml2 import xmldsig
+
+        from ..monkeypatch import applyPatches
+        applyPatches()
+        allowed = xmldsig.SIG_ALLOWED_ALG
+        applyPatches()
+        self.assertIs(xmldsig.SIG_ALLOWED_ALG, allowed)
@@ -0,0 +1,187 @@
+##############################################################################
+#
+# Copyright (c) 2023 Jens Vagelpohl and Contributors. All Rights Reserved.
+#
+# This software is subject to the provisions of the Zope Public License,
+# Version 2.1 (ZPL).  A copy of the ZPL should accompany this distribution.
+# THIS SOFTWARE IS PROVIDED "AS IS" AND ANY AND ALL EXPRESS OR IMPLIED
+# WARRANTIES ARE DISCLAIMED, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF TITLE, MERCHANTABILITY, AGAINST INFRINGEMENT, AND FITNESS
+# FOR A PARTICULAR PURPOSE.
+#
+##############################################################################
+""" Tests for attribute projection rules
+"""
+
+import unittest
+from unittest.mock import MagicMock
+from unittest.mock import patch
+
+from saml2 import saml
+from saml2.attribute_converter import ac_factory
+from saml2.attribute_converter import list_to_local
+
+from .base import PluginTestCase
+from .dummy import DummyNameId
+from .dummy import DummyPySAML2Client
+from .dummy import DummySAMLResponse
+
+
+NAME_FORMAT_URI = 'urn:oasis:names:tc:SAML:2.0:attrname-format:uri'
+OID_MAIL = 'urn:oid:0.9.2342.19200300.100.1.3'
+OID_CN = 'urn:oid:2.5.4.3'
+OID_PHOTO = 'urn:oid:0.9.2342.19200300.100.1.60'
+
+
+def _attribute(name, *values):
+    return saml.Attribute(
+        name=name,
+        name_format=NAME_FORMAT_URI,
+        attribute_value=[saml.AttributeValue(text=val) for val in values])
+
+
+class AttributeProjectionTests(unittest.TestCase):
+
+    def _makeOne(self, rules):
+        from ..projection import AttributeProjection
+        return AttributeProjection(rules)
+
+    def test_no_rules(self):
+        projection = self._makeOne(())
+        self.assertFalse(projection)
+        self.assertTrue(projection.wants('foo'))
+        self.assertEqual(projection.project('foo', 'bar'), ('foo', 'bar'))
+
+    def test_rules(self):
+        projection = self._makeOne(['keep mail',
+                                    'rename cn fullname',
+                                    'truncate cn 3',
+                                    'drop mail'])
+        self.assertTrue(projection)
+        self.assertFalse(projection.wants('mail'))
+        self.assertFalse(projection.wants('jpegPhoto'))
+        self.assertTrue(projection.wants('cn'))
+        self.assertIsNone(projection.project('mail', 'x@example.com'))
+        self.assertIsNone(projection.project('jpegPhoto', 'data'))
+        self.assertEqual(projection.project('cn', 'John Doe'),
+                         ('fullname', 'Joh'))
+
+    def test_drop_only(self):
+        projection = self._makeOne(['drop jpegPhoto', 'truncate cn 4'])
+        self.assertIsNone(projection.project('jpegPhoto', 'data'))
+        self.assertEqual(projection.project('mail', 'x'), ('mail', 'x'))
+        self.assertEqual(projection.project('cn', 'John Doe'), ('cn', 'John'))
+        self.assertEqual(projection.project('cn', ['a']), ('cn', ['a']))
+
+    def test_invalid_rules(self):
+        projection = self._makeOne(['', '# comment', 'keep', 'foo bar',
+                                    'truncate cn x', 'rename mail'])
+        self.assertFalse(projection)
+
+    def test_wrapConverters(self):
+        converters = ac_factory()
+        attributes = [_attribute(OID_MAIL, 'x@example.com'),
+                      _attribute(OID_CN, 'John Doe'),
+                      _attribute(OID_PHOTO, 'PHOTO'),
+                      _attribute('urn:unknown', 'foo')]
+
+        projection = self._makeOne(['keep mail'])
+        wrapped = projection.wrapConverters(converters)
+        self.assertEqual(list_to_local(wrapped, attributes),
+                         {'mail': ['x@example.com']})
+        self.assertEqual(list_to_local(wrapped, attributes, True),
+                         {'mail': ['x@example.com']})
+
+        # Required attributes are converted in any case
+        wrapped = projection.wrapConverters(wrapped, required=('cn',))
+        self.assertEqual(list_to_local(wrapped, attributes),
+                         {'mail': ['x@example.com'], 'cn': ['John Doe']})
+
+        # Dropped attribute values are never looked at
+        photo = MagicMock()
+        photo.name = OID_PHOTO
+        photo.name_format = NAME_FORMAT_URI
+        projection = self._makeOne(['drop jpegPhoto'])
+        wrapped = projection.wrapConverters(converters)
+        self.assertEqual(list_to_local(wrapped, [photo]), {})
+        self.assertFalse(photo.attribute_value.mock_calls)
+
+        # Without keep or drop rules the converters are not wrapped
+        unwrapped = self._makeOne([]).wrapConverters(wrapped)
+        self.assertEqual(unwrapped, converters)
+
+    def test_installProjectedConverters(self):
+        from ..projection import clearAttributeProjections
+        from ..projection import installProjectedConverters
+
+        config = MagicMock()
+        converters = config.attribute_converters = ac_factory()
+        projection = self._makeOne(['keep mail'])
+
+        installProjectedConverters('uid', config, projection, ('cn', ''))
+        wrapped = config.attribute_converters
+        self.assertEqual([conv.converter for conv in wrapped], converters)
+
+        # Later calls wrap nothing and leave the configuration alone
+        with patch.object(projection, 'wrapConverters',
+                          side_effect=AssertionError):
+            installProjectedConverters('uid', config, projection, ('cn',))
+        self.assertIs(config.attribute_converters, wrapped)
+
+        # Other rules are wrapped around the original converters
+        other = self._makeOne(['drop mail'])
+        installProjectedConverters('uid', config, other)
+        self.assertEqual([conv.converter
+                          for conv in config.attribute_converters],
+                         converters)
+        self.assertIs(config.attribute_converters[0].projection, other)
+
+        # A new configuration is wrapped again
+        clearAttributeProjections()
+        new_config = MagicMock()
+        new_config.attribute_converters = converters
+        installProjectedConverters('uid', new_config, projection)
+        self.assertIsNot(new_config.attribute_converters, wrapped)
+
+    def test_getAttributeProjection(self):
+        from ..projection import getAttributeProjection
+        projection = getAttributeProjection(['keep mail'])
+        self.assertIs(getAttributeProjection(('keep mail',)), projection)
+        self.assertIsNot(getAttributeProjection(['keep cn']), projection)
+
+
+class HandleACSRequestProjectionTests(PluginTestCase):
+
+    def _getTargetClass(self):
+        from ..PluginBase import SAML2PluginBase
+        return SAML2PluginBase
+
+    def test_handleACSRequest(self):
+        plugin = self._makeOne('test')
+        self._create_valid_configuration(plugin)
+        user_data = {'uid': ['jdoe'],
+                     'mail': ['jdoe@example.com'],
+                     'cn': ['John Doe'],
+                     'jpegPhoto': ['PHOTO']}
+        saml_response = DummySAMLResponse(subject=DummyNameId('jdoe'),
+                                          issuer='https://idp',
+                                          identity=user_data)
+        dummy_client = DummyPySAML2Client(parse_result=saml_response)
+        plugin.getPySAML2Client = MagicMock(return_value=dummy_client)
+        plugin.login_attribute = 'uid'
+        plugin.attribute_rules = ('rename mail email',
+                                  'keep cn',
+                                  'truncate cn 4')
+
+        user_info = plugin.handleACSRequest(saml_response)
+        self.assertEqual(user_info['_login'], 'jdoe')
+        self.assertEqual(user_info['email'], 'jdoe@example.com')
+        self.assertEqual(user_info['cn'], 'John')
+        self.assertNotIn('mail', user_info)
+        self.assertNotIn('uid', user_info)
+        self.assertNotIn('jpegPhoto', user_info)
+
+        # The converters in the shared configuration are wrapped once
+        converters = dummy_client.config.attribute_converters
+        plugin.handleACSRequest(saml_response)
+        self.assertIs(dummy_client.config.attribute_converters, converters)
@@ -0,0 +1,202 @@
+##############################################################################
+#
+# Copyright (c) 2023 Jens Vagelpohl and Contributors. All Rights Reserved.
+#
+# This software is subject to the provisions of the Zope Public License,
+# Version 2.1 (ZPL).  A copy of the ZPL should accompany this distribution.
+# THIS SOFTWARE IS PROVIDED "AS IS" AND ANY AND ALL EXPRESS OR IMPLIED
+# WARRANTIES ARE DISCLAIMED, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF TITLE, MERCHANTABILITY, AGAINST INFRINGEMENT, AND FITNESS
+# FOR A PARTICULAR PURPOSE.
+#
+##############################################################################
+""" Tests for RelayState tokens and return URL cookies
+"""
+
+import secrets
+import unittest
+import urllib
+
+from .base import PluginTestCase
+from .dummy import DummyRequest
+
+
+class ReturnURLTests(unittest.TestCase):
+
+    def setUp(self):
+        from ..ticket import createTicketKey
+        self.key = createTicketKey()
+
+    def test_createRelayStateToken(self):
+        from ..relaystate import createRelayStateToken
+        from ..relaystate import getRelayStateCookieName
+        from ..relaystate import isRelayStateToken
+
+        token = createRelayStateToken()
+
+        # The SAML specification limits RelayState to 80 bytes
+        self.assertEqual(len(token), 25)
+        self.assertTrue(isRelayStateToken(token))
+        self.assertNotEqual(token, createRelayStateToken())
+        self.assertEqual(getRelayStateCookieName(token),
+                         f'__saml2_rs_{token[3:]}')
+
+    def test_encode_decode(self):
+        from ..relaystate import decodeReturnURL
+        from ..relaystate import encodeReturnURL
+
+        url = 'https://www.example.com/folder/page?' + 'x' * 500
+        value = encodeReturnURL('rs-token', url, self.key)
+        self.assertEqual(decodeReturnURL('rs-token', value, [self.key]), url)
+
+        # The cookie is bound to its token and key
+        self.assertIsNone(decodeReturnURL('rs-other', value, [self.key]))
+        from ..ticket import createTicketKey
+        self.assertIsNone(
+            decodeReturnURL('rs-token', value, [createTicketKey()]))
+        self.assertIsNone(decodeReturnURL('rs-token', value[:-2] + 'xx',
+                                          [self.key]))
+        self.assertIsNone(decodeReturnURL('rs-token', '', [self.key]))
+
+    def test_expiration(self):
+        from ..relaystate import decodeReturnURL
+        from ..relaystate import encodeReturnURL
+
+        value = encodeReturnURL('rs-token', '/page', self.key, ttl=10,
+                                now=1000)
+        self.assertEqual(
+            decodeReturnURL('rs-token', value, [self.key], now=1010), '/page')
+        self.assertIsNone(
+            decodeReturnURL('rs-token', value, [self.key], now=1011))
+
+    def test_not_a_credential_ticket(self):
+        from ..relaystate import encodeReturnURL
+        from ..ticket import decodeTicket
+
+        value = encodeReturnURL('rs-token', '/page', self.key)
+        self.assertIsNone(decodeTicket(value, [self.key]))
+
+    def test_isRelayStateToken(self):
+        from ..relaystate import isRelayStateToken
+
+        self.assertFalse(isRelayStateToken(''))
+        self.assertFalse(isRelayStateToken('/'))
+        self.assertFalse(isRelayStateToken('https://www.example.com/'))
+
+
+class RelayStateTokenTests(PluginTestCase):
+
+    def _getTargetClass(self):
+        from ..SAML2Plugin import SAML2Plugin
+        return SAML2Plugin
+
+    def _makeOne(self):
+        plugin = super()._makeOne('test')
+        self._create_valid_configuration(plugin)
+        return plugin
+
+    def _getRelayState(self, http_info):
+        query = urllib.parse.urlsplit(dict(http_info['headers'])['Location'])
+        return urllib.parse.parse_qs(query.query)['RelayState'][0]
+
+    def _returnRequest(self, req, token):
+        # The browser sends the cookie back with the IdP response
+        from ..relaystate import getRelayStateCookieName
+
+        cookie_name = getRelayStateCookieName(token)
+        return_req = DummyRequest()
+        return_req.cookies[cookie_name] = req.response.cookies[cookie_name][
+            'value']
+        return return_req
+
+    def test_getIdPAuthenticationData(self):
+        from ..relaystate import RELAY_STATE_TTL
+        from ..relaystate import getRelayStateCookieName
+
+        plugin = self._makeOne()
+        req = DummyRequest()
+        return_url = 'https://foo/bar?' + 'x' * 200
+        req.set('came_from', return_url)
+
+        # By default the return URL is sent
+        http_info = plugin.getIdPAuthenticationData(req)
+        self.assertEqual(self._getRelayState(http_info), return_url)
+        self.assertFalse(req.response.cookies)
+
+        plugin.relay_state_tokens = True
+        http_info = plugin.getIdPAuthenticationData(req)
+        token = self._getRelayState(http_info)
+        self.assertEqual(len(token), 25)
+        cookie = req.response.cookies[getRelayStateCookieName(token)]
+        self.assertEqual(cookie['max_age'], RELAY_STATE_TTL)
+        self.assertEqual(cookie['same_site'], 'Lax')
+        self.assertFalse(cookie['secure'])
+
+        # Another plugin instance, as in another Zope process, can
+        # resolve the token
+        return_req = self._returnRequest(req, token)
+        other = self._makeOne()
+        other._ticket_keys = plugin._ticket_keys
+        self.assertEqual(other.resolveRelayState(token, return_req),
+                         return_url)
+
+        # The cookie is removed after use
+        self.assertEqual(
+            return_req.response.cookies[getRelayStateCookieName(token)][
+                'max_age'], 0)
+
+        # Without return URL there is no token
+        req = DummyRequest()
+        http_info = plugin.getIdPAuthenticationData(req)
+        self.assertNotIn('RelayState',
+                         dict(http_info['headers'])['Location'])
+        self.assertFalse(req.response.cookies)
+
+    def test_getIdPAuthenticationData_https(self):
+        from ..relaystate import getRelayStateCookieName
+
+        plugin = self._makeOne()
+        plugin.relay_state_tokens = True
+        req = DummyRequest()
+        req.set('SERVER_URL', 'https://foo')
+        req.set('came_from', 'https://foo/bar')
+        token = self._getRelayState(plugin.getIdPAuthenticationData(req))
+
+        # Cookies must be sent with the cross-site POST from the IdP
+        cookie = req.response.cookies[getRelayStateCookieName(token)]
+        self.assertEqual(cookie['same_site'], 'None')
+        self.assertTrue(cookie['secure'])
+
+    def test_getIdPAuthenticationData_long_url(self):
+        from ..ticket import TICKET_MAX_SIZE
+
+        plugin = self._makeOne()
+        plugin.relay_state_tokens = True
+        req = DummyRequest()
+        return_url = 'https://foo/bar?' + secrets.token_urlsafe(
+            TICKET_MAX_SIZE)
+        req.set('came_from', return_url)
+
+        # URLs too long for a cookie are sent unchanged
+        http_info = plugin.getIdPAuthenticationData(req)
+        self.assertEqual(self._getRelayState(http_info), return_url)
+        self.assertFalse(req.response.cookies)
+
+    def test_resolveRelayState(self):
+        from ..relaystate import encodeReturnURL
+        from ..relaystate import getRelayStateCookieName
+
+        plugin = self._makeOne()
+        req = DummyRequest()
+
+        # Other values are passed through
+        self.assertEqual(plugin.resolveRelayState('/target', req), '/target')
+        self.assertEqual(plugin.resolveRelayState('', req), '')
+        # Unknown tokens go to the site root
+        self.assertEqual(plugin.resolveRelayState('rs-unknown', req), '/')
+
+        # Cookies signed with a key from another plugin are ignored
+        from ..ticket import createTicketKey
+        req.cookies[getRelayStateCookieName('rs-foreign')] = \
+            encodeReturnURL('rs-foreign', '/target', createTicketKey())
+        self.assertEqual(plugin.resolveRelayState('rs-foreign', req), '/')
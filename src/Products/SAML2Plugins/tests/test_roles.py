@@ -0,0 +1,125 @@
+##############################################################################
+#
+# Copyright (c) 2023 Jens Vagelpohl and Contributors. All Rights Reserved.
+#
+# This software is subject to the provisions of the Zope Public License,
+# Version 2.1 (ZPL).  A copy of the ZPL should accompany this distribution.
+# THIS SOFTWARE IS PROVIDED "AS IS" AND ANY AND ALL EXPRESS OR IMPLIED
+# WARRANTIES ARE DISCLAIMED, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF TITLE, MERCHANTABILITY, AGAINST INFRINGEMENT, AND FITNESS
+# FOR A PARTICULAR PURPOSE.
+#
+##############################################################################
+""" Tests for attribute-driven role mapping
+"""
+
+import time
+import unittest
+from unittest.mock import MagicMock
+
+from .base import PluginTestCase
+from .dummy import DummyNameId
+from .dummy import DummyPySAML2Client
+from .dummy import DummySAMLResponse
+
+
+class RoleMapperTests(unittest.TestCase):
+
+    def _makeOne(self, rules):
+        from ..roles import RoleMapper
+        return RoleMapper(rules)
+
+    def test_no_rules(self):
+        mapper = self._makeOne(())
+        self.assertFalse(mapper)
+        self.assertEqual(mapper.attributes, ())
+        self.assertEqual(mapper.getRoles({'groups': ['admins']}), frozenset())
+
+    def test_rules(self):
+        mapper = self._makeOne(
+            ['groups exact admins Manager',
+             'groups exact editors Editor Reviewer',
+             'groups prefix cn=staff, Member',
+             'eduPersonAffiliation regex ^(faculty|staff)$ Staff',
+             'entitlement regex :research: Researcher'])
+        self.assertTrue(mapper)
+        self.assertEqual(mapper.attributes, ('eduPersonAffiliation',
+                                             'entitlement', 'groups'))
+
+        identity = {'groups': ['editors', 'cn=staff,ou=groups', 'other'],
+                    'eduPersonAffiliation': 'staff',
+                    'entitlement': ['urn:x:research:read']}
+        self.assertEqual(mapper.getRoles(identity),
+                         {'Editor', 'Reviewer', 'Member', 'Staff',
+                          'Researcher'})
+
+        self.assertEqual(mapper.getRoles({'groups': ['admins', 'cn=staff']}),
+                         {'Manager'})
+        self.assertEqual(
+            mapper.getRoles({'eduPersonAffiliation': ['student']}), set())
+        self.assertEqual(mapper.getRoles({'cn': ['admins']}), set())
+
+    def test_invalid_rules(self):
+        mapper = self._makeOne(['', '# comment', 'groups exact admins',
+                                'groups suffix admins Manager',
+                                'groups regex ( Manager'])
+        self.assertFalse(mapper)
+
+    def test_getRoleMapper(self):
+        from ..roles import getRoleMapper
+        mapper = getRoleMapper(['groups exact admins Manager'])
+        self.assertIs(getRoleMapper(('groups exact admins Manager',)), mapper)
+        self.assertIsNot(getRoleMapper(['groups exact staff Manager']),
+                         mapper)
+
+    def test_benchmark(self):
+        rules = []
+        for i in range(2000):
+            rules.append(f'groups exact group{i} Role{i % 50}')
+            rules.append(f'groups prefix cn=dept{i},ou= Dept{i % 20}')
+        for i in range(500):
+            rules.append(f'entitlement regex ^urn:app{i}:admin$ Admin{i % 10}')
+        identity = {'groups': [f'group{i * 7}' for i in range(200)]
+                    + [f'cn=dept{i},ou=groups' for i in range(200)],
+                    'entitlement': [f'urn:app{i}:user' for i in range(100)]}
+        mapper = self._makeOne(rules)
+
+        start = time.perf_counter()
+        for _ in range(10):
+            roles = mapper.getRoles(identity)
+        elapsed = (time.perf_counter() - start) / 10
+
+        self.assertEqual(len(roles), 70)
+        # Generous upper bound, this takes about 5 ms
+        self.assertLess(elapsed, 0.25)
+
+
+class HandleACSRequestRolesTests(PluginTestCase):
+
+    def _getTargetClass(self):
+        from ..PluginBase import SAML2PluginBase
+        return SAML2PluginBase
+
+    def test_handleACSRequest(self):
+        plugin = self._makeOne('test')
+        self._create_valid_configuration(plugin)
+        user_data = {'uid': ['jdoe'],
+                     'groups': ['staff', 'cn=admins,ou=groups']}
+        saml_response = DummySAMLResponse(subject=DummyNameId('jdoe'),
+                                          issuer='https://idp',
+                                          identity=user_data)
+        dummy_client = DummyPySAML2Client(parse_result=saml_response)
+        plugin.getPySAML2Client = MagicMock(return_value=dummy_client)
+        plugin.login_attribute = 'uid'
+
+        # Without role rules no roles are stored
+        user_info = plugin.handleACSRequest(saml_response)
+        self.assertNotIn('_roles', user_info)
+
+        # Role rules see all values, even of dropped attributes
+        plugin.attribute_rules = ('drop groups',)
+        plugin.role_rules = ('groups exact staff Member',
+                             'groups prefix cn=admins, Manager Member')
+        user_info = plugin.handleACSRequest(saml_response)
+        self.assertEqual(user_info['_roles'], ('Manager', 'Member'))
+        self.assertNotIn('groups', user_info)
@@ -16,14 +16,17 @@
 import time
 import urllib
 from unittest.mock import MagicMock
+from unittest.mock import patch
 
 from saml2 import BINDING_HTTP_POST
 from saml2.cache import Cache
 from saml2.client import Saml2Client
 
+from ..sessioninfo import SessionInfo
 from .base import PluginTestCase
 from .dummy import DummyNameId
 from .dummy import DummyPySAML2Client
+from .dummy import DummyPySAML2Metadata
 from .dummy import DummyRequest
 from .dummy import DummySAMLResponse
 
@@ -101,8 +104,8 @@ class SAML2ServiceProviderTests(PluginTestCase):
         # Mock out a logged in user
         plugin.getPySAML2Client = MagicMock(return_value=dummy_client)
         dummy_client._store_name_id(name_id)
-        dummy_client.metadata._services = (('single_logout_service',
-                                            BINDING_HTTP_POST),)
+        dummy_client.metadata = DummyPySAML2Metadata(
+            services=(('single_logout_service', BINDING_HTTP_POST),))
         req.SESSION.set(plugin._uid, session_data)
 
         # The PySAML2 client fails during logout - user is logged out locally
@@ -119,7 +122,7 @@ class SAML2ServiceProviderTests(PluginTestCase):
         # Setting a return value for the PySAML2 client logout result
         # but the IdP does not have a single logout service
         dummy_client._store_name_id(name_id)
-        dummy_client.metadata._services = ()
+        dummy_client.metadata = DummyPySAML2Metadata(services=())
         req.SESSION.set(plugin._uid, session_data)
         res = {'https://saml.test':
                ('POST BINDING',
@@ -130,8 +133,22 @@ class SAML2ServiceProviderTests(PluginTestCase):
 
         # Tweaking the client so the IdP has a single logout service
         # and add user again, it was removed in the previous step.
-        dummy_client.metadata._services = (('single_logout_service',
-                                            BINDING_HTTP_POST),)
+        dummy_client.metadata = DummyPySAML2Metadata(
+            services=(('single_logout_service', BINDING_HTTP_POST),))
+        dummy_client._store_name_id(name_id)
+        req.SESSION.set(plugin._uid, session_data)
+        self.assertEqual(plugin.logout(req), 'Data Payload')
+
+        # Only the single logout service of the user's identity provider
+        # counts, another identity provider's service doesn't help.
+        session_data['issuer'] = 'https://other.test'
+        dummy_client._store_name_id(name_id)
+        req.SESSION.set(plugin._uid, session_data)
+        req.RESPONSE.redirected = ''
+        self.assertIsNone(plugin.logout(req))
+        self.assertEqual(req.RESPONSE.redirected, '/logged_out')
+
+        session_data['issuer'] = 'https://saml.test'
         dummy_client._store_name_id(name_id)
         req.SESSION.set(plugin._uid, session_data)
         self.assertEqual(plugin.logout(req), 'Data Payload')
@@ -272,6 +289,30 @@ class SAML2ServiceProviderTests(PluginTestCase):
         self.assertIn('No supported bindings available for authentication',
                       str(context.exception))
 
+    def test_getIdPAuthenticationData_cached_binding(self):
+        from saml2 import BINDING_HTTP_REDIRECT
+
+        plugin = self._makeOne()
+        req = DummyRequest()
+        client = plugin.getPySAML2Client()
+        metadata = client.metadata
+
+        # pysaml2 creates the request for the binding negotiated when the
+        # metadata was loaded, instead of trying every binding
+        with patch.object(client, 'prepare_for_negotiated_authenticate',
+                          wraps=client.prepare_for_negotiated_authenticate
+                          ) as prepare, \
+             patch.object(metadata, 'single_sign_on_service',
+                          wraps=metadata.single_sign_on_service) as sso:
+            http_info = plugin.getIdPAuthenticationData(
+                req, idp_entityid='https://saml.example.com/entityid')
+        self.assertEqual(prepare.call_args[1]['binding'],
+                         BINDING_HTTP_REDIRECT)
+        self.assertEqual(sso.call_count, 1)
+        redirect = dict(http_info['headers'])['Location']
+        self.assertTrue(redirect.startswith(
+            'https://mocksaml.com/api/saml/sso?SAMLRequest='))
+
     def test_handleACSRequest(self):
         plugin = self._makeOne()
 
@@ -296,6 +337,7 @@ class SAML2ServiceProviderTests(PluginTestCase):
         self.assertEqual(user_info['key2'], '')
         self.assertEqual(user_info['key3'], 'foo')
         self.assertAlmostEqual(user_info['last_active'], int(time.time()), 1)
+        self.assertIsInstance(user_info, SessionInfo)
 
         # Set an unknown login attribute
         plugin.login_attribute = 'unknown'
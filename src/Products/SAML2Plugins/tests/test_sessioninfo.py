@@ -0,0 +1,157 @@
+##############################################################################
+#
+# Copyright (c) 2023 Jens Vagelpohl and Contributors. All Rights Reserved.
+#
+# This software is subject to the provisions of the Zope Public License,
+# Version 2.1 (ZPL).  A copy of the ZPL should accompany this distribution.
+# THIS SOFTWARE IS PROVIDED "AS IS" AND ANY AND ALL EXPRESS OR IMPLIED
+# WARRANTIES ARE DISCLAIMED, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF TITLE, MERCHANTABILITY, AGAINST INFRINGEMENT, AND FITNESS
+# FOR A PARTICULAR PURPOSE.
+#
+##############################################################################
+""" Tests for the session information record
+"""
+
+import pickle
+import sys
+import types
+import unittest
+
+
+def _session_data(attributes=20):
+    data = {'_login': 'jdoe',
+            'name_id': '0=,1=,2=,3=,4=jdoe',
+            'issuer': 'https://idp.example.com',
+            'last_active': 1700000000}
+    for i in range(attributes):
+        data[f'attribute{i}'] = f'value{i}'
+    return data
+
+
+class SessionInfoTests(unittest.TestCase):
+
+    def _makeOne(self, data=None):
+        from ..sessioninfo import SessionInfo
+        return SessionInfo.fromMapping(data or _session_data())
+
+    def test_mapping(self):
+        data = _session_data()
+        info = self._makeOne(data)
+        self.assertEqual(info, data)
+        self.assertEqual(dict(info), data)
+        self.assertEqual(len(info), len(data))
+        self.assertEqual(info['_login'], 'jdoe')
+        self.assertEqual(info.login, 'jdoe')
+        self.assertEqual(info['attribute3'], 'value3')
+        self.assertIn('issuer', info)
+        self.assertNotIn('foo', info)
+        self.assertIsNone(info.get('foo'))
+        with self.assertRaises(KeyError):
+            info['foo']
+
+        # Read-only views work as well
+        self.assertEqual(types.MappingProxyType(info)['_login'], 'jdoe')
+
+    def test_missing_core_fields(self):
+        info = self._makeOne({'_login': 'jdoe'})
+        self.assertEqual(dict(info), {'_login': 'jdoe'})
+        self.assertEqual(info.get('last_active', 0), 0)
+        self.assertNotIn('name_id', info)
+        self.assertNotIn('_roles', info)
+
+    def test_roles(self):
+        info = self._makeOne(dict(_session_data(), _roles=('Member',)))
+        self.assertEqual(info.roles, ('Member',))
+        self.assertEqual(info['_roles'], ('Member',))
+        self.assertEqual(pickle.loads(pickle.dumps(info)).roles, ('Member',))
+
+    def test_shared_groups(self):
+        info1 = self._makeOne(dict(_session_data(), _groups=['a', 'b']))
+        info2 = self._makeOne(dict(_session_data(), _groups=('a', 'b')))
+        self.assertEqual(info1['_groups'], ('a', 'b'))
+        self.assertIs(info1.groups, info2.groups)
+        unpickled = pickle.loads(pickle.dumps(info1))
+        self.assertIs(unpickled.groups, info1.groups)
+
+    def test___setitem__(self):
+        info = self._makeOne()
+        info['last_active'] = 1800000000
+        self.assertEqual(info.last_active, 1800000000)
+
+        info['attribute3'] = 'changed'
+        self.assertEqual(info['attribute3'], 'changed')
+        self.assertEqual(info['attribute4'], 'value4')
+
+        info['new'] = 'value'
+        self.assertEqual(info['new'], 'value')
+        self.assertEqual(info._index['new'], len(info._names) - 1)
+        self.assertEqual(len(info), len(_session_data()) + 1)
+
+    def test_shared_names(self):
+        info1 = self._makeOne()
+        info2 = self._makeOne(dict(_session_data(), _login='other'))
+        self.assertIs(info1._names, info2._names)
+        self.assertIs(info1._index, info2._index)
+        self.assertIs(pickle.loads(pickle.dumps(info1))._index, info1._index)
+
+    def test_lookup_without_scan(self):
+        info = self._makeOne(_session_data(attributes=200))
+        # Attribute values are found through the shared name index, the
+        # name tuple is never searched
+        info._names = None
+        self.assertEqual(info['attribute199'], 'value199')
+        self.assertEqual(info.get('attribute0'), 'value0')
+        self.assertIsNone(info.get('missing'))
+        self.assertIn('attribute42', info)
+        self.assertNotIn('missing', info)
+        info['attribute7'] = 'changed'
+        self.assertEqual(info['attribute7'], 'changed')
+
+    def test_pickle(self):
+        info = self._makeOne()
+        unpickled = pickle.loads(pickle.dumps(info))
+        self.assertEqual(unpickled, info)
+        self.assertIs(unpickled._names, info._names)
+
+        # Attribute names are pickled as one string
+        self.assertEqual(info.__reduce__()[1][4],
+                         '\x1f'.join(f'attribute{i}' for i in range(20)))
+
+        # Names containing the separator are kept as tuple
+        info['a\x1fb'] = 'c'
+        self.assertEqual(pickle.loads(pickle.dumps(info)), info)
+
+    def test_pickle_size(self):
+        data = dict(_session_data(), session_index='id-1', _roles=('M',))
+        info = self._makeOne(data)
+
+        # The pickle is smaller than that of the mapping it replaces
+        for protocol in (2, pickle.DEFAULT_PROTOCOL, pickle.HIGHEST_PROTOCOL):
+            self.assertLess(len(pickle.dumps(info, protocol)),
+                            len(pickle.dumps(data, protocol)) * 0.95)
+
+        # Fields that are not set are left out
+        info = self._makeOne({'_login': 'jdoe'})
+        self.assertEqual(info.__reduce__()[1], ('jdoe',))
+        self.assertEqual(pickle.loads(pickle.dumps(info)), {'_login': 'jdoe'})
+
+    def test_pickle_previous_layout(self):
+        from ..sessioninfo import SessionInfo
+
+        # Sessions pickled with the class as constructor still load
+        old = (b'\x80\x04\x95T\x00\x00\x00\x00\x00\x00\x00'
+               b'\x8c!Products.SAML2Plugins.sessioninfo\x94'
+               b'\x8c\x0bSessionInfo\x94\x93\x94(\x8c\x04jdoe\x94NN'
+               b'K\x01\x8c\x01a\x94\x85\x94\x8c\x01b\x94\x85\x94'
+               b'NNNt\x94R\x94.')
+        info = pickle.loads(old)
+        self.assertIsInstance(info, SessionInfo)
+        self.assertEqual(dict(info), {'_login': 'jdoe', 'last_active': 1,
+                                      'a': 'b'})
+
+    def test_memory(self):
+        info = self._makeOne()
+        data = _session_data()
+        self.assertLess(sys.getsizeof(info) + sys.getsizeof(info._values),
+                        sys.getsizeof(data) / 2)
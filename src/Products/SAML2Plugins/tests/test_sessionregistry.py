@@ -0,0 +1,323 @@
+##############################################################################
+#
+# Copyright (c) 2023 Jens Vagelpohl and Contributors. All Rights Reserved.
+#
+# This software is subject to the provisions of the Zope Public License,
+# Version 2.1 (ZPL).  A copy of the ZPL should accompany this distribution.
+# THIS SOFTWARE IS PROVIDED "AS IS" AND ANY AND ALL EXPRESS OR IMPLIED
+# WARRANTIES ARE DISCLAIMED, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF TITLE, MERCHANTABILITY, AGAINST INFRINGEMENT, AND FITNESS
+# FOR A PARTICULAR PURPOSE.
+#
+##############################################################################
+""" Tests for the login session registry and identity provider logout
+"""
+
+import time
+import unittest
+from unittest.mock import MagicMock
+from unittest.mock import patch
+
+from saml2 import saml
+from saml2 import samlp
+from saml2.ident import code as nameid_to_str
+
+from .base import PluginTestCase
+from .dummy import DummyNameId
+from .dummy import DummyPySAML2Client
+from .dummy import DummyRequest
+from .dummy import DummySAMLResponse
+
+
+class SessionRegistryTests(unittest.TestCase):
+
+    def _makeOne(self, ttl=3600):
+        from ..sessionregistry import SessionRegistry
+        return SessionRegistry(ttl)
+
+    def test_register(self):
+        registry = self._makeOne()
+        registry.register('jdoe', 'idx2')
+        registry.register('jdoe', 'idx1')
+        registry.register('jdoe')
+        registry.register('jdoe2', 'idx3')
+        self.assertEqual(registry.sessions('jdoe'), [None, 'idx1', 'idx2'])
+        self.assertEqual(registry.sessions('jdoe2'), ['idx3'])
+        self.assertEqual(registry.sessions('jane'), [])
+
+    def test_revoke_session_index(self):
+        registry = self._makeOne()
+        login_time = time.time()
+        registry.register('jdoe', 'idx1', login_time)
+        registry.register('jdoe', 'idx2', login_time)
+        self.assertFalse(registry.isRevoked('jdoe', 'idx1', login_time))
+
+        self.assertEqual(registry.revoke('jdoe', ['idx1']), 1)
+        self.assertTrue(registry.isRevoked('jdoe', 'idx1', login_time))
+        self.assertFalse(registry.isRevoked('jdoe', 'idx2', login_time))
+        self.assertEqual(registry.sessions('jdoe'), ['idx2'])
+
+        # Session indexes not seen before are revoked as well, only
+        # registered sessions are counted
+        self.assertEqual(registry.revoke('jane', ['idx3']), 0)
+        self.assertTrue(registry.isRevoked('jane', 'idx3', login_time))
+
+        # A later login with the same session index is valid
+        self.assertFalse(registry.isRevoked('jdoe', 'idx1', time.time() + 1))
+
+    def test_revoke_all(self):
+        registry = self._makeOne()
+        login_time = time.time()
+        registry.register('jdoe', 'idx1', login_time)
+        registry.register('jdoe', 'idx2', login_time)
+        registry.register('jane', login_time=login_time)
+
+        self.assertEqual(registry.revoke('jdoe'), 2)
+        self.assertTrue(registry.isRevoked('jdoe', 'idx1', login_time))
+        self.assertTrue(registry.isRevoked('jdoe', 'idx2', login_time))
+        self.assertFalse(registry.isRevoked('jane', None, login_time))
+        self.assertEqual(registry.sessions('jdoe'), [])
+
+        self.assertEqual(registry.revoke('jane'), 1)
+        self.assertTrue(registry.isRevoked('jane', None, login_time))
+
+        # Logging in again makes the session valid
+        login_time = time.time() + 1
+        registry.register('jane', login_time=login_time)
+        self.assertFalse(registry.isRevoked('jane', None, login_time))
+
+    def test_revoke_all_unknown_sessions(self):
+        # Sessions the registry has never seen
+        registry = self._makeOne()
+        login_time = time.time() - 10
+        self.assertEqual(registry.revoke('jdoe'), 0)
+        self.assertTrue(registry.isRevoked('jdoe', 'idx1', login_time))
+        self.assertTrue(registry.isRevoked('jdoe', None, login_time))
+        self.assertFalse(registry.isRevoked('jane', 'idx1', login_time))
+
+        # Sessions without login time are revoked, later ones are not
+        self.assertTrue(registry.isRevoked('jdoe', 'idx1'))
+        self.assertFalse(registry.isRevoked('jdoe', 'idx2', time.time() + 1))
+
+    def test_logout(self):
+        registry = self._makeOne()
+        login_time = time.time()
+        registry.register('jdoe', 'idx1', login_time)
+        registry.logout('jdoe', 'idx1', login_time)
+        self.assertTrue(registry.isRevoked('jdoe', 'idx1', login_time))
+        self.assertEqual(registry.sessions('jdoe'), [])
+
+        # Other sessions, even with the same session index, stay valid
+        self.assertFalse(registry.isRevoked('jdoe', 'idx1', login_time + 1))
+        self.assertFalse(registry.isRevoked('jdoe', 'idx2', login_time))
+
+        # Sessions without login time cannot be told apart
+        registry.logout('jane')
+        self.assertTrue(registry.isRevoked('jane'))
+        self.assertFalse(registry.isRevoked('jane', None, login_time))
+
+    def test_cleanup(self):
+        registry = self._makeOne(ttl=10)
+        registry.register('jdoe', 'idx1')
+        registry.revoke('jane', ['idx2'])
+        registry.revoke('joe')
+        registry.logout('bob', 'idx3', time.time())
+
+        with patch('time.time', return_value=time.time() + 100000):
+            registry.register('bob')
+
+        self.assertEqual(list(registry._sessions), [('bob', '')])
+        self.assertFalse(registry._revoked)
+        self.assertFalse(registry._revoked_all)
+        self.assertFalse(registry._logged_out)
+
+    def test_shared_between_connections(self):
+        # Revocations in one Zope process reach all others
+        import transaction
+        from ZODB.DB import DB
+        from ZODB.MappingStorage import MappingStorage
+
+        db = DB(MappingStorage())
+        self.addCleanup(db.close)
+        tm1 = transaction.TransactionManager()
+        tm2 = transaction.TransactionManager()
+        conn1 = db.open(transaction_manager=tm1)
+        conn2 = db.open(transaction_manager=tm2)
+
+        login_time = time.time()
+        conn1.root()['registry'] = self._makeOne()
+        conn1.root()['registry'].register('jdoe', 'idx1', login_time)
+        tm1.commit()
+
+        tm2.begin()
+        conn2.root()['registry'].revoke('jdoe', ['idx1'])
+        tm2.commit()
+
+        tm1.begin()
+        self.assertTrue(
+            conn1.root()['registry'].isRevoked('jdoe', 'idx1', login_time))
+        self.assertEqual(conn1.root()['registry'].sessions('jdoe'), [])
+
+
+class IdPLogoutTests(PluginTestCase):
+
+    def _getTargetClass(self):
+        from ..PluginBase import SAML2PluginBase
+        return SAML2PluginBase
+
+    def _login(self, plugin, uid, session_index='idx1'):
+        saml_response = DummySAMLResponse(subject=DummyNameId(uid),
+                                          issuer='https://idp',
+                                          identity={'uid': [uid]},
+                                          session_index=session_index)
+        dummy_client = DummyPySAML2Client(parse_result=saml_response)
+        plugin.getPySAML2Client = MagicMock(return_value=dummy_client)
+        plugin.login_attribute = 'uid'
+        return plugin.handleACSRequest(saml_response)
+
+    def _logoutRequest(self, user_info, session_indexes=()):
+        name_id = saml.NameID(text=user_info['_login'],
+                              name_qualifier='name_qualifier_value',
+                              sp_name_qualifier='sp_name_qualifier_value',
+                              format='format_value',
+                              sp_provided_id='sp_provided_id_value')
+        self.assertEqual(nameid_to_str(name_id), user_info['name_id'])
+        message = samlp.LogoutRequest(
+            name_id=name_id,
+            session_index=[samlp.SessionIndex(text=idx)
+                           for idx in session_indexes])
+        # Signatures are verified by pysaml2 while parsing
+        message.signature = MagicMock()
+        return MagicMock(message=message, issuer=saml.Issuer(text='idp'))
+
+    def _mockClient(self, plugin, saml_request):
+        client = MagicMock()
+        client.parse_logout_request.return_value = saml_request
+        client.logout_responses_signed = False
+        client.response_args.return_value = {'binding': 'binding',
+                                             'destination': 'https://idp'}
+        client.apply_binding.return_value = {'headers': [], 'data': 'xml'}
+        client.metadata.certs.return_value = [('', 'CERTIFICATE')]
+        plugin.getPySAML2Client = MagicMock(return_value=client)
+        return client
+
+    def test_handleACSRequest_registers_session(self):
+        plugin = self._makeOne('test')
+        self._create_valid_configuration(plugin)
+        user_info = self._login(plugin, 'jdoe')
+        self.assertEqual(user_info['session_index'], 'idx1')
+        registry = plugin.getSessionRegistry()
+        self.assertIs(plugin._session_registry, registry)
+        self.assertEqual(registry.sessions(user_info['name_id']), ['idx1'])
+
+        # Session indexes are optional
+        user_info = self._login(plugin, 'jane', session_index=None)
+        self.assertNotIn('session_index', user_info)
+        self.assertEqual(registry.sessions(user_info['name_id']), [None])
+
+        # Entries are kept as long as sessions or tickets can be valid
+        self.assertEqual(registry.ttl, 24 * 3600)
+        plugin.inactivity_timeout = 30
+        self.assertEqual(plugin.getSessionRegistry().ttl, 30 * 3600)
+
+    def test_handleLogoutRequest(self):
+        plugin = self._makeOne('test')
+        self._create_valid_configuration(plugin)
+        user_info = self._login(plugin, 'jdoe')
+        req = DummyRequest()
+        plugin.setSessionInfo(req, user_info)
+        self.assertEqual(plugin.extractCredentials(req)['login'], 'jdoe')
+
+        saml_request = self._logoutRequest(user_info, ['idx1'])
+        client = self._mockClient(plugin, saml_request)
+        self.assertEqual(plugin.handleLogoutRequest('abc', 'POST',
+                                                    relay_state='state'),
+                         {'headers': [], 'data': 'xml'})
+        client.parse_logout_request.assert_called_once()
+        status = client.create_logout_response.call_args[1]['status']
+        self.assertEqual(status.status_code.value, samlp.STATUS_SUCCESS)
+        self.assertEqual(client.apply_binding.call_args[0][3], 'state')
+
+        # The session is no longer accepted and gets cleared
+        req.expire_cache()
+        self.assertNotIn('login', plugin.extractCredentials(req))
+        self.assertIsNone(plugin.getSessionInfo(req))
+
+        # A new login with a new session index works
+        user_info = self._login(plugin, 'jdoe', session_index='idx2')
+        plugin.setSessionInfo(req, user_info)
+        self.assertEqual(plugin.extractCredentials(req)['login'], 'jdoe')
+
+    def test_handleLogoutRequest_all_sessions(self):
+        plugin = self._makeOne('test')
+        self._create_valid_configuration(plugin)
+        user_info = self._login(plugin, 'jdoe')
+        self._mockClient(plugin, self._logoutRequest(user_info))
+        plugin.handleLogoutRequest('abc', 'POST')
+        self.assertTrue(plugin.isSessionRevoked(user_info))
+
+    def test_handleLogoutRequest_all_sessions_unknown(self):
+        from ..sessionregistry import SessionRegistry
+
+        plugin = self._makeOne('test')
+        self._create_valid_configuration(plugin)
+        user_info = self._login(plugin, 'jdoe')
+        self.assertIn('login_time', user_info)
+
+        # The session is unknown, for example from before an upgrade
+        plugin._session_registry = SessionRegistry(3600)
+        self._mockClient(plugin, self._logoutRequest(user_info))
+        plugin.handleLogoutRequest('abc', 'POST')
+        self.assertTrue(plugin.isSessionRevoked(user_info))
+
+        # A new login is accepted
+        user_info = self._login(plugin, 'jdoe')
+        self.assertFalse(plugin.isSessionRevoked(user_info))
+
+    def test_handleLogoutRequest_failures(self):
+        plugin = self._makeOne('test')
+        self._create_valid_configuration(plugin)
+        user_info = self._login(plugin, 'jdoe')
+
+        client = self._mockClient(plugin, None)
+        self.assertIsNone(plugin.handleLogoutRequest('abc'))
+
+        client.parse_logout_request.side_effect = Exception('bad')
+        self.assertIsNone(plugin.handleLogoutRequest('abc'))
+
+        # Unsigned requests are rejected
+        saml_request = self._logoutRequest(user_info)
+        saml_request.message.signature = None
+        client = self._mockClient(plugin, saml_request)
+        self.assertIsNone(plugin.handleLogoutRequest('abc', 'POST'))
+        self.assertFalse(plugin.isSessionRevoked(user_info))
+
+        # So are requests from issuers without signing certificate
+        client = self._mockClient(plugin, self._logoutRequest(user_info))
+        client.metadata.certs.return_value = []
+        self.assertIsNone(plugin.handleLogoutRequest('abc', 'POST'))
+        client.metadata.certs.side_effect = KeyError('idp')
+        self.assertIsNone(plugin.handleLogoutRequest('abc', 'POST'))
+        self.assertFalse(plugin.isSessionRevoked(user_info))
+
+        # Missing or invalid redirect binding signatures are rejected
+        client = self._mockClient(plugin, self._logoutRequest(user_info))
+        self.assertIsNone(plugin.handleLogoutRequest(
+            'abc', 'REDIRECT', query_string='SAMLRequest=abc'))
+        plugin._verifyRedirectSignature = MagicMock(return_value=False)
+        self.assertIsNone(plugin.handleLogoutRequest('abc', 'REDIRECT'))
+        self.assertFalse(plugin.isSessionRevoked(user_info))
+
+        # Requests without NameID get an error status
+        plugin._verifyRedirectSignature = MagicMock(return_value=True)
+        saml_request = self._logoutRequest(user_info)
+        saml_request.message.name_id = None
+        client = self._mockClient(plugin, saml_request)
+        plugin.handleLogoutRequest('abc', 'REDIRECT')
+        status = client.create_logout_response.call_args[1]['status']
+        self.assertEqual(status.status_code.status_code.value,
+                         samlp.STATUS_UNKNOWN_PRINCIPAL)
+
+        # Errors creating the response are caught
+        client.response_args.side_effect = Exception('no endpoint')
+        self.assertIsNone(plugin.handleLogoutRequest('abc'))
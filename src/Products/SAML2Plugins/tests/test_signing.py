@@ -0,0 +1,225 @@
+##############################################################################
+#
+# Copyright (c) 2023 Jens Vagelpohl and Contributors. All Rights Reserved.
+#
+# This software is subject to the provisions of the Zope Public License,
+# Version 2.1 (ZPL).  A copy of the ZPL should accompany this distribution.
+# THIS SOFTWARE IS PROVIDED "AS IS" AND ANY AND ALL EXPRESS OR IMPLIED
+# WARRANTIES ARE DISCLAIMED, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF TITLE, MERCHANTABILITY, AGAINST INFRINGEMENT, AND FITNESS
+# FOR A PARTICULAR PURPOSE.
+#
+##############################################################################
+""" Tests for HTTP-Redirect binding signatures
+"""
+
+import base64
+import unittest
+import urllib
+from unittest.mock import MagicMock
+
+from saml2 import sigver
+from saml2.pack import http_redirect_message
+
+from .base import TEST_CONFIG_FOLDER
+from .base import PluginTestCase
+from .dummy import DummyPySAML2Client
+from .dummy import DummySAMLResponse
+
+
+SIGNED_MESSAGE = (
+    'SAMLRequest=fZJNT8MwDIb%2FSpV7m7Tb2BatnQYTEhKIaQwO3NzWWaPlo%2Bqa%2FXvS'
+    'dhNwgZOt2K%2Fs1%2FZud9Ea%2FYw6hAS&RelayState=%2Frestricted_html%3Fkey'
+    '%3Dval&SigAlg=')
+MGF1 = 'http://www.w3.org/2007/05/xmldsig-more#sha256-rsa-MGF1'
+
+
+def _path(filename):
+    return f'{TEST_CONFIG_FOLDER}/{filename}'
+
+
+def _load_vectors():
+    """ Signatures created with openssl, see the data file header """
+    vectors = {}
+    with open(_path('redirect_signature_vectors.txt')) as fp:
+        for line in fp:
+            if line.strip() and not line.startswith('#'):
+                sigalg, signature = line.split()
+                vectors[sigalg] = base64.b64decode(signature)
+    return vectors
+
+
+def _private_key():
+    return sigver.import_rsa_key_from_file(_path('saml2plugintest.key'))
+
+
+def _certificate():
+    # Certificate data as found in metadata, without PEM armor
+    with open(_path('saml2plugintest.pem')) as fp:
+        lines = fp.read().strip().splitlines()
+    return ''.join(lines[1:-1])
+
+
+def _message(sigalg):
+    return (SIGNED_MESSAGE + urllib.parse.quote_plus(sigalg)).encode('ascii')
+
+
+class RedirectSignerTests(unittest.TestCase):
+
+    def _makeOne(self, sigalg, key=None):
+        from ..signing import getRedirectSigner
+        return getRedirectSigner(sigalg, key=key)
+
+    def test_vectors_pkcs1(self):
+        # PKCS#1 v1.5 signatures are deterministic, compare them directly
+        vectors = _load_vectors()
+        for sigalg, signature in vectors.items():
+            if sigalg == MGF1:
+                continue
+            signer = self._makeOne(sigalg, key=_private_key())
+            self.assertEqual(signer.sign(_message(sigalg)), signature)
+            self.assertTrue(signer.verify(_message(sigalg), signature))
+
+    def test_vectors_mgf1(self):
+        # RSASSA-PSS signatures are randomized, only verification can
+        # be compared against the reference.
+        signature = _load_vectors()[MGF1]
+        signer = self._makeOne(MGF1, key=_private_key())
+        self.assertTrue(signer.verify(_message(MGF1), signature))
+        self.assertFalse(signer.verify(_message(MGF1) + b'x', signature))
+
+        own_signature = signer.sign(_message(MGF1))
+        self.assertNotEqual(own_signature, signature)
+        self.assertTrue(signer.verify(_message(MGF1), own_signature))
+
+    def test_vectors_pysaml2_reference(self):
+        # The stock pysaml2 PKCS#1 verifier accepts the same vectors
+        for sigalg, signature in _load_vectors().items():
+            if sigalg == MGF1:
+                continue
+            reference = sigver.RSASigner(
+                self._makeOne(sigalg).digest, key=_private_key())
+            self.assertTrue(reference.verify(_message(sigalg), signature))
+
+    def test_unsupported_algorithm(self):
+        self.assertIsNone(self._makeOne('http://foo/unknown'))
+
+    def test_get_signer(self):
+        from ..monkeypatch import applyPatches
+        applyPatches()
+        crypto = sigver.RSACrypto(_private_key())
+        signer1 = crypto.get_signer(MGF1)
+        signer2 = crypto.get_signer(MGF1, sigkey=_private_key())
+
+        # Each call produces a separate signer bound to its key
+        self.assertIsNot(signer1, signer2)
+        self.assertIs(signer1.key, crypto.key)
+        self.assertIsNot(signer2.key, crypto.key)
+        self.assertIsNone(crypto.get_signer('http://foo/unknown'))
+        self.assertIn(MGF1, sigver.SIGNER_ALGS)
+
+
+class VerifyRedirectQueryTests(unittest.TestCase):
+
+    def _callFUT(self, query_string, certs):
+        from ..signing import verify_redirect_query
+        return verify_redirect_query(query_string, certs)
+
+    def _redirect(self, sigalg, relay_state='/foo?bar=baz'):
+        info = http_redirect_message('<samlp:LogoutResponse/>',
+                                     'https://sp.example.com/slo?x=1',
+                                     relay_state=relay_state,
+                                     typ='SAMLResponse',
+                                     sigalg=sigalg,
+                                     sign=True,
+                                     backend=sigver.RSACrypto(_private_key()))
+        location = dict(info['headers'])['Location']
+        return urllib.parse.urlparse(location).query
+
+    def test_unsigned(self):
+        self.assertIsNone(self._callFUT('', [_certificate()]))
+        self.assertIsNone(self._callFUT('SAMLResponse=abc&RelayState=%2F',
+                                        [_certificate()]))
+
+    def test_signed(self):
+        for sigalg in _load_vectors():
+            query_string = self._redirect(sigalg)
+            self.assertTrue(self._callFUT(query_string, [_certificate()]))
+            self.assertTrue(self._callFUT(query_string,
+                                          [('keyname', _certificate())]))
+
+            # No certificates, bad certificates
+            self.assertFalse(self._callFUT(query_string, []))
+            self.assertFalse(self._callFUT(query_string, ['garbage']))
+
+        # Without relay state
+        query_string = self._redirect(MGF1, relay_state='')
+        self.assertNotIn('RelayState', query_string)
+        self.assertTrue(self._callFUT(query_string, [_certificate()]))
+
+    def test_tampered(self):
+        query_string = self._redirect(MGF1)
+        tampered = query_string.replace('RelayState=%2Ffoo',
+                                        'RelayState=%2Fevil')
+        self.assertFalse(self._callFUT(tampered, [_certificate()]))
+
+        # Unknown signature algorithm
+        tampered = query_string.replace('SigAlg=', 'SigAlg=foo')
+        self.assertFalse(self._callFUT(tampered, [_certificate()]))
+
+        # Broken signature encoding
+        tampered = query_string.replace('Signature=', 'Signature=%25%25')
+        self.assertFalse(self._callFUT(tampered, [_certificate()]))
+
+        # Signature without message
+        self.assertFalse(self._callFUT(
+            f'SigAlg={urllib.parse.quote_plus(MGF1)}&Signature=abc',
+            [_certificate()]))
+
+    def test_other_certificate(self):
+        with open(_path('saml2plugintest_enc.pem')) as fp:
+            other = ''.join(fp.read().strip().splitlines()[1:-1])
+        self.assertFalse(self._callFUT(self._redirect(MGF1), [other]))
+
+
+class HandleSLORequestSignatureTests(PluginTestCase):
+
+    def _getTargetClass(self):
+        from ..PluginBase import SAML2PluginBase
+        return SAML2PluginBase
+
+    def test_handleSLORequest_query_signature(self):
+        plugin = self._makeOne('test')
+        self._create_valid_configuration(plugin)
+        plugin.logout_path = '/logged_out'
+        saml_response = DummySAMLResponse(status='raise_error',
+                                          issuer='https://idp')
+        dummy_client = DummyPySAML2Client(parse_result=saml_response)
+        dummy_client.metadata.certs = MagicMock(return_value=[_certificate()])
+        plugin.getPySAML2Client = MagicMock(return_value=dummy_client)
+        query_string = VerifyRedirectQueryTests._redirect(None, MGF1)
+
+        # A valid signature is accepted and the response gets evaluated
+        self.assertEqual(
+            plugin.handleSLORequest('', binding='REDIRECT',
+                                    query_string=query_string),
+            '/logged_out')
+        dummy_client.metadata.certs.assert_called_with(
+            'https://idp', 'idpsso', 'signing')
+
+        # A bad signature gets the response discarded
+        saml_response.status_ok = MagicMock()
+        tampered = query_string.replace('RelayState=%2Ffoo',
+                                        'RelayState=%2Fevil')
+        self.assertEqual(
+            plugin.handleSLORequest('', binding='REDIRECT',
+                                    query_string=tampered),
+            '/logged_out')
+        saml_response.status_ok.assert_not_called()
+
+        # Query string signatures are ignored for the POST binding
+        self.assertEqual(
+            plugin.handleSLORequest('', binding='POST',
+                                    query_string=tampered),
+            '/logged_out')
+        saml_response.status_ok.assert_called_once()
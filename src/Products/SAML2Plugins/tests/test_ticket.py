@@ -0,0 +1,333 @@
+##############################################################################
+#
+# Copyright (c) 2023 Jens Vagelpohl and Contributors. All Rights Reserved.
+#
+# This software is subject to the provisions of the Zope Public License,
+# Version 2.1 (ZPL).  A copy of the ZPL should accompany this distribution.
+# THIS SOFTWARE IS PROVIDED "AS IS" AND ANY AND ALL EXPRESS OR IMPLIED
+# WARRANTIES ARE DISCLAIMED, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF TITLE, MERCHANTABILITY, AGAINST INFRINGEMENT, AND FITNESS
+# FOR A PARTICULAR PURPOSE.
+#
+##############################################################################
+""" Tests for signed credential tickets
+"""
+
+import time
+import unittest
+
+from .base import PluginTestCase
+from .dummy import DummyRequest
+from .dummy import DummyUser
+
+
+SESSION_INFO = {'_login': 'testuser',
+                'name_id': '0=,1=,2=,3=,4=testuser',
+                'issuer': 'https://samltest',
+                'mail': 'testuser@example.com',
+                'last_active': 0}
+
+
+class TicketTests(unittest.TestCase):
+
+    def setUp(self):
+        from ..ticket import createTicketKey
+        self.key = createTicketKey()
+
+    def _encode(self, data=SESSION_INFO, key=None, encrypt=False):
+        from ..ticket import encodeTicket
+        return encodeTicket(data, key or self.key, encrypt=encrypt)
+
+    def _decode(self, ticket, keys=None):
+        from ..ticket import decodeTicket
+        return decodeTicket(ticket, keys or [self.key])
+
+    def test_createTicketKey(self):
+        from ..ticket import createTicketKey
+        key_id, secret = createTicketKey()
+        self.assertEqual(len(secret), 32)
+        self.assertNotEqual(createTicketKey()[0], key_id)
+
+    def test_signed(self):
+        ticket = self._encode()
+        self.assertTrue(ticket.startswith(f'1.{self.key[0]}.s.'))
+        self.assertEqual(self._decode(ticket), SESSION_INFO)
+
+    def test_encrypted(self):
+        ticket = self._encode(encrypt=True)
+        self.assertTrue(ticket.startswith(f'1.{self.key[0]}.e.'))
+        self.assertNotIn('testuser', ticket)
+        self.assertEqual(self._decode(ticket), SESSION_INFO)
+
+        # Encryption is randomized
+        self.assertNotEqual(ticket, self._encode(encrypt=True))
+
+    def test_tampered(self):
+        for encrypt in (False, True):
+            ticket = self._encode(encrypt=encrypt)
+            version, key_id, mode, payload, sig = ticket.split('.')
+
+            # Changed payload
+            payload = payload[:-2] + ('AA' if payload[-2:] != 'AA' else 'BB')
+            self.assertIsNone(
+                self._decode('.'.join((version, key_id, mode, payload, sig))))
+
+            # Switching the mode flag breaks the signature
+            self.assertIsNone(self._decode(
+                ticket.replace(f'.{mode}.', '.e.' if mode == 's' else '.s.')))
+
+            # Bad version
+            self.assertIsNone(self._decode('2' + ticket[1:]))
+
+    def test_garbage(self):
+        self.assertIsNone(self._decode(''))
+        self.assertIsNone(self._decode(None))
+        self.assertIsNone(self._decode('a.b.c.d.e'))
+        self.assertIsNone(self._decode(f'1.{self.key[0]}.s.!!!.xyz'))
+
+        # Correctly signed but not a mapping
+        self.assertIsNone(self._decode(self._encode(data=['foo'])))
+
+    def test_key_rotation(self):
+        from ..ticket import createTicketKey
+        new_key = createTicketKey()
+        ticket = self._encode()
+
+        # Tickets signed with an older key remain valid while the key is kept
+        self.assertEqual(self._decode(ticket, [new_key, self.key]),
+                         SESSION_INFO)
+        self.assertIsNone(self._decode(ticket, [new_key]))
+
+        # A different secret with the same key ID is rejected
+        self.assertIsNone(self._decode(ticket, [(self.key[0], new_key[1])]))
+
+
+class PluginTicketTests(PluginTestCase):
+
+    def _getTargetClass(self):
+        from ..PluginBase import SAML2PluginBase
+        return SAML2PluginBase
+
+    def _makePlugin(self, encrypt=False):
+        plugin = self._makeOne('test1')
+        self._create_valid_configuration(plugin)
+        plugin.credential_storage = 'ticket'
+        plugin.ticket_encrypt = encrypt
+        return plugin
+
+    def _login(self, plugin, request, **kw):
+        """ Issue a ticket and send the cookie with the next request """
+        now = time.time()
+        session_info = dict(SESSION_INFO, last_active=int(now),
+                            login_time=now)
+        session_info.update(kw)
+        plugin.setSessionInfo(request, session_info)
+        cookie_name = plugin.getTicketCookieName()
+        request.cookies[cookie_name] = \
+            request.RESPONSE.cookies[cookie_name]['value']
+        request.expire_cache()
+        return session_info
+
+    def test_setSessionInfo(self):
+        plugin = self._makePlugin()
+        req = DummyRequest()
+        req.set('SERVER_URL', 'https://zope.example.com')
+        session_info = self._login(plugin, req)
+
+        cookie = req.RESPONSE.cookies['__saml2_test1']
+        self.assertTrue(cookie['http_only'])
+        self.assertTrue(cookie['secure'])
+        self.assertEqual(cookie['path'], '/')
+        self.assertEqual(plugin.getSessionInfo(req), session_info)
+
+        # Nothing is stored in the session
+        self.assertFalse(req.SESSION)
+
+    def test_setSessionInfo_too_large(self):
+        plugin = self._makePlugin(encrypt=True)
+        req = DummyRequest()
+        session_info = dict(SESSION_INFO, blob=str(list(range(5000))))
+        plugin.setSessionInfo(req, session_info)
+
+        # The Zope session is used as fallback
+        self.assertFalse(req.RESPONSE.cookies)
+        self.assertEqual(req.SESSION[plugin._uid], session_info)
+        self.assertEqual(plugin.getSessionInfo(req), session_info)
+
+    def test_setSessionInfo_too_large_replaces_ticket(self):
+        plugin = self._makePlugin()
+        req = DummyRequest()
+        self._login(plugin, req, mail='old@example.com')
+        req.RESPONSE.cookies.clear()
+
+        session_info = dict(SESSION_INFO, blob=str(list(range(5000))))
+        plugin.setSessionInfo(req, session_info)
+
+        # The old ticket is expired, so it cannot shadow the session
+        self.assertEqual(req.RESPONSE.cookies['__saml2_test1']['max_age'], 0)
+        self.assertEqual(plugin.getSessionInfo(req), session_info)
+
+        # The next request doesn't send the expired cookie
+        del req.cookies['__saml2_test1']
+        req.expire_cache()
+        self.assertEqual(plugin.getSessionInfo(req), session_info)
+
+    def test_plugin_interfaces(self):
+        plugin = self._makePlugin(encrypt=True)
+        plugin.assign_roles = ['role1']
+        req = DummyRequest()
+        user = DummyUser('testuser')
+        self._login(plugin, req)
+
+        self.assertEqual(plugin.extractCredentials(req)['login'], 'testuser')
+        self.assertEqual(
+            plugin.getPropertiesForUser(user, req)['mail'],
+            'testuser@example.com')
+        self.assertEqual(plugin.getRolesForPrincipal(user, req), ('role1',))
+
+        # An expired ticket is not accepted
+        self._login(plugin, req, last_active=0)
+        self.assertNotIn('login', plugin.extractCredentials(req))
+
+        # A ticket signed with an unknown key is ignored
+        self._login(plugin, req)
+        plugin._ticket_keys = ()
+        req.expire_cache()
+        self.assertNotIn('login', plugin.extractCredentials(req))
+        self.assertEqual(plugin.getPropertiesForUser(user, req), {})
+
+    def test_activity_update(self):
+        plugin = self._makePlugin()
+        req = DummyRequest()
+        self._login(plugin, req, last_active=int(time.time()) - 3600)
+        req.RESPONSE.cookies.clear()
+
+        # An outdated activity marker leads to a new ticket
+        plugin.extractCredentials(req)
+        ticket = req.RESPONSE.cookies['__saml2_test1']['value']
+        self.assertNotEqual(ticket, req.cookies['__saml2_test1'])
+
+    def test_resetCredentials(self):
+        plugin = self._makePlugin()
+        req = DummyRequest()
+        self._login(plugin, req)
+        plugin.resetCredentials(req, req.RESPONSE)
+        self.assertEqual(req.RESPONSE.cookies['__saml2_test1']['max_age'], 0)
+
+    def test_resetCredentials_replay(self):
+        plugin = self._makePlugin()
+        req = DummyRequest()
+        self._login(plugin, req, last_active=int(time.time()) - 3600)
+        ticket = req.cookies['__saml2_test1']
+
+        # Another browser uses a copy of the ticket
+        other_req = DummyRequest()
+        other_req.cookies['__saml2_test1'] = ticket
+        self.assertEqual(plugin.extractCredentials(other_req)['login'],
+                         'testuser')
+
+        plugin.resetCredentials(req, req.RESPONSE)
+
+        # The copy is rejected after logout, and so is the ticket issued
+        # for it by the activity update
+        refreshed = other_req.RESPONSE.cookies['__saml2_test1']['value']
+        for replayed in (ticket, refreshed):
+            replay_req = DummyRequest()
+            replay_req.cookies['__saml2_test1'] = replayed
+            self.assertNotIn('login', plugin.extractCredentials(replay_req))
+
+        # Logging in again works
+        self._login(plugin, req)
+        self.assertEqual(plugin.extractCredentials(req)['login'], 'testuser')
+
+    def test_ticket_max_lifetime(self):
+        plugin = self._makePlugin()
+        req = DummyRequest()
+
+        # Activity updates do not extend a ticket beyond its lifetime
+        self._login(plugin, req, login_time=time.time() - 23 * 3600)
+        self.assertEqual(plugin.extractCredentials(req)['login'], 'testuser')
+        self._login(plugin, req, login_time=time.time() - 25 * 3600)
+        self.assertNotIn('login', plugin.extractCredentials(req))
+        self.assertIsNone(plugin.getSessionInfo(req))
+
+        plugin.ticket_max_lifetime = 48
+        req.expire_cache()
+        self.assertEqual(plugin.extractCredentials(req)['login'], 'testuser')
+
+        # Tickets without login time are not accepted
+        self._login(plugin, req, login_time=None)
+        self.assertNotIn('login', plugin.extractCredentials(req))
+
+    def test_manage_rotateTicketKeys(self):
+        from ..ticket import TICKET_KEYS_KEPT
+        plugin = self._makePlugin()
+        req = DummyRequest()
+        self._login(plugin, req)
+        first_key = plugin._ticket_keys[0]
+
+        plugin.manage_rotateTicketKeys()
+        self.assertEqual(plugin._ticket_keys[1], first_key)
+        self.assertEqual(plugin.extractCredentials(req)['login'], 'testuser')
+
+        for i in range(TICKET_KEYS_KEPT):
+            plugin.manage_rotateTicketKeys()
+        req.expire_cache()
+        self.assertEqual(len(plugin._ticket_keys), TICKET_KEYS_KEPT)
+        self.assertNotIn(first_key, plugin._ticket_keys)
+        self.assertNotIn('login', plugin.extractCredentials(req))
+
+    def test_missing_keys(self):
+        # Instances created before ticket support have no keys
+        plugin = self._makePlugin()
+        plugin._ticket_keys = ()
+        req = DummyRequest()
+        self._login(plugin, req)
+        self.assertEqual(len(plugin._ticket_keys), 1)
+        self.assertEqual(plugin.extractCredentials(req)['login'], 'testuser')
+
+
+class TicketBenchmarkTests(PluginTestCase):
+    """ Per-request authentication overhead of both storage modes """
+
+    ROUNDS = 1000
+
+    def _getTargetClass(self):
+        from ..PluginBase import SAML2PluginBase
+        return SAML2PluginBase
+
+    def _run(self, plugin, req):
+        user = DummyUser('testuser')
+        start = time.perf_counter()
+        for i in range(self.ROUNDS):
+            req.expire_cache()  # Each round is a new request
+            plugin.extractCredentials(req)
+            plugin.getPropertiesForUser(user, req)
+            plugin.getRolesForPrincipal(user, req)
+        return (time.perf_counter() - start) / self.ROUNDS
+
+    def test_per_request_overhead(self):
+        plugin = self._makeOne('test1')
+        self._create_valid_configuration(plugin)
+        session_info = dict(SESSION_INFO, last_active=int(time.time()))
+
+        session_req = DummyRequest()
+        session_req.SESSION.set(plugin._uid, dict(session_info))
+        session_time = self._run(plugin, session_req)
+
+        plugin.credential_storage = 'ticket'
+        ticket_times = []
+        for encrypt in (False, True):
+            plugin.ticket_encrypt = encrypt
+            ticket_req = DummyRequest()
+            plugin.setSessionInfo(ticket_req, dict(session_info))
+            ticket_req.cookies['__saml2_test1'] = \
+                ticket_req.RESPONSE.cookies['__saml2_test1']['value']
+            ticket_times.append(self._run(plugin, ticket_req))
+
+        # The in-memory session used here is free, a real session costs
+        # a storage round trip. Verifying the ticket three times must stay
+        # well below one millisecond per request.
+        self.assertLess(session_time, 0.001)
+        for ticket_time in ticket_times:
+            self.assertLess(ticket_time, 0.001)
@@ -0,0 +1,199 @@
+##############################################################################
+#
+# Copyright (c) 2023 Jens Vagelpohl and Contributors. All Rights Reserved.
+#
+# This software is subject to the provisions of the Zope Public License,
+# Version 2.1 (ZPL).  A copy of the ZPL should accompany this distribution.
+# THIS SOFTWARE IS PROVIDED "AS IS" AND ANY AND ALL EXPRESS OR IMPLIED
+# WARRANTIES ARE DISCLAIMED, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF TITLE, MERCHANTABILITY, AGAINST INFRINGEMENT, AND FITNESS
+# FOR A PARTICULAR PURPOSE.
+#
+##############################################################################
+""" Tests for the persistent user directory
+"""
+
+import unittest
+from unittest.mock import MagicMock
+from unittest.mock import patch
+
+import transaction
+from ZODB.DB import DB
+from ZODB.MappingStorage import MappingStorage
+
+from .base import PluginTestCase
+from .dummy import DummyNameId
+from .dummy import DummyPySAML2Client
+from .dummy import DummySAMLResponse
+from .dummy import DummyUser
+
+
+class UserDirectoryTests(unittest.TestCase):
+
+    def _makeOne(self):
+        from ..userdirectory import UserDirectory
+        directory = UserDirectory()
+        directory.updateUser('jdoe', {'mail': 'jdoe@example.com'},
+                             email='JDoe@example.com', fullname='John Doe')
+        directory.updateUser('jane', {}, email='jane@example.org',
+                             fullname='Jane Doe')
+        directory.updateUser('bob', {}, login='Bob', fullname='Bob Smith')
+        return directory
+
+    def test_getUser(self):
+        directory = self._makeOne()
+        self.assertEqual(len(directory), 3)
+        self.assertEqual(directory.getUser('jdoe'),
+                         {'login': 'jdoe',
+                          'email': 'JDoe@example.com',
+                          'fullname': 'John Doe',
+                          'properties': {'mail': 'jdoe@example.com'}})
+        self.assertIsNone(directory.getUser('unknown'))
+
+    def test_search(self):
+        directory = self._makeOne()
+        self.assertEqual(directory.search(), ['bob', 'jane', 'jdoe'])
+        self.assertEqual(directory.search(login='j'), ['jane', 'jdoe'])
+        self.assertEqual(directory.search(login='BOB', exact_match=True),
+                         ['bob'])
+        self.assertEqual(directory.search(login='bo', exact_match=True), [])
+        self.assertEqual(directory.search(email='jdoe@'), ['jdoe'])
+        self.assertEqual(directory.search(fullname='jane doe',
+                                          exact_match=True), ['jane'])
+        self.assertEqual(directory.search(fullname='j'), ['jane', 'jdoe'])
+        self.assertEqual(directory.search(fullname='j', email='jane'),
+                         ['jane'])
+        self.assertEqual(directory.search(fullname='x', email='jane'), [])
+
+        # Limited results are the first user IDs in sort order
+        self.assertEqual(directory.search(limit=2), ['bob', 'jane'])
+        self.assertEqual(directory.search(login='j', limit=1), ['jane'])
+
+    def test_updateUser(self):
+        directory = self._makeOne()
+        self.assertFalse(directory.updateUser(
+            'jane', {}, email='jane@example.org', fullname='Jane Doe'))
+        self.assertTrue(directory.updateUser(
+            'jane', {}, email='jane@example.com', fullname='Jane Doe'))
+        self.assertEqual(directory.search(email='jane@example.org'), [])
+        self.assertEqual(directory.search(email='jane@example.com'),
+                         ['jane'])
+        self.assertNotIn('jane@example.org', directory._indexes['email'])
+
+    def test_removeUser(self):
+        directory = self._makeOne()
+        directory.removeUser('jdoe')
+        directory.removeUser('unknown')
+        self.assertEqual(directory.search(), ['bob', 'jane'])
+        self.assertEqual(directory.search(fullname='john'), [])
+        self.assertNotIn('john doe', directory._indexes['fullname'])
+
+    def test_unchanged_no_write(self):
+        db = DB(MappingStorage())
+        conn = db.open()
+        try:
+            conn.root()['directory'] = directory = self._makeOne()
+            transaction.commit()
+
+            directory.updateUser('jane', {}, email='jane@example.org',
+                                 fullname='Jane Doe')
+            self.assertFalse(conn._registered_objects)
+
+            directory.updateUser('jane', {'cn': 'Jane'},
+                                 email='jane@example.org',
+                                 fullname='Jane Doe')
+            self.assertTrue(conn._registered_objects)
+        finally:
+            transaction.abort()
+            conn.close()
+            db.close()
+
+
+class PluginUserDirectoryTests(PluginTestCase):
+
+    def _getTargetClass(self):
+        from ..PluginBase import SAML2PluginBase
+        return SAML2PluginBase
+
+    def _login(self, plugin, uid, **attributes):
+        identity = {'uid': [uid]}
+        identity.update({key: [value] for key, value in attributes.items()})
+        saml_response = DummySAMLResponse(subject=DummyNameId(uid),
+                                          issuer='https://idp',
+                                          identity=identity)
+        dummy_client = DummyPySAML2Client(parse_result=saml_response)
+        plugin.getPySAML2Client = MagicMock(return_value=dummy_client)
+        return plugin.handleACSRequest(saml_response)
+
+    def test_disabled(self):
+        plugin = self._makeOne('test')
+        self._create_valid_configuration(plugin)
+        plugin.login_attribute = 'uid'
+        self._login(plugin, 'jdoe', mail='jdoe@example.com')
+
+        self.assertIsNone(plugin._user_directory)
+        self.assertEqual(plugin.enumerateUsers(), ())
+        self.assertEqual(plugin.getPropertiesForUser(DummyUser('jdoe')), {})
+
+    def test_enumerateUsers(self):
+        plugin = self._makeOne('test')
+        self._create_valid_configuration(plugin)
+        plugin.login_attribute = 'uid'
+        plugin.user_directory = True
+        self._login(plugin, 'jdoe', mail='jdoe@example.com',
+                    displayName='John Doe')
+        self._login(plugin, 'jane', mail='jane@example.org',
+                    displayName='Jane Doe')
+        self._login(plugin, 'bob', displayName='Bob Smith')
+
+        self.assertEqual([info['id'] for info in plugin.enumerateUsers()],
+                         ['bob', 'jane', 'jdoe'])
+        self.assertEqual(plugin.enumerateUsers(id='jdoe', exact_match=True),
+                         ({'id': 'jdoe',
+                           'login': 'jdoe',
+                           'email': 'jdoe@example.com',
+                           'fullname': 'John Doe',
+                           'pluginid': 'test'},))
+        self.assertEqual(
+            [info['id'] for info in plugin.enumerateUsers(login='j')],
+            ['jane', 'jdoe'])
+        self.assertEqual(
+            [info['id'] for info in plugin.enumerateUsers(id=['bob', 'jane'],
+                                                          exact_match=True)],
+            ['bob', 'jane'])
+        self.assertEqual(
+            [info['id'] for info in plugin.enumerateUsers(email='jane@')],
+            ['jane'])
+        self.assertEqual(
+            [info['id'] for info in plugin.enumerateUsers(fullname='j',
+                                                          sort_by='email')],
+            ['jane', 'jdoe'])
+        self.assertEqual(len(plugin.enumerateUsers(max_results=2)), 2)
+        self.assertEqual(
+            [info['id'] for info in plugin.enumerateUsers(sort_by='fullname',
+                                                          max_results=2)],
+            ['bob', 'jane'])
+        self.assertEqual(
+            [info['id'] for info in plugin.enumerateUsers(login='j',
+                                                          max_results=1)],
+            ['jane'])
+
+        # Only the returned records are read
+        directory = plugin._user_directory
+        with patch.object(directory, 'getUser',
+                          wraps=directory.getUser) as getUser:
+            plugin.enumerateUsers(max_results=1)
+            plugin.enumerateUsers(login='j', max_results=1)
+        self.assertEqual(getUser.call_count, 2)
+        self.assertEqual(plugin.enumerateUsers(login='j', fullname='bob'), ())
+
+        # Properties are available without a login session
+        properties = plugin.getPropertiesForUser(DummyUser('jane'))
+        self.assertEqual(properties['mail'], 'jane@example.org')
+        self.assertNotIn('last_active', properties)
+        self.assertEqual(plugin.getPropertiesForUser(DummyUser('x')), {})
+
+        # Logging in again without changes does not change the directory
+        self.assertFalse(plugin.updateUserDirectory(
+            self._login(plugin, 'jane', mail='jane@example.org',
+                        displayName='Jane Doe')))
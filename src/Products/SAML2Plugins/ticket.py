@@ -0,0 +1,144 @@
+##############################################################################
+#
+# Copyright (c) 2023 Jens Vagelpohl and Contributors. All Rights Reserved.
+#
+# This software is subject to the provisions of the Zope Public License,
+# Version 2.1 (ZPL).  A copy of the ZPL should accompany this distribution.
+# THIS SOFTWARE IS PROVIDED "AS IS" AND ANY AND ALL EXPRESS OR IMPLIED
+# WARRANTIES ARE DISCLAIMED, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF TITLE, MERCHANTABILITY, AGAINST INFRINGEMENT, AND FITNESS
+# FOR A PARTICULAR PURPOSE.
+#
+##############################################################################
+""" Signed and optionally encrypted credential tickets
+
+A ticket carries the user session information in a cookie value::
+
+    <version>.<key ID>.<s|e>.<payload>.<signature>
+
+The payload is the compressed JSON representation of the session
+information, encrypted with AES-GCM if the third field is ``e``. The
+signature is a HMAC-SHA256 over everything preceding it. Both the signing
+and the encryption key are derived from a random per-plugin secret, which
+is identified by the key ID so secrets can be rotated.
+"""
+
+import base64
+import binascii
+import functools
+import hashlib
+import hmac
+import json
+import logging
+import os
+import secrets
+import zlib
+
+from cryptography.exceptions import InvalidTag
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+
+
+logger = logging.getLogger('Products.SAML2Plugins')
+
+TICKET_VERSION = '1'
+TICKET_KEYS_KEPT = 3
+
+# Browsers drop cookies larger than 4096 bytes including name and attributes
+TICKET_MAX_SIZE = 3800
+
+
+def createTicketKey():
+    """ Create a new random ticket key
+
+    Returns:
+        A tuple of key ID and secret
+    """
+    return (secrets.token_hex(4), secrets.token_bytes(32))
+
+
+@functools.lru_cache(maxsize=64)
+def _derive_key(secret, purpose):
+    return hmac.new(secret, purpose, hashlib.sha256).digest()
+
+
+def _b64encode(data):
+    return base64.urlsafe_b64encode(data).rstrip(b'=').decode('ascii')
+
+
+def _b64decode(text):
+    return base64.urlsafe_b64decode(text + '=' * (-len(text) % 4))
+
+
+def _signature(secret, signed):
+    mac = hmac.new(_derive_key(secret, b'sign'), signed.encode('ascii'),
+                   hashlib.sha256)
+    return _b64encode(mac.digest())
+
+
+def encodeTicket(data, key, encrypt=False):
+    """ Create a ticket from session information
+
+    Args:
+        data (dict): JSON-serializable session information
+
+        key (tuple): Key ID and secret as returned by ``createTicketKey``
+
+    Kwargs:
+        encrypt (bool): Encrypt the payload in addition to signing it
+
+    Returns:
+        The ticket string
+    """
+    key_id, secret = key
+    header = f'{TICKET_VERSION}.{key_id}.{"e" if encrypt else "s"}'
+    payload = zlib.compress(
+        json.dumps(data, separators=(',', ':')).encode('utf-8'))
+
+    if encrypt:
+        nonce = os.urandom(12)
+        aesgcm = AESGCM(_derive_key(secret, b'encrypt'))
+        payload = nonce + aesgcm.encrypt(nonce, payload,
+                                         header.encode('ascii'))
+
+    signed = f'{header}.{_b64encode(payload)}'
+    return f'{signed}.{_signature(secret, signed)}'
+
+
+def decodeTicket(ticket, keys):
+    """ Verify a ticket and return the session information it carries
+
+    Args:
+        ticket (str): The ticket string
+
+        keys (iterable): Key ID and secret tuples that are accepted
+
+    Returns:
+        The session information mapping or None if the ticket is invalid
+    """
+    try:
+        version, key_id, mode, payload, signature = ticket.split('.')
+    except (AttributeError, ValueError):
+        return None
+
+    secret = dict(keys).get(key_id)
+    if version != TICKET_VERSION or secret is None:
+        logger.debug(f'decodeTicket: Unknown ticket key {key_id}')
+        return None
+
+    signed = ticket[:-len(signature) - 1]
+    if not hmac.compare_digest(_signature(secret, signed), signature):
+        logger.warning('decodeTicket: Invalid ticket signature')
+        return None
+
+    try:
+        payload = _b64decode(payload)
+        if mode == 'e':
+            aesgcm = AESGCM(_derive_key(secret, b'encrypt'))
+            header = f'{version}.{key_id}.{mode}'.encode('ascii')
+            payload = aesgcm.decrypt(payload[:12], payload[12:], header)
+        data = json.loads(zlib.decompress(payload))
+    except (binascii.Error, InvalidTag, ValueError, zlib.error) as exc:
+        logger.warning(f'decodeTicket: Cannot decode ticket: {exc}')
+        return None
+
+    return data if isinstance(data, dict) else None
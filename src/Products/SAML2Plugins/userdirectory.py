@@ -0,0 +1,191 @@
+##############################################################################
+#
+# Copyright (c) 2023 Jens Vagelpohl and Contributors. All Rights Reserved.
+#
+# This software is subject to the provisions of the Zope Public License,
+# Version 2.1 (ZPL).  A copy of the ZPL should accompany this distribution.
+# THIS SOFTWARE IS PROVIDED "AS IS" AND ANY AND ALL EXPRESS OR IMPLIED
+# WARRANTIES ARE DISCLAIMED, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF TITLE, MERCHANTABILITY, AGAINST INFRINGEMENT, AND FITNESS
+# FOR A PARTICULAR PURPOSE.
+#
+##############################################################################
+""" Persistent directory of users who have logged in through a plugin
+"""
+
+import heapq
+from itertools import islice
+
+from BTrees.OOBTree import OOBTree
+from BTrees.OOBTree import OOTreeSet
+from Persistence import Persistent
+
+
+# Index name and the record key holding the indexed value
+INDEXES = (('login', 'login'),
+           ('email', 'email'),
+           ('fullname', 'fullname'))
+
+
+def firstUserIds(user_ids, limit=None):
+    """ Get the first user IDs in sort order
+
+    Args:
+        user_ids (iterable): User IDs
+
+    Kwargs:
+        limit (int or None): Return at most this many user IDs
+
+    Returns:
+        A sorted list of user IDs
+    """
+    if limit:
+        return heapq.nsmallest(limit, user_ids)
+    return sorted(user_ids)
+
+
+class UserDirectory(Persistent):
+    """ Users and their properties in a BTree with secondary indexes
+
+    The secondary indexes map lower-cased login, email and display name
+    values to the IDs of all users with that value, so exact and prefix
+    searches are BTree key lookups and range scans.
+    """
+
+    def __init__(self):
+        self._users = OOBTree()
+        self._indexes = {name: OOBTree() for name, _ in INDEXES}
+
+    def __len__(self):
+        return len(self._users)
+
+    def getUser(self, user_id):
+        """ Get the record for a user
+
+        Args:
+            user_id (str): The user ID
+
+        Returns:
+            A dictionary with keys ``login``, ``email``, ``fullname`` and
+            ``properties``, or None
+        """
+        return self._users.get(user_id)
+
+    def updateUser(self, user_id, properties, login=None, email='',
+                   fullname=''):
+        """ Add or update a user record
+
+        Nothing is written to the database if the record has not changed.
+
+        Args:
+            user_id (str): The user ID
+
+            properties (dict): The user properties
+
+        Kwargs:
+            login (str): The login name, defaults to the user ID
+
+            email (str): The email address for the email index
+
+            fullname (str): The display name for the display name index
+
+        Returns:
+            True if the record was changed, False otherwise
+        """
+        record = {'login': login or user_id,
+                  'email': email or '',
+                  'fullname': fullname or '',
+                  'properties': dict(properties)}
+        old_record = self._users.get(user_id)
+        if old_record == record:
+            return False
+
+        for index_name, key in INDEXES:
+            old_value = old_record[key] if old_record else ''
+            if old_value != record[key]:
+                self._unindex(index_name, old_value, user_id)
+                self._index(index_name, record[key], user_id)
+        self._users[user_id] = record
+
+        return True
+
+    def removeUser(self, user_id):
+        """ Remove a user record
+
+        Args:
+            user_id (str): The user ID
+        """
+        record = self._users.get(user_id)
+        if record is None:
+            return
+
+        for index_name, key in INDEXES:
+            self._unindex(index_name, record[key], user_id)
+        del self._users[user_id]
+
+    def search(self, exact_match=False, limit=None, **criteria):
+        """ Search for users
+
+        Criteria are matched against the lower-cased index values. All
+        given criteria must match.
+
+        Kwargs:
+            exact_match (bool): Match whole values instead of prefixes
+
+            limit (int or None): Return at most this many user IDs
+
+            login, email, fullname (str): Search values for the indexes
+
+        Returns:
+            A sorted list of user IDs
+        """
+        result = None
+        for index_name, _ in INDEXES:
+            value = criteria.get(index_name)
+            if not value:
+                continue
+            user_ids = self._lookup(index_name, value.lower(), exact_match)
+            if result is None:
+                result = user_ids
+            else:
+                result &= user_ids
+            if not result:
+                break
+
+        if result is None:
+            # Stop reading the BTree at the limit
+            return list(islice(self._users.keys(), limit))
+        return firstUserIds(result, limit)
+
+    def _lookup(self, index_name, value, exact_match):
+        index = self._indexes[index_name]
+        if exact_match:
+            return set(index.get(value, ()))
+
+        user_ids = set()
+        for key, ids in index.items(min=value):
+            if not key.startswith(value):
+                break
+            user_ids.update(ids)
+        return user_ids
+
+    def _index(self, index_name, value, user_id):
+        if not value:
+            return
+        index = self._indexes[index_name]
+        value = value.lower()
+        ids = index.get(value)
+        if ids is None:
+            ids = index[value] = OOTreeSet()
+        ids.insert(user_id)
+
+    def _unindex(self, index_name, value, user_id):
+        if not value:
+            return
+        index = self._indexes[index_name]
+        value = value.lower()
+        ids = index.get(value)
+        if ids is not None and user_id in ids:
+            ids.remove(user_id)
+            if not ids:
+                del index[value]